@@ -2,9 +2,22 @@ __AUTHOR__ = 'KAAAsS'
 __LICENSE__ = "MIT"
 __VERSION__ = "1.1.5"
 
-from beancount_bot import builtin
-from beancount_bot import dispatcher
-from beancount_bot import task
-from beancount_bot import transaction
-from beancount_bot import util
-from beancount_bot.main import main
+import importlib
+
+# Imported when first used, so that the command line and setup.py do not load beancount and telebot
+_LAZY_MODULES = ['builtin', 'dispatcher', 'task', 'transaction', 'util']
+
+
+def __getattr__(name: str):
+    if name in _LAZY_MODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _LAZY_MODULES)
+
+
+# The entry point. main only imports click, the bot modules are imported when serving.
+# Imported after the submodule is loaded, so that beancount_bot.main is always the function
+from beancount_bot.main import main  # noqa: E402
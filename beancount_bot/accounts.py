@@ -0,0 +1,226 @@
+import datetime
+import difflib
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from beancount.core.data import Open, Close, Transaction, Directive
+
+from beancount_bot.config import get_config_obj, get_global, lookup, GLOBAL_ACCOUNTS
+from beancount_bot.i18n import _
+from beancount_bot.ledger import Ledger, get_ledger
+from beancount_bot.util import logger
+
+# Seconds between checks of the main ledger for new Open/Close directives
+REFRESH_INTERVAL = 1.0
+
+
+class _Node:
+    """
+    Node of the account trie. A node is an account if it was opened
+    """
+    __slots__ = ('children', 'opened', 'closed')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.opened: Optional[datetime.date] = None
+        self.closed: Optional[datetime.date] = None
+
+
+class AccountTrie:
+    """
+    Accounts indexed by their components, e.g. Expenses -> Food -> Drink
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+
+    def add(self, account: str, opened: datetime.date, closed: Optional[datetime.date] = None):
+        """
+        Add an account
+        :param account:
+        :param opened: Date of the Open directive
+        :param closed: Date of the Close directive
+        :return:
+        """
+        node = self.root
+        for component in account.split(':'):
+            node = node.children.setdefault(component, _Node())
+        if node.opened is None:
+            self.size += 1
+        node.opened = opened
+        node.closed = closed
+
+    def find(self, account: str) -> Optional[_Node]:
+        """
+        Find the node of an account
+        :param account:
+        :return: None if no account has this name or prefix
+        """
+        node = self.root
+        for component in account.split(':'):
+            node = node.children.get(component)
+            if node is None:
+                return None
+        return node
+
+    def is_open(self, account: str, date: datetime.date) -> bool:
+        """
+        Whether the account is open on the date. As in beancount, postings on the closing date are accepted
+        :param account:
+        :param date:
+        :return:
+        """
+        node = self.find(account)
+        return node is not None and node.opened is not None and node.opened <= date and \
+            (node.closed is None or date <= node.closed)
+
+    def accounts(self, prefix: str = '') -> Iterator[str]:
+        """
+        Accounts in lexicographic order
+        :param prefix: Complete components, e.g. Expenses:Food
+        :return:
+        """
+        node = self.find(prefix) if prefix != '' else self.root
+        if node is None:
+            return
+        stack = [(prefix, node)]
+        while len(stack) > 0:
+            name, node = stack.pop()
+            if node.opened is not None:
+                yield name
+            for component in sorted(node.children.keys(), reverse=True):
+                stack.append((f'{name}:{component}' if name != '' else component, node.children[component]))
+
+    def suggest(self, account: str, n: int = 3) -> List[str]:
+        """
+        Accounts similar to a misspelt one. Every component is matched against the components at its level
+        :param account:
+        :param n:
+        :return:
+        """
+        found = []
+
+        def walk(node: _Node, name: str, components: List[str]):
+            if len(found) >= n:
+                return
+            if len(components) == 0:
+                if node.opened is not None:
+                    found.append(name)
+                return
+            component, rest = components[0], components[1:]
+            candidates = [component] if component in node.children else []
+            candidates += [c for c in difflib.get_close_matches(component, node.children.keys(), n, 0.6)
+                           if c != component]
+            for c in candidates:
+                walk(node.children[c], f'{name}:{c}' if name != '' else c, rest)
+
+        walk(self.root, '', account.split(':'))
+        if len(found) == 0:
+            found = difflib.get_close_matches(account, list(self.accounts()), n, 0.6)
+        return found
+
+
+class AccountIndex:
+    """
+    Accounts opened in the main ledger and the files it includes.
+    Open/Close directives are collected again only from files that changed
+    """
+
+    def __init__(self, main_ledger: str, ledger: Ledger):
+        self.main_ledger = main_ledger
+        self.ledger = ledger
+        self.trie: Optional[AccountTrie] = None
+        # path -> (entries, Open/Close directives in them)
+        self._directives: Dict[str, Tuple[List[Directive], List[Directive]]] = {}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False) -> Optional[AccountTrie]:
+        """
+        Reload the accounts if the main ledger changed. Checked at most once per REFRESH_INTERVAL
+        :param force: Check now
+        :return: Account trie. None if the main ledger cannot be read
+        """
+        now = time.monotonic()
+        if not force and now - self._checked < REFRESH_INTERVAL:
+            return self.trie
+        with self._lock:
+            self._checked = now
+            try:
+                tree = self.ledger.load_tree(self.main_ledger)
+            except OSError as e:
+                logger.warning('Unable to read main ledger %s: %s', self.main_ledger, e)
+                return self.trie
+            changed = tree.keys() != self._directives.keys()
+            directives = {}
+            for path, entries in tree.items():
+                cached = self._directives.get(path)
+                if cached is not None and cached[0] is entries:
+                    directives[path] = cached
+                else:
+                    directives[path] = (entries, [e for e in entries if isinstance(e, (Open, Close))])
+                    changed = True
+            self._directives = directives
+            if changed or self.trie is None:
+                self.trie = self._build()
+            return self.trie
+
+    def _build(self) -> AccountTrie:
+        """
+        Build the trie from the collected directives
+        :return:
+        """
+        opened, closed = {}, {}
+        for __, found in self._directives.values():
+            for entry in found:
+                if isinstance(entry, Open):
+                    opened[entry.account] = entry.date
+                else:
+                    closed[entry.account] = entry.date
+        trie = AccountTrie()
+        for account, date in opened.items():
+            trie.add(account, date, closed.get(account))
+        return trie
+
+    def validate(self, tx: Transaction):
+        """
+        Check that the accounts of a transaction are open
+        :param tx:
+        :return:
+        """
+        trie = self.refresh()
+        if trie is None:
+            return
+        for posting in tx.postings:
+            if trie.is_open(posting.account, tx.date):
+                continue
+            node = trie.find(posting.account)
+            if node is not None and node.opened is not None:
+                raise ValueError(_("Account {account} is not open on {date}！")
+                                 .format(account=posting.account, date=tx.date))
+            suggestions = trie.suggest(posting.account)
+            if len(suggestions) > 0:
+                raise ValueError(_("Account {account} does not exist！Did you mean：{suggestions}")
+                                 .format(account=posting.account, suggestions=', '.join(suggestions)))
+            raise ValueError(_("Account {account} does not exist！").format(account=posting.account))
+
+
+def create_accounts(conf: dict, ledger: Ledger) -> Optional[AccountIndex]:
+    """
+    Create the accounts of the main ledger from a configuration
+    :param conf:
+    :param ledger:
+    :return: None if no main ledger is configured
+    """
+    main_ledger = lookup(conf, 'transaction.main_ledger')
+    return AccountIndex(main_ledger, ledger) if main_ledger is not None else None
+
+
+def get_accounts() -> Optional[AccountIndex]:
+    """
+    Get the accounts of the main ledger (transaction.main_ledger)
+    :return: None if no main ledger is configured
+    """
+    return get_global(GLOBAL_ACCOUNTS, lambda: create_accounts(get_config_obj(), get_ledger()))
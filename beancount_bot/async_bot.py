@@ -0,0 +1,345 @@
+import asyncio
+import functools
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Message, CallbackQuery, InlineQuery
+
+from beancount_bot import bot as sync_bot, metrics, transaction
+from beancount_bot.config import get_config
+from beancount_bot.i18n import _
+from beancount_bot.reload import reload_config
+from beancount_bot.session import get_session, SESS_AUTH, set_session
+from beancount_bot.task import get_task, trigger_task
+from beancount_bot.transaction import get_manager
+from beancount_bot.util import logger
+
+bot = AsyncTeleBot(token=None, parse_mode=None)
+
+_executor: ThreadPoolExecutor = None
+
+
+async def run_io(func: callable, *args, **kwargs):
+    """
+    Run blocking ledger or session I/O in the executor, so that it does not stall other updates
+    :param func:
+    :param args:
+    :param kwargs:
+    :return:
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+#######
+# Authentication #
+#######
+
+def check_auth(uid: int) -> bool:
+    """
+    Check if you log in
+    :param uid:
+    :return:
+    """
+    return get_session(uid, SESS_AUTH, False)
+
+
+@bot.message_handler(commands=['start'])
+@metrics.timed
+async def start_handler(message: Message):
+    """
+    First chat time authentication
+    :param message:
+    :return:
+    """
+    if check_auth(message.from_user.id):
+        await bot.reply_to(message, _("Have been authenticated！"))
+        return
+    # 要求鉴权
+    await bot.reply_to(message, _("Welcome to the accounting robot!Please enter the authentication token:"))
+
+
+async def auth_token_handler(message: Message):
+    """
+    Login token callback
+    :param message:
+    :return:
+    """
+    # Unconfirmation is considered an authentication token
+    auth_token = get_config('bot.auth_token')
+    if auth_token == message.text:
+        await run_io(set_session, message.from_user.id, SESS_AUTH, True)
+        await bot.reply_to(message, _("Authentic success！"))
+    else:
+        await bot.reply_to(message, _("Authentication token error！"))
+
+
+#######
+# instruction #
+#######
+
+
+@bot.message_handler(commands=['reload'])
+@metrics.timed
+async def reload_handler(message: Message):
+    """
+    Overload configuration instruction
+    :param message:
+    :return:
+    """
+    if not check_auth(message.from_user.id):
+        await bot.reply_to(message, _("Please conduct authentication first！"))
+        return
+    changes = await run_io(reload_config)
+    await bot.reply_to(message, sync_bot.reload_message(changes))
+
+
+@bot.message_handler(commands=['help'])
+@metrics.timed
+async def help_handler(message: Message):
+    """
+    Help instruction
+    :param message:
+    :return:
+    """
+    cmd = message.text
+    dispatchers = (await run_io(get_manager)).dispatchers
+    if cmd == '/help':
+        help_text, markup = sync_bot.help_message(dispatchers)
+        await bot.reply_to(message, help_text, reply_markup=markup)
+    else:
+        # Display detailed help
+        found = sync_bot.find_dispatchers(dispatchers, cmd[6:])
+        for d in found:
+            await bot.reply_to(message, sync_bot.usage_message(d))
+        if len(found) == 0:
+            await bot.reply_to(message, _("The corresponding name of the transaction statement processor does not exist！"))
+
+
+@bot.callback_query_handler(func=lambda call: call.data[:4] == 'help')
+@metrics.timed
+async def callback_help(call: CallbackQuery):
+    """
+    Help statement detailed help
+    :param call:
+    :return:
+    """
+    try:
+        d_id = int(call.data[5:])
+        dispatchers = (await run_io(get_manager)).dispatchers
+        await bot.reply_to(call.message, sync_bot.usage_message(dispatchers[d_id]))
+    except Exception as e:
+        logger.error(f'{call.id}：Unknown error！', e)
+        logger.error(traceback.format_exc())
+        await bot.answer_callback_query(call.id, _("Unknown error！\n" + traceback.format_exc()))
+
+
+@bot.message_handler(commands=['task'])
+@metrics.timed
+async def task_handler(message: Message):
+    """
+    Task instruction
+    :param message:
+    :return:
+    """
+    if not check_auth(message.from_user.id):
+        await bot.reply_to(message, _("Please conduct authentication first!"))
+        return
+
+    cmd = message.text
+    tasks = await run_io(get_task)
+    if cmd == '/task':
+        # Show all tasks
+        await bot.reply_to(message, sync_bot.task_list_message(tasks))
+    else:
+        # Run task
+        dest = cmd[6:]
+        if dest not in tasks:
+            await bot.reply_to(message, _("Task does not exist！"))
+            return
+        # 任务基于同步 Bot 实现
+        if not await run_io(trigger_task, tasks[dest], sync_bot.bot):
+            await bot.reply_to(message, _("Task is still running!"))
+
+
+@bot.message_handler(commands=['profile'])
+@metrics.timed
+async def profile_handler(message: Message):
+    """
+    Profiling instruction
+    :param message:
+    :return:
+    """
+    if not check_auth(message.from_user.id):
+        await bot.reply_to(message, _("Please conduct authentication first!"))
+        return
+    result = await run_io(sync_bot.profile_command, message.text[len('/profile'):].strip())
+    if isinstance(result, bytes):
+        await bot.send_document(message.chat.id, result, reply_to_message_id=message.message_id,
+                                visible_file_name=sync_bot.PSTATS_FILE_NAME)
+        return
+    for text in result:
+        await bot.reply_to(message, text)
+
+
+#######
+# Completion #
+#######
+
+
+@bot.inline_handler(func=lambda query: True)
+@metrics.timed
+async def inline_query_handler(query: InlineQuery):
+    """
+    Suggest trading statements while typing
+    :param query:
+    :return:
+    """
+    if not check_auth(query.from_user.id):
+        await bot.answer_inline_query(query.id, [], cache_time=0, is_personal=True)
+        return
+    try:
+        manager = await run_io(get_manager)
+        results = sync_bot.inline_results(sync_bot.complete(manager.dispatchers, query.query))
+        await bot.answer_inline_query(query.id, results, cache_time=0, is_personal=True)
+    except Exception as e:
+        logger.error(f'{query.id}：Unknown error！', e)
+        logger.error(traceback.format_exc())
+
+
+#######
+# trade #
+#######
+
+
+@bot.message_handler(func=lambda m: True)
+@metrics.timed
+async def transaction_query_handler(message: Message):
+    """
+    Trading statement processing
+    :param message:
+    :return:
+    """
+    if not check_auth(message.from_user.id):
+        await auth_token_handler(message)
+        return
+    if sync_bot.is_partial_completion(message):
+        return
+    if sync_bot.is_batch(message.text):
+        await batch_transaction_handler(message)
+        return
+    # Treated
+    try:
+        manager = await run_io(get_manager)
+        tx_uuid, tx = await run_io(manager.create_from_str, message.text)
+        # 回复
+        await bot.reply_to(message, transaction.stringfy(tx), reply_markup=sync_bot.withdraw_markup(tx_uuid))
+    except ValueError as e:
+        logger.info(f'{message.from_user.id}：Unable to add transactions', e)
+        await bot.reply_to(message, e.args[0])
+    except Exception as e:
+        logger.error(f'{message.from_user.id}：An unknown mistake!Adding a transaction failed.', e)
+        await bot.reply_to(message, _("An unknown mistake!Adding a transaction failed.\n" + traceback.format_exc()))
+
+
+async def batch_transaction_handler(message: Message):
+    """
+    Processing of a trading statement per line
+    :param message:
+    :return:
+    """
+    try:
+        single, batch_uuid, results = await run_io(sync_bot.create_lines, message.text)
+        if single is not None:
+            tx_uuid, tx = single
+            await bot.reply_to(message, transaction.stringfy(tx), reply_markup=sync_bot.withdraw_markup(tx_uuid))
+            return
+        texts, markup = sync_bot.batch_message(batch_uuid, results)
+        for text in texts[:-1]:
+            await bot.reply_to(message, text)
+        await bot.reply_to(message, texts[-1], reply_markup=markup)
+    except Exception as e:
+        logger.error(f'{message.from_user.id}：An unknown mistake!Adding a transaction failed.', e)
+        await bot.reply_to(message, _("An unknown mistake!Adding a transaction failed.\n" + traceback.format_exc()))
+
+
+@bot.message_handler(content_types=['document'])
+@metrics.timed
+async def import_handler(message: Message):
+    """
+    Import an uploaded statement
+    :param message:
+    :return:
+    """
+    if not check_auth(message.from_user.id):
+        await bot.reply_to(message, _("Please conduct authentication first！"))
+        return
+    try:
+        file_info = await bot.get_file(message.document.file_id)
+        data = await bot.download_file(file_info.file_path)
+        report = await run_io(sync_bot.import_statement, message.document.file_name or '', data)
+        await bot.reply_to(message, sync_bot.import_message(report), reply_markup=sync_bot.import_markup(report))
+    except ValueError as e:
+        logger.info(f'{message.from_user.id}：Unable to import statement', e)
+        await bot.reply_to(message, e.args[0])
+    except Exception as e:
+        logger.error(f'{message.from_user.id}：An unknown mistake!Importing the statement failed.', e)
+        await bot.reply_to(message, _("An unknown mistake!Importing the statement failed.\n" + traceback.format_exc()))
+
+
+@bot.callback_query_handler(func=lambda call: call.data[:8] == 'withdraw')
+@metrics.timed
+async def callback_withdraw(call: CallbackQuery):
+    """
+    Transaction withdrawal callback
+    :param call:
+    :return:
+    """
+    if not check_auth(call.from_user.id):
+        await bot.answer_callback_query(call.id, _("Please conduct authentication first！"))
+        return
+    tx_uuid = call.data[9:]
+    try:
+        manager = await run_io(get_manager)
+        await run_io(manager.remove, tx_uuid)
+        # Modify the original message reply
+        message, entities = sync_bot.withdrawn_message()
+        await bot.edit_message_text(message,
+                                    chat_id=call.message.chat.id,
+                                    message_id=call.message.message_id,
+                                    entities=entities)
+    except ValueError as e:
+        logger.info(f'{call.id}：Unable to create trading', e)
+        await bot.answer_callback_query(call.id, e.args[0])
+    except Exception as e:
+        logger.error(f'{call.id}：An unknown mistake!Withdrawal of the transaction failed.', e)
+        await bot.answer_callback_query(call.id, _("An unknown mistake!Withdrawal of the transaction failed."))
+
+
+def setup():
+    """
+    Set up Token, proxy and the I/O executor from configuration
+    :return:
+    """
+    global _executor
+    # 定时任务仍使用同步 Bot 发送消息
+    sync_bot.setup()
+    bot.token = get_config('bot.token')
+    proxy = get_config('bot.proxy')
+    if proxy is not None:
+        asyncio_helper.proxy = proxy
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=get_config('bot.io_workers', 4),
+                                       thread_name_prefix='beancount_bot_io')
+
+
+def serving():
+    """
+    start up Bot in asyncio runtime
+    :return:
+    """
+    setup()
+    # start up
+    asyncio.run(bot.infinity_polling())
@@ -1,14 +1,20 @@
+import io
 import traceback
+from typing import Dict, List, Optional, Tuple, Union
+
 import telebot
-from telebot import apihelper
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, MessageEntity, Message, CallbackQuery
+from telebot import apihelper, util
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, MessageEntity, Message, CallbackQuery, \
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent
 
-from beancount_bot import transaction
-from beancount_bot.config import get_config, load_config
+from beancount_bot import importer, metrics, profiler, transaction
+from beancount_bot.completion import Completion, MAX_COMPLETIONS
+from beancount_bot.config import get_config
 from beancount_bot.dispatcher import Dispatcher
 from beancount_bot.i18n import _
+from beancount_bot.reload import reload_config
 from beancount_bot.session import get_session, SESS_AUTH, get_session_for, set_session
-from beancount_bot.task import load_task, get_task
+from beancount_bot.task import get_task, trigger_task, ScheduleTask
 from beancount_bot.transaction import get_manager
 from beancount_bot.util import logger
 
@@ -16,6 +22,12 @@ apihelper.ENABLE_MIDDLEWARE = True
 
 bot = telebot.TeleBot(token=None, parse_mode=None)
 
+# File name of /profile pstats
+PSTATS_FILE_NAME = 'beancount_bot.pstats'
+
+# Imports of more batches have no withdrawal buttons
+MAX_IMPORT_BUTTONS = 10
+
 
 @bot.middleware_handler(update_types=['message'])
 def session_middleware(bot_instance, message):
@@ -41,6 +53,7 @@ def check_auth() -> bool:
 
 
 @bot.message_handler(commands=['start'])
+@metrics.timed
 def start_handler(message: Message):
     """
     First chat time authentication
@@ -78,6 +91,7 @@ def auth_token_handler(message: Message):
 
 
 @bot.message_handler(commands=['reload'])
+@metrics.timed
 def reload_handler(message):
     """
     Overload configuration instruction
@@ -87,12 +101,23 @@ def reload_handler(message):
     if not check_auth():
         bot.reply_to(message, _("Please conduct authentication first！"))
         return
-    load_config()
-    load_task()
-    bot.reply_to(message, _("Successful overload configuration！"))
+    changes = reload_config()
+    bot.reply_to(message, reload_message(changes))
+
+
+def reload_message(changes: List[str]) -> str:
+    """
+    Reply of the reload command
+    :param changes:
+    :return:
+    """
+    if len(changes) == 0:
+        return _("Successful overload configuration！Nothing changed")
+    return _("Successful overload configuration！Reloaded：{changes}").format(changes=', '.join(changes))
 
 
 @bot.message_handler(commands=['help'])
+@metrics.timed
 def help_handler(message):
     """
     Help instruction
@@ -102,34 +127,61 @@ def help_handler(message):
     cmd = message.text
     dispatchers = get_manager().dispatchers
     if cmd == '/help':
-        # Create a message button
-        markup = InlineKeyboardMarkup()
-        for ind, d in zip(range(len(dispatchers)), dispatchers):
-            help_btn = _("help：{name}").format(name=d.get_name())
-            markup.add(InlineKeyboardButton(help_btn, callback_data=f'help:{ind}'))
-        # 帮助信息
-        command_usage = [
-            _("/start - Authentication"),
-            _("/help - Using help"),
-            _("/reload - Reload the configuration file"),
-            _("/task - View, run the task"),
-        ]
-        help_text = \
-            _("Account bill Bot\n\nAvailable instruction list：\n{command}\n\nTrade statement syntax help, select the corresponding module，Use /help [Module name] Check.").format(
-                command='\n'.join(command_usage))
+        help_text, markup = help_message(dispatchers)
         bot.reply_to(message, help_text, reply_markup=markup)
     else:
         # Display detailed help
-        name: str = cmd[6:]
-        flag_found = False
-        for d in dispatchers:
-            if name.lower() == d.get_name().lower():
-                show_usage_for(message, d)
-                flag_found = True
-        if not flag_found:
+        found = find_dispatchers(dispatchers, cmd[6:])
+        for d in found:
+            show_usage_for(message, d)
+        if len(found) == 0:
             bot.reply_to(message, _("The corresponding name of the transaction statement processor does not exist！"))
 
 
+def help_message(dispatchers: List[Dispatcher]) -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Help information and the buttons of processor help
+    :param dispatchers:
+    :return:
+    """
+    # Create a message button
+    markup = InlineKeyboardMarkup()
+    for ind, d in zip(range(len(dispatchers)), dispatchers):
+        help_btn = _("help：{name}").format(name=d.get_name())
+        markup.add(InlineKeyboardButton(help_btn, callback_data=f'help:{ind}'))
+    # 帮助信息
+    command_usage = [
+        _("/start - Authentication"),
+        _("/help - Using help"),
+        _("/reload - Reload the configuration file"),
+        _("/task - View, run the task"),
+        _("/profile - Profile of sampled transactions, /profile pstats for the statistics file"),
+    ]
+    help_text = \
+        _("Account bill Bot\n\nAvailable instruction list：\n{command}\n\nTrade statement syntax help, select the corresponding module，Use /help [Module name] Check.").format(
+            command='\n'.join(command_usage))
+    return help_text, markup
+
+
+def find_dispatchers(dispatchers: List[Dispatcher], name: str) -> List[Dispatcher]:
+    """
+    Find processors by name
+    :param dispatchers:
+    :param name:
+    :return:
+    """
+    return [d for d in dispatchers if name.lower() == d.get_name().lower()]
+
+
+def usage_message(d: Dispatcher) -> str:
+    """
+    The method of use of a specific processor
+    :param d:
+    :return:
+    """
+    return _("help：{name}\n\n{usage}").format(name=d.get_name(), usage=d.get_usage())
+
+
 def show_usage_for(message: Message, d: Dispatcher):
     """
     Show the method of use of a specific processor
@@ -137,11 +189,11 @@ def show_usage_for(message: Message, d: Dispatcher):
     :param d:
     :return:
     """
-    usage = _("help：{name}\n\n{usage}").format(name=d.get_name(), usage=d.get_usage())
-    bot.reply_to(message, usage)
+    bot.reply_to(message, usage_message(d))
 
 
 @bot.callback_query_handler(func=lambda call: call.data[:4] == 'help')
+@metrics.timed
 def callback_help(call: CallbackQuery):
     """
     Help statement detailed help
@@ -159,6 +211,7 @@ def callback_help(call: CallbackQuery):
 
 
 @bot.message_handler(commands=['task'])
+@metrics.timed
 def task_handler(message):
     """
     Task instruction
@@ -173,18 +226,135 @@ def task_handler(message):
     tasks = get_task()
     if cmd == '/task':
         # Show all tasks
-        all_tasks = ', '.join(tasks.keys())
-        bot.reply_to(message,
-                     _("Current registration task：{all_tasks}\n"
-                       "able to pass /task [Task Name] Active trigger").format(all_tasks=all_tasks))
+        bot.reply_to(message, task_list_message(tasks))
     else:
         # Run task
         dest = cmd[6:]
         if dest not in tasks:
             bot.reply_to(message, _("Task does not exist！"))
             return
-        task = tasks[dest]
-        task.trigger(bot)
+        if not trigger_task(tasks[dest], bot):
+            bot.reply_to(message, _("Task is still running!"))
+
+
+@bot.message_handler(commands=['profile'])
+@metrics.timed
+def profile_handler(message: Message):
+    """
+    Profiling instruction
+    :param message:
+    :return:
+    """
+    if not check_auth():
+        bot.reply_to(message, _("Please conduct authentication first!"))
+        return
+    result = profile_command(message.text[len('/profile'):].strip())
+    if isinstance(result, bytes):
+        bot.send_document(message.chat.id, result, reply_to_message_id=message.message_id,
+                          visible_file_name=PSTATS_FILE_NAME)
+        return
+    for text in result:
+        bot.reply_to(message, text)
+
+
+def profile_command(arg: str) -> Union[List[str], bytes]:
+    """
+    Result of the profiling instruction.
+    /profile: timing of calls and stages, and top functions; /profile pstats: statistics file; /profile clear
+    :param arg:
+    :return: Messages, or the content of the statistics file
+    """
+    hot_path = profiler.get_profiler()
+    if hot_path is None:
+        return [_("Profiling is not enabled！Set profiler.enabled in the profile")]
+    if arg == 'clear':
+        hot_path.clear()
+        return [_("Profiles cleared")]
+    if arg == 'pstats':
+        data = hot_path.dump()
+        return data if data is not None else [_("No function statistics yet")]
+    return util.smart_split(hot_path.report(), util.MAX_MESSAGE_LENGTH)
+
+
+def task_list_message(tasks: Dict[str, ScheduleTask]) -> str:
+    """
+    List of registered tasks
+    :param tasks:
+    :return:
+    """
+    all_tasks = ', '.join(tasks.keys())
+    return _("Current registration task：{all_tasks}\n"
+             "able to pass /task [Task Name] Active trigger").format(all_tasks=all_tasks)
+
+
+#######
+# Completion #
+#######
+
+
+@bot.inline_handler(func=lambda query: True)
+@metrics.timed
+def inline_query_handler(query: InlineQuery):
+    """
+    Suggest trading statements while typing. Inline mode of the robot must be enabled by @BotFather
+    :param query:
+    :return:
+    """
+    if not get_session(query.from_user.id, SESS_AUTH, False):
+        bot.answer_inline_query(query.id, [], cache_time=0, is_personal=True)
+        return
+    try:
+        results = inline_results(complete(get_manager().dispatchers, query.query))
+        bot.answer_inline_query(query.id, results, cache_time=0, is_personal=True)
+    except Exception as e:
+        logger.error(f'{query.id}：Unknown error！', e)
+        logger.error(traceback.format_exc())
+
+
+def complete(dispatchers: List[Dispatcher], query: str) -> List[Completion]:
+    """
+    Completions of all processors, at most MAX_COMPLETIONS
+    :param dispatchers:
+    :param query:
+    :return:
+    """
+    found = {}
+    for d in dispatchers:
+        for c in d.complete(query):
+            found.setdefault(c.text, c)
+            if len(found) >= MAX_COMPLETIONS:
+                return list(found.values())
+    return list(found.values())
+
+
+def inline_results(completions: List[Completion]) -> List[InlineQueryResultArticle]:
+    """
+    Inline query results of completions. Choosing one sends the completed statement.
+    A partial statement is not added: the message sent shows its usage, with a button filling it back into the input
+    :param completions:
+    :return:
+    """
+    results = []
+    for ind, c in enumerate(completions):
+        if c.partial:
+            markup = InlineKeyboardMarkup()
+            markup.add(InlineKeyboardButton(_("Continue: {text}").format(text=c.text),
+                                            switch_inline_query_current_chat=c.text + ' '))
+            results.append(InlineQueryResultArticle(str(ind), c.title, InputTextMessageContent(c.title),
+                                                    reply_markup=markup, description=c.description))
+        else:
+            results.append(InlineQueryResultArticle(str(ind), c.title, InputTextMessageContent(c.text),
+                                                    description=c.description))
+    return results
+
+
+def is_partial_completion(message: Message) -> bool:
+    """
+    Message of a partial completion chosen in inline mode, which only carries the button continuing the input
+    :param message:
+    :return:
+    """
+    return message.via_bot is not None and message.reply_markup is not None
 
 
 #######
@@ -193,6 +363,7 @@ def task_handler(message):
 
 
 @bot.message_handler(func=lambda m: True)
+@metrics.timed
 def transaction_query_handler(message: Message):
     """
     Trading statement processing
@@ -202,15 +373,17 @@ def transaction_query_handler(message: Message):
     if not check_auth():
         auth_token_handler(message)
         return
+    if is_partial_completion(message):
+        return
+    if is_batch(message.text):
+        batch_transaction_handler(message)
+        return
     # Treated
     manager = get_manager()
     try:
         tx_uuid, tx = manager.create_from_str(message.text)
-        # Create a message button
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton(_("Revoke trading"), callback_data=f'withdraw:{tx_uuid}'))
         # 回复
-        bot.reply_to(message, transaction.stringfy(tx), reply_markup=markup)
+        bot.reply_to(message, transaction.stringfy(tx), reply_markup=withdraw_markup(tx_uuid))
     except ValueError as e:
         logger.info(f'{message.from_user.id}：Unable to add transactions', e)
         bot.reply_to(message, e.args[0])
@@ -219,7 +392,145 @@ def transaction_query_handler(message: Message):
         bot.reply_to(message, _("An unknown mistake!Adding a transaction failed.\n"+traceback.format_exc()))
 
 
+def batch_transaction_handler(message: Message):
+    """
+    Processing of a trading statement per line
+    :param message:
+    :return:
+    """
+    try:
+        single, batch_uuid, results = create_lines(message.text)
+        if single is not None:
+            tx_uuid, tx = single
+            bot.reply_to(message, transaction.stringfy(tx), reply_markup=withdraw_markup(tx_uuid))
+            return
+        texts, markup = batch_message(batch_uuid, results)
+        for text in texts[:-1]:
+            bot.reply_to(message, text)
+        bot.reply_to(message, texts[-1], reply_markup=markup)
+    except Exception as e:
+        logger.error(f'{message.from_user.id}：An unknown mistake!Adding a transaction failed.', e)
+        bot.reply_to(message, _("An unknown mistake!Adding a transaction failed.\n"+traceback.format_exc()))
+
+
+def create_lines(text: str) -> Tuple[Optional[Tuple[str, object]], Optional[str], List[transaction.BatchLine]]:
+    """
+    Create the transactions of a message of several lines, one trading statement per line.
+    If some lines cannot be parsed, the message may be a single statement of several lines, e.g. of
+    a third-party processor. It is created as such if it parses
+    :param text:
+    :return: (uuid, transaction) if created as a single statement, batch uuid, result of every line
+    """
+    manager = get_manager()
+    results = manager.parse_batch(text)
+    if any(r.error is not None for r in results):
+        try:
+            return manager.create_from_str(text), None, results
+        except ValueError:
+            pass
+    return None, manager.create_parsed_batch(results, get_config('transaction.batch_partial', False)), results
+
+
+def is_batch(text: str) -> bool:
+    """
+    Whether a message contains more than one trading statement
+    :param text:
+    :return:
+    """
+    return sum(1 for line in text.splitlines() if line.strip() != '') > 1
+
+
+def batch_message(batch_uuid: Optional[str], results: List[transaction.BatchLine]) \
+        -> Tuple[List[str], Optional[InlineKeyboardMarkup]]:
+    """
+    Summary of a batch, split to fit in messages, and the button of batch withdrawal
+    :param batch_uuid:
+    :param results:
+    :return:
+    """
+    failed = [r for r in results if r.error is not None]
+    if batch_uuid is None:
+        summary = _("No transaction was added, {failed} of {total} rows have errors") \
+            .format(failed=len(failed), total=len(results))
+    else:
+        summary = _("Added {count} of {total} transactions").format(count=len(results) - len(failed),
+                                                                      total=len(results))
+    lines = [summary]
+    for r in results:
+        if r.error is not None:
+            lines.append(_('Row {lineno}：{message}').format(lineno=r.lineno, message=f'{r.text}\n{r.error}'))
+        elif batch_uuid is not None:
+            lines.append(transaction.stringfy(r.tx))
+    texts = util.smart_split('\n'.join(lines), util.MAX_MESSAGE_LENGTH)
+    if batch_uuid is None:
+        return texts, None
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton(_("Revoke batch"), callback_data=f'withdraw:{batch_uuid}'))
+    return texts, markup
+
+
+@bot.message_handler(content_types=['document'])
+@metrics.timed
+def import_handler(message: Message):
+    """
+    Import an uploaded statement
+    :param message:
+    :return:
+    """
+    if not check_auth():
+        bot.reply_to(message, _("Please conduct authentication first！"))
+        return
+    try:
+        data = bot.download_file(bot.get_file(message.document.file_id).file_path)
+        report = import_statement(message.document.file_name or '', data)
+        bot.reply_to(message, import_message(report), reply_markup=import_markup(report))
+    except ValueError as e:
+        logger.info(f'{message.from_user.id}：Unable to import statement', e)
+        bot.reply_to(message, e.args[0])
+    except Exception as e:
+        logger.error(f'{message.from_user.id}：An unknown mistake!Importing the statement failed.', e)
+        bot.reply_to(message, _("An unknown mistake!Importing the statement failed.\n" + traceback.format_exc()))
+
+
+def import_statement(filename: str, data: bytes) -> importer.ImportReport:
+    """
+    Import a statement file
+    :param filename:
+    :param data:
+    :return:
+    """
+    statement_importer = importer.create_importer(get_manager())
+    return statement_importer.run(importer.read_rows(io.BytesIO(data), importer.guess_format(filename)))
+
+
+def import_message(report: importer.ImportReport) -> str:
+    """
+    Summary of an import
+    :param report:
+    :return:
+    """
+    lines = [str(report)]
+    lines.extend(_('Row {lineno}：{message}').format(lineno=rowno, message=error) for rowno, error in report.errors)
+    return util.smart_split('\n'.join(lines), util.MAX_MESSAGE_LENGTH)[0]
+
+
+def import_markup(report: importer.ImportReport) -> Optional[InlineKeyboardMarkup]:
+    """
+    Buttons of withdrawing imported batches. Large imports have no buttons
+    :param report:
+    :return:
+    """
+    if len(report.batches) == 0 or len(report.batches) > MAX_IMPORT_BUTTONS:
+        return None
+    markup = InlineKeyboardMarkup()
+    for ind, batch_uuid in enumerate(report.batches, 1):
+        markup.add(InlineKeyboardButton(_("Revoke batch {ind}").format(ind=ind),
+                                        callback_data=f'withdraw:{batch_uuid}'))
+    return markup
+
+
 @bot.callback_query_handler(func=lambda call: call.data[:8] == 'withdraw')
+@metrics.timed
 def callback_withdraw(call: CallbackQuery):
     """
     Transaction withdrawal callback
@@ -235,12 +546,11 @@ def callback_withdraw(call: CallbackQuery):
     try:
         manager.remove(tx_uuid)
         # Modify the original message reply
-        message = _("Transaction has been withdrawn")
-        code_format = MessageEntity('code', 0, len(message))
+        message, entities = withdrawn_message()
         bot.edit_message_text(message,
                               chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
-                              entities=[code_format])
+                              entities=entities)
     except ValueError as e:
         logger.info(f'{call.id}：Unable to create trading', e)
         bot.answer_callback_query(call.id, e.args[0])
@@ -249,12 +559,31 @@ def callback_withdraw(call: CallbackQuery):
         bot.answer_callback_query(call.id, _("An unknown mistake!Withdrawal of the transaction failed."))
 
 
-def serving():
+def withdraw_markup(tx_uuid: str) -> InlineKeyboardMarkup:
     """
-    start up Bot
+    Button of transaction withdrawal
+    :param tx_uuid:
     :return:
     """
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton(_("Revoke trading"), callback_data=f'withdraw:{tx_uuid}'))
+    return markup
+
 
+def withdrawn_message() -> Tuple[str, List[MessageEntity]]:
+    """
+    Message replacing the withdrawn transaction
+    :return:
+    """
+    message = _("Transaction has been withdrawn")
+    return message, [MessageEntity('code', 0, len(message))]
+
+
+def setup():
+    """
+    Set up Token and proxy from configuration
+    :return:
+    """
     # set up Token
     token = get_config('bot.token')
     bot.token = token
@@ -262,5 +591,13 @@ def serving():
     proxy = get_config('bot.proxy')
     if proxy is not None:
         apihelper.proxy = {'https': proxy}
+
+
+def serving():
+    """
+    start up Bot
+    :return:
+    """
+    setup()
     # start up
     bot.infinity_polling()
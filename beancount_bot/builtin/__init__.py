@@ -1,3 +1,19 @@
-from beancount_bot.builtin import template_dispatcher
-from beancount_bot.builtin.daily_command_task import DailyCommandTask
-from beancount_bot.builtin.template_dispatcher import TemplateDispatcher
+import importlib
+
+# Built-in processors and tasks, imported when first used
+_LAZY_CLASSES = {
+    'DailyCommandTask': 'beancount_bot.builtin.daily_command_task',
+    'TemplateDispatcher': 'beancount_bot.builtin.template_dispatcher',
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_CLASSES:
+        return getattr(importlib.import_module(_LAZY_CLASSES[name]), name)
+    if name == 'template_dispatcher':
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_CLASSES.keys()) + ['template_dispatcher'])
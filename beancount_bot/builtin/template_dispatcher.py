@@ -1,23 +1,27 @@
+import builtins
 import datetime
-import itertools
-from typing import List, Mapping
+import decimal
+import math
+import re
+import threading
+import time
+from types import CodeType
+from typing import Dict, List, Mapping, Tuple
 
 import yaml
+from beancount.parser import parser
 
-from beancount_bot.dispatcher import Dispatcher
+from beancount_bot import metrics
+from beancount_bot.completion import Completion, PrefixTrie
+from beancount_bot.dispatcher import Dispatcher, NotMatchException
 from beancount_bot.i18n import _
-from beancount_bot.transaction import NotMatchException
 from beancount_bot.util import logger
 
-_CH_CLASS = [' ', '\"', '\\', '<']
-_STATE_MAT = [
-    # Empty, ", \, <, other characters
-    [0, 2, -1, 4, 1],  # 0: Space
-    [0, 2, -1, 4, 1],  # 1: word
-    [2, 0, 3, 2, 2],  # 2: String
-    [2, 2, 2, 2, 2],  # 3: Escape
-    [0, 2, -1, -1, 1],  # 4: symbol
-]
+# Tokens: word, string (with quotes), symbol. Spaces between tokens are skipped
+_TOKEN = re.compile(r'([^ "\\<]+)|("[^"\\]*(?:\\.[^"\\]*)*")|(<)', re.DOTALL)
+# Longest prefix that can be split. Symbols cannot be followed by another symbol
+_VALID_PREFIX = re.compile(r'(?: +|[^ "\\<]+|"[^"\\]*(?:\\.[^"\\]*)*"|<(?!<))*', re.DOTALL)
+_ESCAPE = re.compile(r'\\(.)', re.DOTALL)
 
 
 def split_command(cmd):
@@ -26,31 +30,24 @@ def split_command(cmd):
     :param cmd:
     :return:
     """
-    state = 0
+    # Locate grammatical errors
+    pos = _VALID_PREFIX.match(cmd).end()
+    if pos < len(cmd):
+        ch = cmd[pos]
+        if ch == '"':
+            raise ValueError(_("Location {pos}：Grammatical errors!String, the escape is not over.").format(pos=len(cmd)))
+        if ch == '<':
+            # The second of consecutive symbols
+            pos += 1
+        raise ValueError(_("Location {pos}：Grammatical errors!Should not appear {ch}.").format(pos=pos, ch=cmd[pos]))
     words: List[str] = []
-
-    for i in range(len(cmd)):
-        ch = cmd[i]
-        # Character class
-        if ch in _CH_CLASS:
-            ch_class = _CH_CLASS.index(ch)
+    for word, string, symbol in _TOKEN.findall(cmd):
+        if string:
+            string = string[1:-1]
+            # Split by escapes keeps the escaped characters between the literal parts
+            words.append(''.join(_ESCAPE.split(string)) if '\\' in string else string)
         else:
-            ch_class = 4
-        # State transfer
-        state, old_state = _STATE_MAT[state][ch_class], state
-        if state == -1:
-            raise ValueError(_("Location {pos}：Grammatical errors!Should not appear {ch}.").format(pos=i, ch=ch))
-        # 进入事件
-        if state != old_state and old_state != 3:
-            if state in [1, 2, 4]:
-                words.append('')
-            if state in [2, 3]:
-                continue
-        # Status event
-        if state != 0:
-            words[-1] += ch
-    if state not in [0, 1, 4]:
-        raise ValueError(_("Location {pos}：Grammatical errors!String, the escape is not over.").format(pos=len(cmd)))
+            words.append(word or symbol)
     return words
 
 
@@ -85,11 +82,142 @@ def print_one_usage(template: Template) -> str:
     return usage
 
 
+_SAFE_BUILTINS = [
+    'abs', 'all', 'any', 'bool', 'dict', 'divmod', 'enumerate', 'filter', 'float', 'format', 'int', 'isinstance',
+    'len', 'list', 'map', 'max', 'min', 'pow', 'range', 'reversed', 'round', 'set', 'sorted', 'str', 'sum',
+    'tuple', 'zip', 'ValueError',
+]
+
+# Modules available to computed expressions
+_IMPORTABLE = {'datetime': datetime, 'time': time, 'math': math, 're': re, 'decimal': decimal}
+
+
+def _safe_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """
+    __import__ of computed expressions. Keeps __import__('datetime') of old templates working,
+    other modules cannot be imported
+    """
+    module = _IMPORTABLE.get(name) if level == 0 else None
+    if module is None:
+        raise ImportError(_("Module {name} cannot be imported in templates").format(name=name))
+    return module
+
+
+# Global namespace of computed expressions
+_EVAL_GLOBALS = {
+    '__builtins__': {**{name: getattr(builtins, name) for name in _SAFE_BUILTINS}, '__import__': _safe_import},
+    'datetime': datetime,
+    'time': time,
+    'math': math,
+    're': re,
+    'Decimal': decimal.Decimal,
+}
+
+
+def _compile_computed(template: Template, name: str, expr: str) -> CodeType:
+    """
+    Compile a computed parameter expression
+    :param template:
+    :param name: Parameter name
+    :param expr: Python expression
+    :return:
+    """
+    command = _to_list(template['command'])[0]
+    try:
+        return compile(str(expr).strip(), f'<template {command}: {name}>', 'eval')
+    except SyntaxError as e:
+        raise ValueError(_("Template {command}: computed parameter {name} has syntax error: {msg}")
+                         .format(command=command, name=name, msg=e.msg))
+
+
+# Placeholder-like text in template
+_PLACEHOLDER = re.compile(r'\{([^\W\d]\w*)\}')
+# Built-in variables
+_BUILTIN_VARIABLES = ['account', 'date', 'command']
+
+
+def _compile_body(template: Template, names: List[str]) -> List[str]:
+    """
+    Split the template body into segments. Even segments are literal text, odd segments are parameter names
+    :param template:
+    :param names: Parameters that can be referenced
+    :return:
+    """
+    body = template['template']
+    pattern = re.compile(r'\{(' + '|'.join(map(re.escape, sorted(names, key=len, reverse=True))) + r')\}')
+    segments = pattern.split(body)
+    for literal in segments[::2]:
+        for unknown in _PLACEHOLDER.findall(literal):
+            raise ValueError(_("Template {command}: undefined parameter {name}")
+                             .format(command=_to_list(template['command'])[0], name=unknown))
+    return segments
+
+
+class CompiledTemplate:
+    """
+    Template compiled at load time
+    """
+
+    def __init__(self, template: Template):
+        self.template = template
+        self.computed: List[Tuple[str, CodeType]] = [
+            (k, _compile_computed(template, k, expr)) for k, expr in template.get('computed', {}).items()
+        ]
+        names = _BUILTIN_VARIABLES + template.get('args', []) + template.get('optional_args', []) + \
+            list(template.get('computed', {}).keys())
+        self.segments = _compile_body(template, names)
+
+    def render(self, arg_map: Mapping) -> str:
+        """
+        Fill parameters into the template
+        :param arg_map:
+        :return:
+        """
+        segments = self.segments[:]
+        segments[1::2] = [str(arg_map[name]) for name in segments[1::2]]
+        return ''.join(segments)
+
+    def skeleton(self) -> str:
+        """
+        Fill parameters with sample values guessed from their position, to check the template at load time
+        :return:
+        """
+        rendered = []
+        line = ''
+        for i, segment in enumerate(self.segments):
+            if i % 2 == 0:
+                value = segment
+            elif segment == 'date' or line == '':
+                value = '2000-01-01'
+            elif line.count('"') % 2 == 1:
+                value = 'x'
+            elif line.strip() == '':
+                value = 'Assets:Skeleton'
+            else:
+                value = '0'
+            rendered.append(value)
+            line = (line + value).rsplit('\n', 1)[-1]
+        return ''.join(rendered)
+
+    def check(self) -> List[str]:
+        """
+        Parse the skeleton of the template
+        :return: Parse errors
+        """
+        __, errors, __ = parser.parse_string(self.skeleton(), dedent=True)
+        return [e.message for e in errors]
+
+
 class TemplateDispatcher(Dispatcher):
     """
     Template processor.Based on the JSON template to generate transaction information.
     """
 
+    # The template is selected by the instruction name
+    route_by_token = True
+    # Templates are checked at load time, the rendered text is written as is
+    canonical_output = True
+
     def get_name(self) -> str:
         return _("template")
 
@@ -122,24 +250,85 @@ class TemplateDispatcher(Dispatcher):
             data = yaml.full_load(f)
         self.config = data['config']
         self.templates = data['templates']
+        # Command index. The first template defining a command takes it
+        self._commands: Dict[str, CompiledTemplate] = {}
+        for template in self.templates:
+            compiled = CompiledTemplate(template)
+            errors = compiled.check()
+            if len(errors) > 0:
+                raise ValueError(_("Template {command} does not generate valid beancount: {errors}")
+                                 .format(command=_to_list(template['command'])[0], errors='; '.join(errors)))
+            for command in _to_list(template['command']):
+                self._commands.setdefault(command, compiled)
+        # Completion of commands and account aliases
+        self._command_trie = PrefixTrie(
+            (command, Completion(command, print_one_usage(c.template), c.template['template'].strip().split('\n')[0],
+                                 len(c.template.get('args', [])) > 0))
+            for command, c in sorted(self._commands.items())
+        )
+        self._alias_trie = PrefixTrie(
+            (alias, (alias, account)) for alias, account in sorted(self.config['accounts'].items())
+        )
+        self._last_split = threading.local()
+
+    def _split(self, input_str: str) -> List[str]:
+        """
+        Separate input instructions. The result of the last input is reused, so that
+        quick_check and _process_raw of the same message tokenise only once
+        :param input_str:
+        :return:
+        """
+        last = getattr(self._last_split, 'value', None)
+        if last is not None and last[0] == input_str:
+            return last[1]
+        with metrics.stage('split_command'):
+            words = split_command(input_str)
+        self._last_split.value = (input_str, words)
+        return words
 
     def quick_check(self, input_str: str) -> bool:
-        words = split_command(input_str)
-        prefixes = map(lambda t: _to_list(t['command']), self.templates)
-        prefixes = itertools.chain(*prefixes)
+        words = self._split(input_str)
         # The same is the same and spaced apart
-        return any(map(lambda prefix: words[0] == prefix, prefixes))
+        return len(words) > 0 and words[0] in self._commands
+
+    def complete(self, query: str) -> List[Completion]:
+        head, __, last = query.rpartition(' ')
+        if head.strip() == '':
+            # Command
+            return self._command_trie.complete(last)
+        compiled = self._commands.get(query.split(None, 1)[0])
+        if last.startswith('<'):
+            # Target account
+            partial = compiled is not None and self._missing_args(compiled, head)
+            return [Completion(f'{head} <{alias}', f'<{alias}', account, partial)
+                    for alias, account in self._alias_trie.complete(last[1:])]
+        # Parameters
+        if compiled is None:
+            return []
+        return [Completion(query.strip(), print_one_usage(compiled.template), '',
+                           self._missing_args(compiled, query))]
+
+    @staticmethod
+    def _missing_args(compiled: CompiledTemplate, statement: str) -> bool:
+        """
+        Whether required parameters are missing in a statement being typed
+        :param compiled:
+        :param statement:
+        :return:
+        """
+        given = [word for word in statement.split()[1:] if not word.startswith('<')]
+        return len(given) < len(compiled.template.get('args', []))
 
     def _process_raw(self, input_str: str) -> str:
-        words = split_command(input_str)
+        words = self._split(input_str)
+        if len(words) == 0:
+            raise NotMatchException()
         cmd, args = words[0], words[1:]
         # Select template
-        template = next(
-            filter(lambda t: cmd in _to_list(t['command']), self.templates),
-            None
-        )
-        if template is None:
+        compiled = self._commands.get(cmd)
+        if compiled is None:
             raise NotMatchException()
+        template = compiled.template
         # Default parameters
         arg_map = {
             'account': self.config['default_account'],
@@ -171,12 +360,8 @@ class TemplateDispatcher(Dispatcher):
         if len(args) != 0:
             raise ValueError(_("Excessive parameters!grammar：{syntax}").format(syntax=print_one_usage(template)))
         # Calculate parameters to be calculated
-        if 'computed' in template:
-            for k, expr in template['computed'].items():
-                arg_map[k] = eval(expr, None, arg_map)
+        for k, code in compiled.computed:
+            arg_map[k] = eval(code, _EVAL_GLOBALS, arg_map)
         # Template replacement
         logger.debug('Template parameters %s', arg_map)
-        ret = template['template']
-        for k, v in arg_map.items():
-            ret = ret.replace(f'{{{k}}}', str(v))
-        return ret
+        return compiled.render(arg_map)
@@ -0,0 +1,88 @@
+from typing import Dict, Generic, Iterable, List, NamedTuple, Optional, Tuple, TypeVar
+
+# Telegram answers at most 50 results to an inline query
+MAX_COMPLETIONS = 50
+
+T = TypeVar('T')
+
+
+class Completion(NamedTuple):
+    """
+    Suggestion of an inline query
+    """
+    # Message sent when the suggestion is chosen
+    text: str
+    title: str
+    description: str = ''
+    # The text is not a whole statement yet, e.g. a command without its arguments.
+    # Choosing it fills the text back into the input instead of adding a transaction
+    partial: bool = False
+
+
+class _Node:
+    __slots__ = ('children', 'values', 'top')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = {}
+        self.values: list = []
+        # First MAX_COMPLETIONS values under this node, by key
+        self.top: list = []
+
+
+class PrefixTrie(Generic[T]):
+    """
+    Values indexed by every prefix of their keys. The completions of each prefix are computed when built,
+    so a lookup only walks the characters of the prefix
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, T]] = (), limit: int = MAX_COMPLETIONS):
+        """
+        :param items: (key, value). Values of the same key keep their order
+        :param limit: Completions kept per prefix
+        """
+        self.limit = limit
+        self.root = _Node()
+        for key, value in items:
+            node = self.root
+            for ch in key:
+                node = node.children.setdefault(ch, _Node())
+            node.values.append(value)
+        self._collect(self.root)
+
+    def _collect(self, root: _Node):
+        """
+        Compute the completions of every node, children before parents
+        :param root:
+        :return:
+        """
+        order: List[_Node] = []
+        stack = [root]
+        while len(stack) > 0:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children.values())
+        for node in reversed(order):
+            top = node.values[:self.limit]
+            for ch in sorted(node.children.keys()):
+                if len(top) >= self.limit:
+                    break
+                top.extend(node.children[ch].top[:self.limit - len(top)])
+            node.top = top
+
+    def _find(self, prefix: str) -> Optional[_Node]:
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def complete(self, prefix: str, n: int = MAX_COMPLETIONS) -> List[T]:
+        """
+        Values whose key starts with prefix, in key order
+        :param prefix:
+        :param n:
+        :return:
+        """
+        node = self._find(prefix)
+        return node.top[:n] if node is not None else []
@@ -1,5 +1,3 @@
-import yaml
-
 from beancount_bot.i18n import _
 
 global_object_map = {}
@@ -7,6 +5,8 @@ global_object_map = {}
 GLOBAL_CONFIG = 'config'
 GLOBAL_MANAGER = 'manager'
 GLOBAL_TASK = 'task'
+GLOBAL_LEDGER = 'ledger'
+GLOBAL_ACCOUNTS = 'accounts'
 
 config_file = ''
 
@@ -35,19 +35,36 @@ def get_global(key: str, default_producer: callable):
     return global_object_map[key]
 
 
-def load_config(path=None):
+def read_config(path=None) -> dict:
     """
-    From the file load configuration, clear the global object
+    Read configuration from the file
     :param path:
     :return:
     """
+    import yaml
     if path is None:
         path = config_file
-    global global_object_map
     with open(path, 'r', encoding='utf-8') as f:
-        data = yaml.full_load(f)
-    global_object_map = {}
-    set_global(GLOBAL_CONFIG, data)
+        return yaml.full_load(f)
+
+
+def load_config(path=None):
+    """
+    From the file load configuration, clear the global object
+    :param path:
+    :return:
+    """
+    swap_globals({GLOBAL_CONFIG: read_config(path)})
+
+
+def swap_globals(object_map: dict):
+    """
+    Replace all global objects at once. Requests that already got the old objects keep using them
+    :param object_map:
+    :return:
+    """
+    global global_object_map
+    global_object_map = object_map
 
 
 def get_config_obj():
@@ -69,7 +86,17 @@ def get_config(key_path: str, default_value=None):
     :param default_value:
     :return:
     """
-    obj = get_config_obj()
+    return lookup(get_config_obj(), key_path, default_value)
+
+
+def lookup(obj: dict, key_path: str, default_value=None):
+    """
+    Get a value of a configuration object
+    :param obj:
+    :param key_path:
+    :param default_value:
+    :return:
+    """
     for ind in key_path.split('.'):
         if ind not in obj:
             return default_value
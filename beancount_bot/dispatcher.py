@@ -1,16 +1,31 @@
-from typing import Union
+import textwrap
+from typing import List, Union
 
 from beancount.core.data import Transaction
 from beancount.parser import parser
 
+from beancount_bot import metrics, render
+from beancount_bot.completion import Completion
 from beancount_bot.i18n import _
 
 
+class NotMatchException(Exception):
+    pass
+
+
 class Dispatcher:
     """
     Trading statement processor
     """
 
+    # The output of _process_raw is already the text to write, starting with the transaction header.
+    # If set, transactions are written and replied as is instead of being rendered by beancount
+    canonical_output = False
+
+    # Whether the processor accepts or rejects an input by its leading token alone.
+    # If set, the router tries it last for inputs whose leading token it rejected before
+    route_by_token = False
+
     def __init__(self) -> None:
         """
         The constructor of the processor will be built TransactionManager Performation.If started、/reload After the first statement analysis
@@ -36,14 +51,16 @@ class Dispatcher:
         :raise NotMatchException: User input cannot be processed
         """
         tx_str = self._process_raw(input_str)
-        try:
-            tx = parser.parse_one(tx_str)
-            if isinstance(tx, Transaction):
-                return tx
-            else:
-                return tx_str
-        except AssertionError:
+        text = textwrap.dedent(tx_str).lstrip('\n')
+        with metrics.stage('parse'):
+            entries, errors, __ = parser.parse_string(text)
+        if len(errors) > 0 or len(entries) != 1 or not isinstance(entries[0], Transaction):
             return tx_str
+        tx = entries[0]
+        # Metadata is added after the first line, which must be the transaction header, e.g. not a comment
+        if self.canonical_output and tx.meta.get('lineno') == 1:
+            render.remember(tx, text.rstrip('\n') + '\n')
+        return tx
 
     def _process_raw(self, input_str: str) -> str:
         """
@@ -58,6 +75,15 @@ class Dispatcher:
                  Expenses:Unknown    + 1 CNY
                '''
 
+    def complete(self, query: str) -> List[Completion]:
+        """
+        Suggest completions of a statement being typed. Shown as the results of inline queries,
+        so it should take no more than a few milliseconds
+        :param query: Incomplete user input
+        :return:
+        """
+        return []
+
     def get_name(self) -> str:
         """
         Get the processor name.In /help Display options
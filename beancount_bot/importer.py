@@ -0,0 +1,328 @@
+import codecs
+import csv
+import datetime
+import hashlib
+import io
+import re
+import sqlite3
+import time
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+from beancount.core.data import Transaction
+
+from beancount_bot.config import get_config
+from beancount_bot.i18n import _
+from beancount_bot.transaction import TransactionManager, Uuid
+from beancount_bot.util import logger
+
+META_IMPORT = 'tgbot_import'
+
+Row = Dict[str, str]
+
+# Errors kept in the report. Later errors are only counted
+MAX_REPORTED_ERRORS = 20
+READ_SIZE = 64 * 1024
+
+_IMPORT_META = re.compile(META_IMPORT.encode('utf-8') + rb': *"([0-9a-f]+)"')
+_OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+def read_csv(stream: BinaryIO, encoding: str = 'utf-8-sig', delimiter: str = ',', skip_lines: int = 0) -> Iterator[Row]:
+    """
+    Read rows of a CSV statement. The first line after skip_lines is the header
+    :param stream:
+    :param encoding:
+    :param delimiter:
+    :param skip_lines: Lines before the header, e.g. the account information of some banks
+    :return:
+    """
+    text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    for __ in range(skip_lines):
+        text.readline()
+    for row in csv.DictReader(text, delimiter=delimiter):
+        yield {k.strip(): (v or '').strip() for k, v in row.items() if k is not None}
+
+
+def read_ofx(stream: BinaryIO, encoding: str = 'utf-8') -> Iterator[Row]:
+    """
+    Read the transactions (STMTTRN) of an OFX statement. Both SGML (OFX 1.x) and XML (OFX 2.x) are supported
+    :param stream:
+    :param encoding:
+    :return: Tags of a transaction, e.g. DTPOSTED, TRNAMT, FITID, NAME, MEMO
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    buffer = ''
+    row: Optional[Row] = None
+    eof = False
+    while not eof:
+        chunk = stream.read(READ_SIZE)
+        eof = len(chunk) == 0
+        buffer += decoder.decode(chunk, final=eof)
+        # The text after the last tag may be incomplete
+        end = len(buffer) if eof else buffer.rfind('<')
+        if end <= 0:
+            continue
+        for closing, tag, value in _OFX_TAG.findall(buffer, 0, end):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if row is not None:
+                    yield row
+                row = None if closing else {}
+            elif row is not None and not closing and value.strip() != '':
+                row[tag] = value.strip()
+        buffer = buffer[end:]
+    if row is not None:
+        yield row
+
+
+def read_rows(stream: BinaryIO, file_format: str) -> Iterator[Row]:
+    """
+    Read rows of a statement by the options in configuration
+    :param stream:
+    :param file_format: csv or ofx
+    :return:
+    """
+    if file_format == 'csv':
+        return read_csv(stream,
+                        encoding=get_config('importer.csv.encoding', 'utf-8-sig'),
+                        delimiter=get_config('importer.csv.delimiter', ','),
+                        skip_lines=get_config('importer.csv.skip_lines', 0))
+    elif file_format == 'ofx':
+        return read_ofx(stream, encoding=get_config('importer.ofx.encoding', 'utf-8'))
+    raise ValueError(_("Unsupported statement format：{format}").format(format=file_format))
+
+
+def guess_format(filename: str) -> str:
+    """
+    Statement format by file extension
+    :param filename:
+    :return:
+    """
+    ext = filename.rsplit('.', 1)[-1].lower()
+    return 'ofx' if ext in ('ofx', 'qfx') else 'csv'
+
+
+def row_hash(row: Row) -> str:
+    """
+    Identity of a row. The transaction id of OFX is used if present
+    :param row:
+    :return:
+    """
+    if row.get('FITID'):
+        key = 'FITID\0' + row['FITID']
+    else:
+        key = '\0'.join(f'{k}\0{v}' for k, v in sorted(row.items()))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def imported_hashes(files: Iterable[str]) -> Iterator[str]:
+    """
+    Hashes of rows already imported into the account files
+    :param files:
+    :return:
+    """
+    for path in files:
+        with open(path, 'rb') as f:
+            for line in f:
+                if META_IMPORT.encode('utf-8') in line:
+                    yield from (h.decode('ascii') for h in _IMPORT_META.findall(line))
+
+
+class _SeenRows:
+    """
+    Hashes of imported rows and occurrences of statement rows, kept in a temporary SQLite database
+    so that memory does not grow with the statement or the account
+    """
+
+    def __init__(self, imported: Iterable[str]):
+        # An empty file name opens a private temporary database on disk, deleted when closed
+        self._conn = sqlite3.connect('')
+        self._conn.execute('CREATE TABLE seen (hash TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._conn.execute('CREATE TABLE occurrence (hash TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID')
+        self._conn.executemany('INSERT OR IGNORE INTO seen VALUES (?)', ((h,) for h in imported))
+
+    def occurrence(self, hash_value: str) -> int:
+        """
+        Count a statement row
+        :param hash_value:
+        :return: Times the row appeared before
+        """
+        found = self._conn.execute('SELECT count FROM occurrence WHERE hash = ?', (hash_value,)).fetchone()
+        count = found[0] if found is not None else 0
+        self._conn.execute('INSERT OR REPLACE INTO occurrence VALUES (?, ?)', (hash_value, count + 1))
+        return count
+
+    def add(self, hash_value: str):
+        self._conn.execute('INSERT OR IGNORE INTO seen VALUES (?)', (hash_value,))
+
+    def __contains__(self, hash_value: str) -> bool:
+        return self._conn.execute('SELECT 1 FROM seen WHERE hash = ?', (hash_value,)).fetchone() is not None
+
+    def close(self):
+        self._conn.close()
+
+
+def parse_date(value: str, date_format: Optional[str] = None) -> datetime.date:
+    """
+    Parse the date of a row
+    :param value:
+    :param date_format: strptime format. By default, OFX dates (20211231120000[-5:EST]) and ISO dates are accepted
+    :return:
+    """
+    value = value.strip()
+    if date_format is not None:
+        return datetime.datetime.strptime(value, date_format).date()
+    if value[:8].isdigit():
+        return datetime.datetime.strptime(value[:8], '%Y%m%d').date()
+    return datetime.date.fromisoformat(value[:10])
+
+
+def _quote(value: str) -> str:
+    """
+    Escape a value so that it can be placed in a quoted parameter
+    :param value:
+    :return:
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class ImportReport:
+    """
+    Result of an import
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        # (row number, error message)
+        self.errors: List[tuple] = []
+        self.batches: List[Uuid] = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return _("{rows} rows, {imported} imported, {duplicates} duplicated, {failed} failed. "
+                 "{seconds:.2f}s, {rate:.0f} rows/s") \
+            .format(rows=self.rows, imported=self.imported, duplicates=self.duplicates, failed=self.failed,
+                    seconds=self.seconds, rate=self.rows_per_second)
+
+
+class StatementImporter:
+    """
+    Import statement rows as transactions. Every row is formatted into a trading statement
+    and parsed by the message dispatchers, e.g. a template
+    """
+
+    def __init__(self, manager: TransactionManager, statement: str, date_field: Optional[str] = None,
+                 date_format: Optional[str] = None, batch_size: int = 500):
+        """
+        :param manager:
+        :param statement: Trading statement of a row. Fields of the row are referenced by {field}
+        :param date_field: Field of the transaction date. None keeps the date given by the dispatcher
+        :param date_format:
+        :param batch_size: Transactions written per append
+        """
+        self.manager = manager
+        self.statement = statement
+        self.date_field = date_field
+        self.date_format = date_format
+        self.batch_size = batch_size
+
+    def _to_transaction(self, row: Row, hash_value: str) -> Transaction:
+        """
+        Convert a row to a transaction
+        :param row:
+        :param hash_value:
+        :return:
+        """
+        try:
+            statement = self.statement.format(**{k: _quote(v) for k, v in row.items()})
+        except KeyError as e:
+            raise ValueError(_("Row has no field {field}").format(field=e.args[0]))
+        tx = self.manager.router.route(statement)
+        if not isinstance(tx, Transaction):
+            raise ValueError(_("Statement is not a transaction：{statement}").format(statement=statement))
+        date = tx.date
+        if self.date_field is not None:
+            try:
+                date = parse_date(row.get(self.date_field, ''), self.date_format)
+            except ValueError:
+                raise ValueError(_("Invalid date：{value}").format(value=row.get(self.date_field)))
+        tx = tx._replace(date=date, meta={**tx.meta, META_IMPORT: hash_value})
+        self.manager.validate(tx)
+        return tx
+
+    def run(self, rows: Iterable[Row], on_progress: Callable[[ImportReport], None] = None) -> ImportReport:
+        """
+        Import rows. Only a batch of transactions is held in memory, hashes of rows are kept on disk
+        :param rows:
+        :param on_progress: Called after every batch is written
+        :return:
+        """
+        report = ImportReport()
+        start = time.perf_counter()
+        seen = _SeenRows(imported_hashes(self.manager.ledger_files()))
+        batch: List[Transaction] = []
+
+        def flush():
+            if len(batch) == 0:
+                return
+            batch_uuid, __ = self.manager.create_batch(batch)
+            report.batches.append(batch_uuid)
+            report.imported += len(batch)
+            batch.clear()
+            report.seconds = time.perf_counter() - start
+            if on_progress is not None:
+                on_progress(report)
+
+        try:
+            for rowno, row in enumerate(rows, 1):
+                report.rows += 1
+                hash_value = row_hash(row)
+                # Identical rows in a statement are told apart by their occurrence
+                occurrence = seen.occurrence(hash_value)
+                if occurrence > 0:
+                    hash_value = hashlib.sha1(f'{hash_value}:{occurrence}'.encode('utf-8')).hexdigest()
+                if hash_value in seen:
+                    report.duplicates += 1
+                    continue
+                try:
+                    batch.append(self._to_transaction(row, hash_value))
+                except ValueError as e:
+                    report.failed += 1
+                    if len(report.errors) < MAX_REPORTED_ERRORS:
+                        report.errors.append((rowno, e.args[0]))
+                    continue
+                seen.add(hash_value)
+                if len(batch) >= self.batch_size:
+                    flush()
+            flush()
+        finally:
+            seen.close()
+        report.seconds = time.perf_counter() - start
+        logger.info('Imported statement: %s', report)
+        return report
+
+
+def create_importer(manager: TransactionManager, statement: str = None, date_field: str = None,
+                    date_format: str = None) -> StatementImporter:
+    """
+    Create the importer from configuration. Arguments override the configuration
+    :param manager:
+    :param statement:
+    :param date_field:
+    :param date_format:
+    :return:
+    """
+    statement = statement if statement is not None else get_config('importer.statement')
+    if statement is None:
+        raise ValueError(_("Statement of imported rows is not configured！"))
+    return StatementImporter(manager, statement,
+                             date_field=date_field if date_field is not None else get_config('importer.date_field'),
+                             date_format=date_format if date_format is not None else get_config('importer.date_format'),
+                             batch_size=get_config('importer.batch_size', 500))
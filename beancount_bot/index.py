@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from beancount_bot.rewrite import atomic_open
+from beancount_bot.util import logger
+
+
+class Span(NamedTuple):
+    """
+    Location of a transaction in the account file
+    """
+    file: str
+    start: int
+    end: int
+    hash: str
+
+
+def content_hash(data: bytes) -> str:
+    """
+    Hash of the transaction content, used to check whether the span is still valid
+    :param data:
+    :return:
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+class TransactionIndex:
+    """
+    Transaction location index: uuid -> (file, start byte, end byte, content hash)
+    The sidecar file is an append-only log of JSON lines. A removal appends a record of the cut span,
+    which shifts the spans behind it when replayed. The log is compacted when it holds too many cuts,
+    whose replay costs a pass over the spans each, or too many dead records.
+    """
+
+    # Cut records kept in the log before compaction
+    COMPACT_CUTS = 64
+    # Dead records kept in the log before compaction, in addition to one per live record
+    COMPACT_DEAD = 1024
+
+    def __init__(self, index_file: Optional[str] = None):
+        """
+        :param index_file: Sidecar file path. If None, the index is only kept in memory
+        """
+        self.index_file = index_file
+        self._spans: Dict[str, Span] = {}
+        self._lock = threading.RLock()
+        self._log = None
+        # Records in the log, and cut records among them
+        self._records = 0
+        self._cuts = 0
+        self._load()
+
+    def _load(self):
+        """
+        Replay the sidecar log
+        :return:
+        """
+        if self.index_file is None or not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能残留半行
+                    logger.warning('Ignore broken index record: %s', line)
+                    continue
+                self._records += 1
+                if record.get('cut', False):
+                    self._shift(record['uuid'], Span(record['file'], record['start'], record['end'], ''))
+                    self._cuts += 1
+                elif record.get('removed', False):
+                    self._spans.pop(record['uuid'], None)
+                else:
+                    self._spans[record['uuid']] = Span(record['file'], record['start'], record['end'], record['hash'])
+        logger.debug('Load %d index records from %s', len(self._spans), self.index_file)
+        self._compact_if_needed()
+
+    def _append_record(self, record: dict):
+        """
+        Append a record to the sidecar log
+        :param record:
+        :return:
+        """
+        if self.index_file is None:
+            return
+        if self._log is None:
+            self._log = open(self.index_file, 'a', encoding='utf-8')
+        self._log.write(json.dumps(record) + '\n')
+        self._log.flush()
+        self._records += 1
+
+    def _rewrite(self):
+        """
+        Compact the sidecar log to the current records
+        :return:
+        """
+        if self.index_file is None:
+            return
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        with atomic_open(self.index_file, 'w', encoding='utf-8') as f:
+            for tx_uuid, span in self._spans.items():
+                f.write(json.dumps({'uuid': tx_uuid, **span._asdict()}) + '\n')
+        self._records = len(self._spans)
+        self._cuts = 0
+
+    def _compact_if_needed(self):
+        if self.index_file is None:
+            return
+        if self._cuts >= self.COMPACT_CUTS or self._records - len(self._spans) > self.COMPACT_DEAD + len(self._spans):
+            self._rewrite()
+
+    def _shift(self, tx_uuid: str, span: Span):
+        """
+        Forget a transaction and shift the spans behind the cut span
+        :param tx_uuid:
+        :param span:
+        :return:
+        """
+        self._spans.pop(tx_uuid, None)
+        length = span.end - span.start
+        for other_uuid, other in self._spans.items():
+            if other.file == span.file and other.start >= span.end:
+                self._spans[other_uuid] = other._replace(start=other.start - length, end=other.end - length)
+
+    def get(self, tx_uuid: str) -> Optional[Span]:
+        """
+        Get the span of a transaction
+        :param tx_uuid:
+        :return:
+        """
+        return self._spans.get(tx_uuid)
+
+    def add(self, tx_uuid: str, span: Span):
+        """
+        Record a newly written transaction
+        :param tx_uuid:
+        :param span:
+        :return:
+        """
+        with self._lock:
+            self._spans[tx_uuid] = span
+            self._append_record({'uuid': tx_uuid, **span._asdict()})
+
+    def discard(self, tx_uuid: str):
+        """
+        Forget a transaction
+        :param tx_uuid:
+        :return:
+        """
+        with self._lock:
+            if self._spans.pop(tx_uuid, None) is not None:
+                self._append_record({'uuid': tx_uuid, 'removed': True})
+                self._compact_if_needed()
+
+    def cut(self, tx_uuid: str, span: Span = None):
+        """
+        Forget a transaction whose span has been cut out of the file, and shift the spans behind it
+        :param tx_uuid:
+        :param span: The span actually cut. Default to the recorded one
+        :return:
+        """
+        with self._lock:
+            recorded = self._spans.get(tx_uuid)
+            if span is None:
+                span = recorded
+            if span is None:
+                return
+            self._shift(tx_uuid, span)
+            self._append_record({'uuid': tx_uuid, 'cut': True, 'file': span.file, 'start': span.start,
+                                 'end': span.end})
+            self._cuts += 1
+            self._compact_if_needed()
+
+    def __contains__(self, tx_uuid: str) -> bool:
+        return tx_uuid in self._spans
+
+    def __len__(self) -> int:
+        return len(self._spans)
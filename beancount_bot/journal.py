@@ -0,0 +1,170 @@
+import contextlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import BinaryIO, Dict, List, Optional
+
+
+class _Pending:
+    """
+    An append waiting to be committed
+    """
+
+    def __init__(self, path: str, data: bytes):
+        self.path = path
+        self.data = data
+        self.start = -1
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+class GroupCommitWriter:
+    """
+    Group commit writer of account files.
+    Appends arriving within the batch window are written by a single writer with one write + fsync per file.
+    The caller that finds no writer running becomes the writer of the next batch, so no thread is kept in background.
+    """
+
+    def __init__(self, window: float = 0.0, max_batch_size: int = 64, max_open_files: int = 4):
+        """
+        :param window: Seconds the writer waits for more appends before committing
+        :param max_batch_size: Maximum appends in one batch
+        :param max_open_files: Append handles kept open, least recently used are closed first
+        """
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_open_files = max(1, max_open_files)
+        self._cond = threading.Condition()
+        self._queue: List[_Pending] = []
+        self._writing = False
+        self._file_lock = threading.RLock()
+        # path -> append handle. Guarded by _file_lock
+        self._handles: Dict[str, BinaryIO] = OrderedDict()
+
+    def append(self, path: str, data: bytes) -> int:
+        """
+        Append data to the file. Return after the data is durable
+        :param path:
+        :param data:
+        :return: Start offset of data in the file
+        """
+        pending = _Pending(path, data)
+        with self._cond:
+            self._queue.append(pending)
+            self._cond.notify_all()
+        while True:
+            with self._cond:
+                while not pending.done and self._writing:
+                    self._cond.wait()
+                if pending.done:
+                    break
+                # Become the writer, wait for the batch window
+                self._writing = True
+                deadline = time.monotonic() + self.window
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._queue[:self.max_batch_size]
+                del self._queue[:self.max_batch_size]
+            try:
+                self._commit(batch)
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+        if pending.error is not None:
+            raise pending.error
+        return pending.start
+
+    def _commit(self, batch: List[_Pending]):
+        """
+        Write a batch. Appends of the same file are joined into one write
+        :param batch:
+        :return:
+        """
+        by_path = {}
+        for pending in batch:
+            by_path.setdefault(pending.path, []).append(pending)
+        with self._file_lock:
+            for path, group in by_path.items():
+                try:
+                    f = self._handle(path)
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(b''.join(map(lambda p: p.data, group)))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    for pending in group:
+                        pending.start = offset
+                        offset += len(pending.data)
+                except BaseException as e:
+                    self._close(path)
+                    for pending in group:
+                        pending.error = e
+                finally:
+                    for pending in group:
+                        pending.done = True
+
+    def _handle(self, path: str) -> BinaryIO:
+        """
+        Get the append handle of a file. Called with _file_lock held.
+        A handle is reopened if the file was replaced or removed since it was opened
+        :param path:
+        :return:
+        """
+        f = self._handles.get(path)
+        if f is not None:
+            try:
+                st = os.stat(path)
+                fst = os.fstat(f.fileno())
+                if (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino):
+                    self._handles.move_to_end(path)
+                    return f
+            except FileNotFoundError:
+                pass
+            self._close(path)
+        f = open(path, 'ab')
+        self._handles[path] = f
+        while len(self._handles) > self.max_open_files:
+            self._close(next(iter(self._handles)))
+        return f
+
+    def _close(self, path: str):
+        """
+        Close the append handle of a file
+        :param path:
+        :return:
+        """
+        f = self._handles.pop(path, None)
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def _close_all(self):
+        for path in list(self._handles.keys()):
+            self._close(path)
+
+    def close(self):
+        """
+        Close all append handles
+        :return:
+        """
+        with self._file_lock:
+            self._close_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Block commits while the account files are rewritten, so that no append goes to a replaced file.
+        Append handles are dropped afterwards, as the files may have been replaced
+        :return:
+        """
+        with self._file_lock:
+            try:
+                yield
+            finally:
+                self._close_all()
@@ -0,0 +1,185 @@
+import glob
+import hashlib
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from beancount.core.data import Directive, BeancountError
+from beancount.parser import parser
+
+from beancount_bot.config import get_global, GLOBAL_LEDGER
+
+# Bytes before the consumed offset that must be unchanged for the file to be parsed incrementally
+GUARD_SIZE = 4096
+
+
+class _FileState(NamedTuple):
+    """
+    Parsed content of an account file.
+    The last directive may still be continued by later appends, so the content is consumed
+    only up to its first line and it is parsed again with the next tail
+    """
+    entries: List[Directive]
+    errors: List[BeancountError]
+    # Entries and errors before offset
+    stable_entries: int
+    stable_errors: int
+    # Bytes and lines consumed
+    offset: int
+    lines: int
+    # Hash of the GUARD_SIZE bytes before offset
+    guard: str
+    # Paths of include directives, as written
+    includes: Tuple[str, ...]
+    # Identity of the file when it was parsed
+    dev: int
+    ino: int
+    size: int
+    mtime_ns: int
+
+
+_EMPTY = _FileState([], [], 0, 0, 0, 0, '', (), 0, 0, -1, 0)
+
+
+def _guard(data: bytes) -> str:
+    return hashlib.sha1(data[-GUARD_SIZE:]).hexdigest()
+
+
+def _last_directive(data: bytes) -> int:
+    """
+    Start of the last line that begins a directive. Indented lines and comments continue a directive
+    :param data: Complete lines
+    :return:
+    """
+    pos = len(data)
+    while pos > 0:
+        start = data.rfind(b'\n', 0, pos - 1) + 1
+        if data[start:start + 1].isalnum():
+            return start
+        pos = start
+    return 0
+
+
+def _lineno(meta: Optional[dict]) -> int:
+    return meta.get('lineno', 0) if meta is not None else 0
+
+
+class Ledger:
+    """
+    Parsed account files. When a file grows, only the new content is parsed.
+    It is parsed from scratch when it was replaced (inode), truncated (size) or edited in place (mtime)
+    """
+
+    def __init__(self):
+        self._files: Dict[str, _FileState] = {}
+        self._lock = threading.RLock()
+        # Statistics
+        self.full_parses = 0
+        self.tail_parses = 0
+
+    def load(self, path: str) -> Tuple[List[Directive], List[BeancountError]]:
+        """
+        Get the entries of an account file
+        :param path:
+        :return: entries and errors in file order. The lists must not be modified
+        """
+        path = os.path.realpath(path)
+        with self._lock:
+            state = self._refresh(path, self._files.get(path))
+            self._files[path] = state
+            return state.entries, state.errors
+
+    def load_tree(self, path: str) -> Dict[str, List[Directive]]:
+        """
+        Get the entries of an account file and the files it includes, recursively
+        :param path:
+        :return: path -> entries. Missing included files are skipped
+        """
+        tree = {}
+        pending = [os.path.realpath(path)]
+        while len(pending) > 0:
+            path = pending.pop()
+            if path in tree:
+                continue
+            with self._lock:
+                state = self._refresh(path, self._files.get(path))
+                self._files[path] = state
+            tree[path] = state.entries
+            for include in state.includes:
+                pattern = os.path.join(os.path.dirname(path), include)
+                pending.extend(os.path.realpath(p) for p in sorted(glob.glob(pattern)))
+        return tree
+
+    def invalidate(self, path: Optional[str] = None):
+        """
+        Forget the parsed content of a file, or all files
+        :param path:
+        :return:
+        """
+        with self._lock:
+            if path is None:
+                self._files.clear()
+            else:
+                self._files.pop(os.path.realpath(path), None)
+
+    def _refresh(self, path: str, state: Optional[_FileState]) -> _FileState:
+        """
+        Bring the parsed content up to date with the file
+        :param path:
+        :param state:
+        :return:
+        """
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if state is not None and (state.dev, state.ino) == (st.st_dev, st.st_ino) and st.st_size >= state.offset:
+                if (state.size, state.mtime_ns) == (st.st_size, st.st_mtime_ns):
+                    return state
+                # Check that the consumed part is unchanged
+                guard_start = max(0, state.offset - GUARD_SIZE)
+                f.seek(guard_start)
+                data = f.read(st.st_size - guard_start)
+                consumed = state.offset - guard_start
+                if _guard(data[:consumed]) == state.guard:
+                    self.tail_parses += 1
+                    return self._parse(path, state, data[:consumed], data[consumed:], st)
+            self.full_parses += 1
+            f.seek(0)
+            return self._parse(path, _EMPTY, b'', f.read(st.st_size), st)
+
+    @staticmethod
+    def _parse(path: str, state: _FileState, before: bytes, tail: bytes, st: os.stat_result) -> _FileState:
+        """
+        Parse the content after the consumed part
+        :param path:
+        :param state:
+        :param before: Bytes before the consumed offset, for the guard
+        :param tail: Bytes after the consumed offset
+        :param st:
+        :return:
+        """
+        # An incomplete last line is left for the next time
+        end = tail.rfind(b'\n') + 1
+        new_entries, new_errors, options = parser.parse_string(tail[:end], report_filename=path,
+                                                          report_firstline=state.lines + 1)
+        boundary = _last_directive(tail[:end])
+        lines = state.lines + tail.count(b'\n', 0, boundary)
+        # In file order. The parser sorts entries by date
+        new_entries.sort(key=lambda e: _lineno(e.meta))
+        new_errors.sort(key=lambda e: _lineno(e.source))
+        stable_entries = state.stable_entries + sum(1 for e in new_entries if _lineno(e.meta) <= lines)
+        stable_errors = state.stable_errors + sum(1 for e in new_errors if _lineno(e.source) <= lines)
+        # New lists, callers may still hold the old ones
+        return _FileState(state.entries[:state.stable_entries] + new_entries,
+                          state.errors[:state.stable_errors] + new_errors,
+                          stable_entries, stable_errors,
+                          state.offset + boundary, lines, _guard(before + tail[:boundary]),
+                          tuple(dict.fromkeys(state.includes + tuple(options['include']))),
+                          st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def get_ledger() -> Ledger:
+    """
+    Get the shared ledger
+    :return:
+    """
+    return get_global(GLOBAL_LEDGER, Ledger)
@@ -1,42 +1,138 @@
 import click
 
-from beancount_bot import bot, config as conf, __VERSION__
+from beancount_bot import config as conf, __VERSION__
 from beancount_bot.config import load_config, get_config
 from beancount_bot.i18n import _
-from beancount_bot.session import load_session
-from beancount_bot.task import load_task, start_schedule_thread
-from beancount_bot.transaction import get_manager
+from beancount_bot.startup import StartupProfile, phase
 from beancount_bot.util import logger
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.version_option(__VERSION__, '-V', '--version', help=_("Display version information"))
 @click.help_option(help=_("Display help information"))
 @click.option('-c', '--config', default='beancount_bot.yml', help=_("Profile path"))
-def main(config):
+@click.option('-r', '--runtime', type=click.Choice(['sync', 'async']), default=None,
+              help=_("Serving runtime. Override bot.runtime in the profile"))
+@click.option('-w', '--webhook', is_flag=True, default=False,
+              help=_("Receive updates by webhook. Same as bot.webhook.enabled in the profile"))
+@click.option('--profile-startup', is_flag=True, default=False,
+              help=_("Print the time spent in each phase of the startup"))
+@click.pass_context
+def main(ctx, config, runtime, webhook, profile_startup):
     """
     Telegram robot for Beancount
     """
+    profile = StartupProfile(lambda report: click.echo(report, err=True)) if profile_startup else None
+    serving = ctx.invoked_subcommand is None
+    if serving:
+        # Bot modules are only imported when serving. Importing telebot resets the log level, so before setting it
+        with phase(profile, 'imports'):
+            from beancount_bot import bot
     logger.setLevel('INFO')
     # Load configuration
     logger.info("Load configuration：%s", config)
     conf.config_file = config
-    load_config()
+    with phase(profile, 'config load'):
+        load_config()
     # Set log level
     logger.setLevel(get_config('log.level', 'INFO'))
+    if not serving:
+        return
+    from beancount_bot.session import load_session, flush_session
+    from beancount_bot.task import get_task, start_scheduler
+    from beancount_bot.transaction import get_manager
     # Load session
     logger.info("Load session...")
-    load_session()
+    with phase(profile, 'session load'):
+        load_session()
     # Create a management object
     logger.info("Create a management object...")
-    get_manager()
+    with phase(profile, 'get_manager'):
+        get_manager()
     # Load timing task
     logger.info("Load timing task...")
-    load_task()
-    start_schedule_thread()
+    with phase(profile, 'load_task'):
+        get_task()
+    start_scheduler(get_config('bot.schedule_workers', 2))
+    if get_config('metrics.enabled', False):
+        from beancount_bot import metrics
+        listen, port = get_config('metrics.listen', '127.0.0.1'), get_config('metrics.port', 9464)
+        logger.info("Serve metrics at http://%s:%s/metrics", listen, port)
+        metrics.start_server(listen, port)
+    if get_config('profiler.enabled', False):
+        from beancount_bot import profiler
+        profiler.enable(get_config('profiler.sample_rate', 0.01), get_config('profiler.capacity', 100),
+                        get_config('profiler.cprofile', True))
+    if get_config('bot.watch_config', False):
+        from beancount_bot.reload import start_config_watcher
+        logger.info("Watch configuration...")
+        start_config_watcher(get_config('bot.watch_interval', 1.0))
     # start up
-    logger.info("start up Bot...")
-    bot.serving()
+    if runtime is None:
+        runtime = get_config('bot.runtime', 'sync')
+    logger.info("start up Bot（%s）...", runtime)
+    _exit_on_sigterm()
+    try:
+        if webhook or get_config('bot.webhook.enabled', False):
+            from beancount_bot import webhook as webhook_server
+            if profile is not None:
+                # Updates are pushed, there is no poll
+                profile.finish()
+            webhook_server.serving(runtime)
+        elif runtime == 'async':
+            from beancount_bot import async_bot
+            if profile is not None:
+                profile.until_first_poll(async_bot.bot)
+            async_bot.serving()
+        else:
+            if profile is not None:
+                profile.until_first_poll(bot.bot)
+            bot.serving()
+    finally:
+        # Session changes still waiting for the write-behind delay
+        flush_session()
+
+
+def _exit_on_sigterm():
+    """
+    Exit on SIGTERM (e.g. stopping a container) as on Ctrl-C, so that pending changes are written
+    :return:
+    """
+    import signal
+
+    def handler(signum, frame):
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+@main.command('import')
+@click.help_option(help=_("Display help information"))
+@click.argument('statement_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('-f', '--format', 'file_format', type=click.Choice(['csv', 'ofx']), default=None,
+              help=_("Statement format. Guessed by the file extension by default"))
+@click.option('-s', '--statement', default=None,
+              help=_("Trading statement of a row. Override importer.statement in the profile"))
+@click.option('--date-field', default=None, help=_("Field of the transaction date. Override importer.date_field"))
+@click.option('--date-format', default=None, help=_("Format of the transaction date. Override importer.date_format"))
+def import_statement(statement_file, file_format, statement, date_field, date_format):
+    """
+    Import a bank statement into the account
+    """
+    from beancount_bot import importer
+    from beancount_bot.transaction import get_manager
+    if file_format is None:
+        file_format = importer.guess_format(statement_file)
+    statement_importer = importer.create_importer(get_manager(), statement, date_field, date_format)
+
+    def on_progress(report):
+        click.echo(_("{rows} rows, {rate:.0f} rows/s").format(rows=report.rows, rate=report.rows_per_second))
+
+    with open(statement_file, 'rb') as f:
+        report = statement_importer.run(importer.read_rows(f, file_format), on_progress)
+    for rowno, error in report.errors:
+        click.echo(_('Row {lineno}：{message}').format(lineno=rowno, message=error), err=True)
+    click.echo(str(report))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,345 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Metrics are only recorded after start_server. Until then instrumented code only checks this flag
+enabled = False
+# Traces in progress, see Trace. Durations are also measured while a trace is in progress
+tracing = 0
+
+_local = threading.local()
+_tracing_lock = threading.Lock()
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra != '':
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if len(pairs) > 0 else ''
+
+
+class Counter:
+    """
+    Monotonic counter per label values
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_labels(self.label_names, labels)} {value}' for labels, value in values]
+
+
+class Histogram:
+    """
+    Distribution of durations per label values
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, span_prefix: str = ''):
+        """
+        :param name:
+        :param documentation:
+        :param label_names:
+        :param buckets: Upper bounds in seconds, ascending
+        :param span_prefix: Prefix of the label values in traces
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.span_prefix = span_prefix
+        # label values -> (count per bucket, +Inf included, sum)
+        self._values: Dict[tuple, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            value = self._values.get(labels)
+            if value is None:
+                value = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            value[0][index] += 1
+            value[1][0] += seconds
+
+    def count(self, *labels: str) -> int:
+        value = self._values.get(labels)
+        return sum(value[0]) if value is not None else 0
+
+    def time(self, *labels: str) -> '_Timer':
+        """
+        Observe the duration of a with block
+        :param labels:
+        :return:
+        """
+        return _Timer(self, labels) if enabled or tracing > 0 else _NOOP
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total[0])) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        observe(self.histogram, time.perf_counter() - self.start, *self.labels)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NOOP = _NoopTimer()
+
+
+class Registry:
+    """
+    Metrics exposed by the HTTP endpoint
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS, span_prefix: str = '') -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets, span_prefix)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Prometheus text format
+        :return:
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines += metric.samples()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram('beancount_bot_handler_seconds', 'Time spent in update handlers', ['handler'],
+                                     span_prefix='handler ')
+HANDLER_ERRORS = REGISTRY.counter('beancount_bot_handler_errors_total', 'Exceptions raised by update handlers',
+                                  ['handler'])
+DISPATCHER_SECONDS = REGISTRY.histogram('beancount_bot_dispatcher_seconds',
+                                        'Time spent in processors. result: hit or miss', ['dispatcher', 'result'],
+                                        span_prefix='dispatcher ')
+STAGE_SECONDS = REGISTRY.histogram('beancount_bot_stage_seconds',
+                                   'Time spent in stages of a request, e.g. parse, append, set_session', ['stage'])
+TELEGRAM_SECONDS = REGISTRY.histogram('beancount_bot_telegram_request_seconds', 'Time spent in Bot API requests',
+                                      ['method'], span_prefix='telegram ')
+
+
+def observe(histogram: Histogram, seconds: float, *labels: str):
+    """
+    Record a duration in the histogram if metrics are enabled, and in the trace of this thread if any
+    :param histogram:
+    :param seconds:
+    :param labels:
+    :return:
+    """
+    if enabled:
+        histogram.observe(seconds, *labels)
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append((histogram.span_prefix + ' '.join(labels), seconds))
+
+
+def stage(name: str):
+    """
+    Observe the duration of a stage
+    :param name:
+    :return:
+    """
+    return _Timer(STAGE_SECONDS, (name,)) if enabled or tracing > 0 else _NOOP
+
+
+class Trace:
+    """
+    Collect the durations observed in this thread during a with block, as (labels, seconds)
+    """
+
+    def __init__(self):
+        self.spans: List[Tuple[str, float]] = []
+        self._outer = None
+
+    def __enter__(self) -> List[Tuple[str, float]]:
+        global tracing
+        with _tracing_lock:
+            tracing += 1
+        self._outer = getattr(_local, 'spans', None)
+        _local.spans = self.spans
+        return self.spans
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global tracing
+        _local.spans = self._outer
+        with _tracing_lock:
+            tracing -= 1
+
+
+def timed(func: Callable) -> Callable:
+    """
+    Observe the duration and the exceptions of an update handler, labeled by its function name
+    :param func: Function or coroutine function
+    :return:
+    """
+    name = func.__name__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not enabled:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+def _instrument_telegram():
+    """
+    Time the requests of telebot, by wrapping its request functions
+    :return:
+    """
+    from telebot import apihelper
+
+    make_request = apihelper._make_request
+
+    @functools.wraps(make_request)
+    def timed_make_request(token, method_name, *args, **kwargs):
+        with TELEGRAM_SECONDS.time(method_name):
+            return make_request(token, method_name, *args, **kwargs)
+
+    apihelper._make_request = timed_make_request
+    try:
+        from telebot import asyncio_helper
+    except ImportError:
+        # aiohttp is not installed
+        return
+    process_request = asyncio_helper._process_request
+
+    @functools.wraps(process_request)
+    async def timed_process_request(token, url, *args, **kwargs):
+        with TELEGRAM_SECONDS.time(url):
+            return await process_request(token, url, *args, **kwargs)
+
+    asyncio_helper._process_request = timed_process_request
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not logged
+        pass
+
+
+def start_server(listen: str = '127.0.0.1', port: int = 9464) -> ThreadingHTTPServer:
+    """
+    Start recording metrics and serve them at http://listen:port/metrics
+    :param listen:
+    :param port: 0 for any free port
+    :return:
+    """
+    global enabled
+    enabled = True
+    _instrument_telegram()
+    server = ThreadingHTTPServer((listen, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,211 @@
+import cProfile
+import collections
+import io
+import marshal
+import pstats
+import random
+import threading
+import time
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from beancount_bot import metrics
+from beancount_bot.util import logger
+
+
+class Profile(NamedTuple):
+    """
+    Profile of a sampled call
+    """
+    # Profiled method, e.g. create_from_str
+    name: str
+    # Unix time of the call
+    started: float
+    seconds: float
+    # Durations of the stages, see metrics.stage
+    spans: List[Tuple[str, float]]
+    # None if cProfile is not used or another profiler is active
+    stats: Optional[pstats.Stats]
+
+
+class _Sample:
+    """
+    Profile a call and keep the result
+    """
+
+    def __init__(self, profiler: 'HotPathProfiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self.trace = metrics.Trace()
+        self.profile: Optional[cProfile.Profile] = None
+
+    def __enter__(self):
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.trace.__enter__()
+        if self.profiler.use_cprofile:
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is active in this thread
+                self.profile = None
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.profile is not None:
+            self.profile.disable()
+        seconds = time.perf_counter() - self.start
+        self.trace.__exit__(exc_type, exc_val, exc_tb)
+        stats = pstats.Stats(self.profile) if self.profile is not None else None
+        self.profiler.add(Profile(self.name, self.started, seconds, self.trace.spans, stats))
+
+
+class _NoSample:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NO_SAMPLE = _NoSample()
+
+
+class HotPathProfiler:
+    """
+    Profile a fraction of the calls and keep the last profiles
+    """
+
+    def __init__(self, sample_rate: float = 0.01, capacity: int = 100, use_cprofile: bool = True):
+        """
+        :param sample_rate: Fraction of the calls profiled
+        :param capacity: Profiles kept
+        :param use_cprofile: Profile functions with cProfile. Otherwise only stages are timed, which costs less
+        """
+        self.sample_rate = sample_rate
+        self.use_cprofile = use_cprofile
+        self.profiles: Deque[Profile] = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def sample(self, name: str):
+        """
+        Profile a with block if it is sampled
+        :param name:
+        :return:
+        """
+        if random.random() >= self.sample_rate:
+            return _NO_SAMPLE
+        return _Sample(self, name)
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self.profiles.append(profile)
+
+    def clear(self):
+        with self._lock:
+            self.profiles.clear()
+
+    def snapshot(self) -> List[Profile]:
+        with self._lock:
+            return list(self.profiles)
+
+    def stats(self) -> Optional[pstats.Stats]:
+        """
+        Function statistics of all kept profiles
+        :return: None if no profile has them
+        """
+        found = [profile.stats for profile in self.snapshot() if profile.stats is not None]
+        if len(found) == 0:
+            return None
+        merged = pstats.Stats(stream=io.StringIO())
+        merged.add(*found)
+        return merged
+
+    def dump(self) -> Optional[bytes]:
+        """
+        Function statistics in the format of pstats.Stats.dump_stats, readable by pstats and snakeviz
+        :return:
+        """
+        stats = self.stats()
+        return marshal.dumps(stats.stats) if stats is not None else None
+
+    def report(self, top: int = 15) -> str:
+        """
+        Timing of calls and stages, and the functions with the most cumulative time
+        :param top: Functions shown
+        :return:
+        """
+        profiles = self.snapshot()
+        if len(profiles) == 0:
+            return 'No profile yet'
+        lines = [f'{len(profiles)} profiles, sample rate {self.sample_rate}', '']
+        lines += _timing_table('call', [(p.name, p.seconds) for p in profiles])
+        lines.append('')
+        lines += _timing_table('stage', [span for p in profiles for span in p.spans])
+        stats = self.stats()
+        if stats is not None:
+            stream = io.StringIO()
+            stats.stream = stream
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+            lines += ['', stream.getvalue().strip()]
+        return '\n'.join(lines)
+
+
+def _timing_table(title: str, timings: List[Tuple[str, float]]) -> List[str]:
+    """
+    Count, mean and max of durations per name
+    :param title:
+    :param timings:
+    :return:
+    """
+    grouped: Dict[str, List[float]] = collections.defaultdict(list)
+    for name, seconds in timings:
+        grouped[name].append(seconds)
+    width = max([len(name) for name in grouped.keys()] + [len(title)])
+    lines = [f'{title:<{width}}  {"count":>6}  {"mean ms":>9}  {"max ms":>9}']
+    for name, values in sorted(grouped.items(), key=lambda item: -sum(item[1])):
+        lines.append(f'{name:<{width}}  {len(values):>6}  {sum(values) / len(values) * 1000:>9.3f}  '
+                     f'{max(values) * 1000:>9.3f}')
+    return lines
+
+
+_profiler: Optional[HotPathProfiler] = None
+
+
+def enable(sample_rate: float = 0.01, capacity: int = 100, use_cprofile: bool = True) -> HotPathProfiler:
+    """
+    Start profiling the hot path
+    :param sample_rate:
+    :param capacity:
+    :param use_cprofile:
+    :return:
+    """
+    global _profiler
+    _profiler = HotPathProfiler(sample_rate, capacity, use_cprofile)
+    logger.info('Profiling %s of the calls', sample_rate)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Optional[HotPathProfiler]:
+    """
+    :return: None if profiling is not enabled
+    """
+    return _profiler
+
+
+def sample(name: str):
+    """
+    Profile a with block if profiling is enabled and the call is sampled
+    :param name:
+    :return:
+    """
+    if _profiler is None:
+        return _NO_SAMPLE
+    return _profiler.sample(name)
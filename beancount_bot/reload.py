@@ -0,0 +1,216 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import threading
+from typing import Dict, List, Optional
+
+from beancount_bot import config as conf_module
+from beancount_bot.accounts import create_accounts
+from beancount_bot.config import read_config, swap_globals, get_config_obj, lookup, \
+    GLOBAL_CONFIG, GLOBAL_LEDGER, GLOBAL_ACCOUNTS, GLOBAL_MANAGER, GLOBAL_TASK
+from beancount_bot.ledger import get_ledger
+from beancount_bot.task import load_task, get_task, stale_tasks, cancel_tasks
+from beancount_bot.transaction import get_manager, create_manager, create_dispatchers
+from beancount_bot.util import logger, file_signature
+
+# Configuration items of the account files. The management object is created again if one of them changed
+STORAGE_KEYS = ['transaction.beancount_file', 'transaction.index_file', 'transaction.commit_window',
+                'transaction.commit_batch_size', 'transaction.open_files']
+
+_reload_lock = threading.Lock()
+
+
+def reload_config(path: str = None) -> List[str]:
+    """
+    Load the configuration file again. Only the processors and tasks whose configuration changed are created again,
+    then all global objects are replaced at once
+    :param path: Configuration file, default config.config_file
+    :return: What changed
+    """
+    with _reload_lock:
+        old_conf = get_config_obj()
+        conf = read_config(path)
+        ledger = get_ledger()
+        old_manager = get_manager()
+        old_tasks = get_task()
+        changes = []
+
+        accounts = old_manager.accounts
+        if lookup(conf, 'transaction.main_ledger') != lookup(old_conf, 'transaction.main_ledger'):
+            accounts = create_accounts(conf, ledger)
+            changes.append('transaction.main_ledger')
+
+        sources = create_dispatchers(lookup(conf, 'transaction.message_dispatcher', []), old_manager.sources)
+        reused = set(id(d) for __, d in old_manager.sources)
+        rebuilt = [f'dispatcher {key[0]}' for key, d in sources if id(d) not in reused]
+        changes += rebuilt
+        if len(rebuilt) == 0 and [id(d) for __, d in sources] != [id(d) for __, d in old_manager.sources]:
+            # Removed or reordered
+            changes.append('transaction.message_dispatcher')
+
+        if any(lookup(conf, key) != lookup(old_conf, key) for key in STORAGE_KEYS):
+            manager = create_manager(conf, ledger, accounts, sources)
+            changes.append('transaction')
+        elif len(changes) > 0:
+            manager = old_manager.with_dispatchers(sources, accounts)
+        else:
+            manager = old_manager
+
+        tasks = load_task(lookup(conf, 'schedule', []), old_tasks)
+        stale = stale_tasks(old_tasks, tasks)
+        changes += [f'task {name}' for name, task in tasks.items() if old_tasks.get(name) is not task]
+        changes += [f'task {name}' for name in old_tasks.keys() if name not in tasks]
+
+        swap_globals({
+            GLOBAL_CONFIG: conf,
+            GLOBAL_LEDGER: ledger,
+            GLOBAL_ACCOUNTS: accounts,
+            GLOBAL_MANAGER: manager,
+            GLOBAL_TASK: tasks,
+        })
+        cancel_tasks(stale)
+        if manager.writer is not old_manager.writer:
+            old_manager.writer.close()
+        logger.info('Configuration reloaded, changed: %s', ', '.join(changes) if len(changes) > 0 else 'nothing')
+        return changes
+
+
+def watched_files() -> List[str]:
+    """
+    Configuration file and the files used by processors, e.g. template_config
+    :return:
+    """
+    files = [conf_module.config_file]
+    for key, __ in get_manager().sources:
+        files += [signature[0] for signature in key[2]]
+    return files
+
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class _Inotify:
+    """
+    Minimal inotify binding. Directories are watched, as editors often replace files instead of writing them
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self._watched = set()
+
+    def watch(self, directory: str):
+        if directory in self._watched:
+            return
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch', directory)
+        self._watched.add(directory)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for events and discard them
+        :param timeout:
+        :return: Whether something happened
+        """
+        readable, __, __ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return False
+        try:
+            while len(os.read(self.fd, 65536)) > 0:
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Reload the configuration when the configuration file or a file of a processor changes.
+    Uses inotify where available, otherwise checks the modification time every interval seconds
+    """
+
+    def __init__(self, interval: float = 1.0, debounce: float = 0.2):
+        """
+        :param interval: Seconds between checks without inotify
+        :param debounce: Seconds to wait for further changes, editors write a file in several steps
+        """
+        super().__init__(name='config-watcher', daemon=True)
+        self.interval = interval
+        self.debounce = debounce
+        self._stopped = threading.Event()
+        self._signatures: Dict[str, tuple] = self._scan()
+        try:
+            self._inotify: Optional[_Inotify] = _Inotify()
+        except (OSError, AttributeError) as e:
+            logger.info('inotify unavailable, checking the configuration every %ss: %s', interval, e)
+            self._inotify = None
+
+    @staticmethod
+    def _scan() -> Dict[str, tuple]:
+        return {path: file_signature(path) for path in watched_files()}
+
+    def _watch_directories(self):
+        for path in self._signatures.keys():
+            try:
+                self._inotify.watch(os.path.dirname(os.path.abspath(path)))
+            except OSError as e:
+                logger.warning('Unable to watch %s: %s', path, e)
+
+    def check(self) -> Optional[List[str]]:
+        """
+        Reload the configuration if a watched file changed
+        :return: What changed. None if no file changed
+        """
+        if self._scan() == self._signatures:
+            return None
+        try:
+            changes = reload_config()
+        except Exception as e:
+            # Keep the running configuration, e.g. while the file is being edited
+            logger.error('Unable to reload the configuration: %s', e)
+            changes = None
+        self._signatures = self._scan()
+        return changes
+
+    def run(self):
+        while not self._stopped.is_set():
+            if self._inotify is not None:
+                self._watch_directories()
+                if not self._inotify.wait(self.interval):
+                    continue
+            if self._stopped.wait(self.debounce if self._inotify is not None else self.interval):
+                break
+            if self._inotify is not None:
+                # Changes during the debounce
+                self._inotify.wait(0)
+            self.check()
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_config_watcher(interval: float = 1.0) -> ConfigWatcher:
+    """
+    Watch the configuration in the background
+    :param interval:
+    :return:
+    """
+    watcher = ConfigWatcher(interval)
+    watcher.start()
+    return watcher
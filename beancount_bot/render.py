@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from beancount.core.data import Transaction
+from beancount.parser import printer
+
+CACHE_SIZE = 256
+
+# id(tx) -> (tx, text). The transaction is kept so that its id is not reused while cached
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def remember(tx: Transaction, text: str):
+    """
+    Remember the text of a transaction, so that it is rendered only once
+    :param tx:
+    :param text: Beancount text starting with the transaction header, ending with a newline
+    :return:
+    """
+    with _lock:
+        _cache[id(tx)] = (tx, text)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def cached(tx: Transaction) -> Optional[str]:
+    """
+    Get the remembered text of a transaction
+    :param tx:
+    :return:
+    """
+    item = _cache.get(id(tx))
+    if item is not None and item[0] is tx:
+        return item[1]
+    return None
+
+
+def format_entry(tx: Transaction) -> str:
+    """
+    Render a transaction, or reuse its remembered text
+    :param tx:
+    :return:
+    """
+    text = cached(tx)
+    if text is None:
+        text = printer.format_entry(tx)
+        remember(tx, text)
+    return text
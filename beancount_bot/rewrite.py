@@ -0,0 +1,176 @@
+import contextlib
+import os
+import shutil
+import tempfile
+from typing import Optional, Tuple
+
+BUFFER_SIZE = 64 * 1024
+
+_copy_file_range = getattr(os, 'copy_file_range', None)
+_sendfile = getattr(os, 'sendfile', None)
+
+
+def _fsync_dir(directory: str):
+    """
+    Persist a rename in the directory. Not supported on every platform
+    :param directory:
+    :return:
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = 'wb', **kwargs):
+    """
+    Open a temporary file beside path, which replaces path after fsync when the block exits normally.
+    If the block raises, path is left untouched
+    :param path: A symbolic link is followed, the file it points to is replaced
+    :param mode: Write mode of the temporary file
+    :param kwargs: Passed to open
+    :return:
+    """
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    fd, tmp_file = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with open(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_file)
+        os.replace(tmp_file, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_file)
+        raise
+    _fsync_dir(directory)
+
+
+def _copy_range(src, dst, offset: int, count: Optional[int], buffer: bytearray):
+    """
+    Copy count bytes of src starting at offset to the current position of dst
+    Use copy_file_range / sendfile if possible, otherwise stream through buffer
+    :param src: Unbuffered source file
+    :param dst: Unbuffered destination file
+    :param offset:
+    :param count: None for copying to the end of src
+    :param buffer: Fixed-size buffer for the fallback
+    :return:
+    """
+    if count is None:
+        count = os.fstat(src.fileno()).st_size - offset
+    # Kernel-side copy
+    for copy in [_copy_file_range, _sendfile]:
+        if copy is None:
+            continue
+        try:
+            while count > 0:
+                if copy is _copy_file_range:
+                    n = copy(src.fileno(), dst.fileno(), count, offset)
+                else:
+                    n = copy(dst.fileno(), src.fileno(), offset, count)
+                if n == 0:
+                    return
+                offset += n
+                count -= n
+            return
+        except OSError:
+            # Not supported between these files. Continue from where it stops
+            continue
+    # Userspace copy
+    view = memoryview(buffer)
+    src.seek(offset)
+    while count > 0:
+        n = src.readinto(view[:min(count, len(buffer))])
+        if not n:
+            return
+        dst.write(view[:n])
+        count -= n
+
+
+def remove_span(path: str, start: int, end: int):
+    """
+    Remove bytes [start, end) of the file.
+    The file is streamed into a temporary file which then replaces it, so that memory usage is constant
+    and a crash leaves either the old or the new file
+    :param path:
+    :param start:
+    :param end:
+    :return:
+    """
+    buffer = bytearray(BUFFER_SIZE)
+    with open(path, 'rb', buffering=0) as src, atomic_open(path, 'wb', buffering=0) as dst:
+        _copy_range(src, dst, 0, start, buffer)
+        _copy_range(src, dst, end, None, buffer)
+
+
+def read_span(path: str, start: int, end: int) -> bytes:
+    """
+    Read bytes [start, end) of the file
+    :param path:
+    :param start:
+    :param end:
+    :return:
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def line_span(path: str, first_line: int, last_line: int) -> Tuple[int, int]:
+    """
+    Get the byte span of lines [first_line, last_line] (1-based) by streaming the file
+    :param path:
+    :param first_line:
+    :param last_line:
+    :return:
+    """
+    start = end = -1
+    offset = 0
+    with open(path, 'rb') as f:
+        for lineno, line in enumerate(f, 1):
+            if lineno == first_line:
+                start = offset
+            offset += len(line)
+            if lineno == last_line:
+                end = offset
+                break
+    if start == -1 or end == -1:
+        raise ValueError(f'Lines {first_line}-{last_line} out of range')
+    return start, end
+
+
+def marker_span(path: str, start_marker: bytes, end_marker: bytes) -> Optional[Tuple[int, int, bytes]]:
+    """
+    Find the first line containing start_marker and the first line containing end_marker by streaming the file
+    :param path:
+    :param start_marker:
+    :param end_marker:
+    :return: Start of the first line, end of the last line and the content between them. None if not found
+    """
+    start = end = -1
+    offset = 0
+    inner = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if start != -1 and end == -1:
+                if end_marker in line:
+                    end = offset + len(line)
+                    break
+                inner.append(line)
+            elif start == -1 and start_marker in line:
+                start = offset
+            offset += len(line)
+    if start == -1 or end == -1:
+        return None
+    return start, end, b''.join(inner)
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Set, Union
+
+from beancount.core.data import Transaction
+
+from beancount_bot import metrics
+from beancount_bot.dispatcher import Dispatcher, NotMatchException
+from beancount_bot.i18n import _
+
+
+class DispatcherStats:
+    """
+    Routing statistics of a processor
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # 解析成功
+        self.hits = 0
+        self.hit_seconds = 0.0
+        # 抛出 NotMatchException
+        self.misses = 0
+        self.miss_seconds = 0.0
+        # quick_check 未通过
+        self.skips = 0
+
+    def __repr__(self) -> str:
+        return f'DispatcherStats({self.name}: hits={self.hits}, misses={self.misses}, skips={self.skips}, ' \
+               f'hit_seconds={self.hit_seconds:.6f}, miss_seconds={self.miss_seconds:.6f})'
+
+
+def route_key(input_str: str) -> str:
+    """
+    Leading token of input, which decides the route
+    :param input_str:
+    :return:
+    """
+    words = input_str.split(None, 1)
+    return words[0] if len(words) > 0 else ''
+
+
+class DispatcherRouter:
+    """
+    Adaptive routing of processors.
+    Remember the processor that last parsed an input with the same leading token and try it early.
+    The configured priority still holds: processors before it are tried first, except those that
+    raised NotMatchException for the same leading token and decide by it alone (Dispatcher.route_by_token),
+    which are tried last.
+    """
+
+    def __init__(self, dispatchers: List[Dispatcher], cache_size: int = 1024):
+        self.dispatchers = dispatchers
+        self.cache_size = cache_size
+        self.stats = [DispatcherStats(d.get_name()) for d in dispatchers]
+        # leading token -> (index of last matched processor, indexes of processors that missed)
+        self._routes: Dict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _order(self, key: str) -> List[int]:
+        """
+        Order of processors to try
+        :param key:
+        :return:
+        """
+        with self._lock:
+            route = self._routes.get(key)
+            if route is not None:
+                self._routes.move_to_end(key)
+        if route is None:
+            return list(range(len(self.dispatchers)))
+        matched, missed = route
+        first = [i for i in range(matched) if i not in missed] + [matched]
+        return first + [i for i in range(len(self.dispatchers)) if i not in first]
+
+    def _remember(self, key: str, matched: int, missed: Set[int]):
+        """
+        Remember the route of key
+        :param key:
+        :param matched:
+        :param missed:
+        :return:
+        """
+        with self._lock:
+            self._routes[key] = (matched, frozenset(missed))
+            self._routes.move_to_end(key)
+            while len(self._routes) > self.cache_size:
+                self._routes.popitem(last=False)
+
+    def route(self, input_str: str) -> Union[Transaction, str]:
+        """
+        Parse input by the processors
+        :param input_str:
+        :return:
+        """
+        key = route_key(input_str)
+        missed = set()
+        for i in self._order(key):
+            dispatcher, stats = self.dispatchers[i], self.stats[i]
+            if not dispatcher.quick_check(input_str):
+                stats.skips += 1
+                continue
+            # Try to analyze
+            start = time.perf_counter()
+            try:
+                tx = dispatcher.process(input_str)
+            except NotMatchException:
+                # Cannot be parsed by this parser
+                elapsed = time.perf_counter() - start
+                stats.misses += 1
+                stats.miss_seconds += elapsed
+                if metrics.enabled or metrics.tracing > 0:
+                    metrics.observe(metrics.DISPATCHER_SECONDS, elapsed, stats.name, 'miss')
+                missed.add(i)
+                continue
+            elapsed = time.perf_counter() - start
+            stats.hits += 1
+            stats.hit_seconds += elapsed
+            if metrics.enabled or metrics.tracing > 0:
+                metrics.observe(metrics.DISPATCHER_SECONDS, elapsed, stats.name, 'hit')
+            self._remember(key, i, {j for j in missed if j < i and self.dispatchers[j].route_by_token})
+            return tx
+        # No match
+        raise ValueError(_("Unable to identify this trading syntax"))
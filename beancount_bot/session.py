@@ -1,14 +1,149 @@
+import atexit
 import json
 import os.path
+import sqlite3
+import threading
 from types import MappingProxyType
 from typing import Dict, Iterable
 
+from beancount_bot import metrics
 from beancount_bot.config import get_config
-from beancount_bot.util import logger
+from beancount_bot.rewrite import atomic_open
+from beancount_bot.util import logger, load_class
 
 SESS_AUTH = 'auth'
 
 _session_cache: Dict[str, dict] = {}
+_session_lock = threading.RLock()
+_store: 'SessionStore' = None
+
+
+class SessionStore:
+    """
+    Session storage backend
+    """
+
+    def load(self) -> Dict[str, dict]:
+        """
+        Read all sessions
+        :return: uid -> session
+        """
+        return {}
+
+    def set(self, sessions: Dict[str, dict], uid: str, key: str):
+        """
+        Persist a changed session value. Called with the session lock held
+        :param sessions: All sessions
+        :param uid:
+        :param key:
+        :return:
+        """
+        pass
+
+    def flush(self):
+        """
+        Write pending changes
+        :return:
+        """
+        pass
+
+
+class JsonSessionStore(SessionStore):
+    """
+    Write-behind JSON file. Changes are flushed flush_delay seconds after the first change and at exit
+    """
+
+    def __init__(self, session_file: str, flush_delay: float = 1.0):
+        self.session_file = session_file
+        self.flush_delay = flush_delay
+        self._sessions: Dict[str, dict] = {}
+        self._version = 0
+        self._written_version = 0
+        self._timer: threading.Timer = None
+        self._write_lock = threading.Lock()
+
+    def load(self) -> Dict[str, dict]:
+        if not os.path.exists(self.session_file):
+            return {}
+        with open(self.session_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def set(self, sessions: Dict[str, dict], uid: str, key: str):
+        self._sessions = sessions
+        self._version += 1
+        if self.flush_delay <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with _session_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            version = self._version
+            if version == self._written_version:
+                return
+            data = json.dumps(self._sessions)
+        with self._write_lock:
+            # 避免旧快照覆盖新快照
+            if version <= self._written_version:
+                return
+            with atomic_open(self.session_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+            self._written_version = version
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    SQLite database. Each change updates a single row
+    """
+
+    def __init__(self, session_file: str):
+        self._conn = sqlite3.connect(session_file, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS session ('
+                           'uid TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (uid, key))')
+        self._conn.commit()
+
+    def load(self) -> Dict[str, dict]:
+        sessions = {}
+        for uid, key, value in self._conn.execute('SELECT uid, key, value FROM session'):
+            sessions.setdefault(uid, {})[key] = json.loads(value)
+        return sessions
+
+    def set(self, sessions: Dict[str, dict], uid: str, key: str):
+        self._conn.execute('INSERT OR REPLACE INTO session (uid, key, value) VALUES (?, ?, ?)',
+                           (uid, key, json.dumps(sessions[uid][key])))
+        self._conn.commit()
+
+
+def create_store() -> SessionStore:
+    """
+    Create the session backend from configuration
+    :return:
+    """
+    backend = get_config('bot.session_backend', 'json')
+    session_file = get_config('bot.session_file')
+    if backend == 'json':
+        return JsonSessionStore(session_file, get_config('bot.session_flush_delay', 1.0))
+    elif backend == 'sqlite':
+        return SqliteSessionStore(session_file)
+    else:
+        # Third-party backend
+        return load_class(backend)(session_file)
+
+
+def get_store() -> SessionStore:
+    """
+    Get the session backend
+    :return:
+    """
+    global _store
+    if _store is None:
+        _store = create_store()
+    return _store
 
 
 def load_session():
@@ -16,12 +151,13 @@ def load_session():
     Restore session data from file
     :return:
     """
-    global _session_cache
-    session_file = get_config('bot.session_file')
-    if os.path.exists(session_file):
-        with open(session_file, 'r', encoding='utf-8') as f:
-            _session_cache = json.load(f)
-        logger.debug("Restore session from file %s", _session_cache)
+    global _session_cache, _store
+    if _store is not None:
+        _store.flush()
+    _store = create_store()
+    with _session_lock:
+        _session_cache = _store.load()
+    logger.debug("Restore session from file %s", _session_cache)
 
 
 def get_session_for(uid: int) -> MappingProxyType:
@@ -31,9 +167,9 @@ def get_session_for(uid: int) -> MappingProxyType:
     :return:
     """
     uid = str(uid)
-    if uid not in _session_cache:
-        _session_cache[uid] = {}
-    return MappingProxyType(_session_cache[uid])
+    with _session_lock:
+        session = _session_cache.setdefault(uid, {})
+    return MappingProxyType(session)
 
 
 def get_session(uid: int, key: str, default_value=None) -> object:
@@ -45,11 +181,9 @@ def get_session(uid: int, key: str, default_value=None) -> object:
     :return:
     """
     uid = str(uid)
-    if uid not in _session_cache:
-        _session_cache[uid] = {}
-    if key not in _session_cache[uid]:
-        return default_value
-    return _session_cache[uid][key]
+    with _session_lock:
+        session = _session_cache.setdefault(uid, {})
+    return session.get(key, default_value)
 
 
 def set_session(uid: int, key: str, value: object):
@@ -61,13 +195,25 @@ def set_session(uid: int, key: str, value: object):
     :return:
     """
     uid = str(uid)
-    if uid not in _session_cache:
-        _session_cache[uid] = {}
-    _session_cache[uid][key] = value
-    # 保存缓存
-    session_file = get_config('bot.session_file')
-    with open(session_file, 'w', encoding='utf-8') as f:
-        json.dump(_session_cache, f)
+    with metrics.stage('set_session'), _session_lock:
+        if uid not in _session_cache:
+            _session_cache[uid] = {}
+        _session_cache[uid][key] = value
+        # 保存缓存
+        get_store().set(_session_cache, uid, key)
+
+
+def flush_session():
+    """
+    Write pending session changes
+    :return:
+    """
+    if _store is not None:
+        _store.flush()
+
+
+# Previous stores are flushed by load_session
+atexit.register(flush_session)
 
 
 def all_user(auth=True) -> Iterable[int]:
@@ -0,0 +1,80 @@
+import contextlib
+import functools
+import time
+from typing import Callable, List, Optional, Tuple
+
+
+class StartupProfile:
+    """
+    Time spent in each phase of the startup
+    """
+
+    def __init__(self, output: Callable[[str], None] = print):
+        """
+        :param output: Receives the report once the startup is finished
+        """
+        self.output = output
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Time a phase
+        :param name:
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def until_first_poll(self, bot):
+        """
+        Time the serving setup until the bot requests its first updates, then output the report.
+        Works for TeleBot and AsyncTeleBot, which both poll through their get_updates
+        :param bot:
+        :return:
+        """
+        start = time.perf_counter()
+        get_updates = bot.get_updates
+
+        @functools.wraps(get_updates)
+        def first_get_updates(*args, **kwargs):
+            # Later polls use the method of the class again
+            del bot.get_updates
+            self.phases.append(('first poll', time.perf_counter() - start))
+            self.finish()
+            return get_updates(*args, **kwargs)
+
+        bot.get_updates = first_get_updates
+
+    def report(self) -> str:
+        """
+        Timing breakdown
+        :return:
+        """
+        total = time.perf_counter() - self.started
+        width = max([len(name) for name, __ in self.phases] + [len('total')])
+        lines = [f'{name:<{width}}  {seconds * 1000:9.1f} ms' for name, seconds in self.phases]
+        lines.append(f'{"total":<{width}}  {total * 1000:9.1f} ms')
+        return '\n'.join(lines)
+
+    def finish(self):
+        self.output(self.report())
+
+
+@contextlib.contextmanager
+def phase(profile: Optional[StartupProfile], name: str):
+    """
+    Time a phase if profiling
+    :param profile: None if not profiling
+    :param name:
+    :return:
+    """
+    if profile is None:
+        yield
+    else:
+        with profile.phase(name):
+            yield
@@ -1,14 +1,20 @@
+import datetime
+import functools
+import heapq
+import itertools
 import threading
-import time
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Iterable, Optional, Set, Tuple, TYPE_CHECKING
 
 import schedule
-from telebot import TeleBot
 
 from beancount_bot.config import get_config, get_global, GLOBAL_TASK
 from beancount_bot.util import logger, load_class
 
-_schedule_thread: threading.Thread = None
+if TYPE_CHECKING:
+    from telebot import TeleBot
+
+_scheduler: Optional['Scheduler'] = None
 
 
 class ScheduleTask:
@@ -22,6 +28,8 @@ class ScheduleTask:
         构造函数参数通过 **kwargs 形式传入
         """
         self.config = None
+        # 注册的定时任务，重载时取消
+        self.jobs: List[schedule.Job] = []
 
     def register(self, fire: callable):
         """
@@ -30,7 +38,7 @@ class ScheduleTask:
         """
         pass
 
-    def trigger(self, bot: TeleBot):
+    def trigger(self, bot: 'TeleBot'):
         """
         触发任务。任务可通过两种方式触发：定时执行（register 中注册）、/task 任务名
         :param bot: Bot 对象
@@ -38,28 +46,64 @@ class ScheduleTask:
         pass
 
 
-def load_task() -> Dict[str, ScheduleTask]:
+def load_task(confs: List[dict] = None, previous: Dict[str, ScheduleTask] = None) -> Dict[str, ScheduleTask]:
     """
     加载定时任务
+    :param confs: 任务配置，默认为 schedule 配置项
+    :param previous: 已加载的任务。配置未变化的任务将被复用，其余任务需由调用方通过 cancel_tasks 取消
     :return:
     """
     from beancount_bot.bot import bot
     ret = {}
-    schedule.clear()
-    for conf in get_config('schedule', []):
+    if confs is None:
+        confs = get_config('schedule', [])
+    if previous is None:
+        schedule.clear()
+        previous = {}
+    for conf in confs:
         name = conf['name']
+        old_task = previous.get(name)
+        if old_task is not None and old_task.config == conf:
+            ret[name] = old_task
+            continue
         clazz = load_class(conf['class'])
         args = conf['args']
 
         logger.info('注册定时任务：%s', name)
         task: ScheduleTask = clazz(**args)
-        task.register(lambda capture_task=task: capture_task.trigger(bot))
+        registered = set(schedule.jobs)
+        task.register(lambda capture_task=task: _fire(capture_task, bot))
+        task.jobs = [job for job in schedule.jobs if job not in registered]
         task.config = conf
 
         ret[name] = task
+    wake_scheduler()
     return ret
 
 
+def stale_tasks(previous: Dict[str, ScheduleTask], current: Dict[str, ScheduleTask]) -> List[ScheduleTask]:
+    """
+    重载后不再使用的任务
+    :param previous:
+    :param current:
+    :return:
+    """
+    kept = set(id(task) for task in current.values())
+    return [task for task in previous.values() if id(task) not in kept]
+
+
+def cancel_tasks(tasks: Iterable[ScheduleTask]):
+    """
+    取消任务注册的定时执行
+    :param tasks:
+    :return:
+    """
+    for task in tasks:
+        for job in getattr(task, 'jobs', []):
+            schedule.cancel_job(job)
+    wake_scheduler()
+
+
 def get_task() -> Dict[str, ScheduleTask]:
     """
     获得任务
@@ -68,22 +112,212 @@ def get_task() -> Dict[str, ScheduleTask]:
     return get_global(GLOBAL_TASK, load_task)
 
 
-def start_schedule_thread(interval=5) -> threading.Thread:
+def _task_name(task: ScheduleTask) -> str:
+    return task.config['name'] if task.config is not None else type(task).__name__
+
+
+def _fire(task: ScheduleTask, bot: 'TeleBot'):
+    """
+    定时触发任务。调度线程运行时交由其线程池执行，否则直接执行
+    :param task:
+    :param bot:
+    :return:
+    """
+    if _scheduler is not None:
+        _scheduler.submit(task, bot)
+    else:
+        task.trigger(bot)
+
+
+def _call_logged(job_func: callable):
+    try:
+        return job_func()
+    except Exception:
+        logger.exception('定时任务执行失败：%s', getattr(job_func, '__name__', job_func))
+
+
+class Scheduler(threading.Thread):
+    """
+    调度线程。job 按下次执行时间放入堆中，线程休眠至最早的 job 到期，或被 wake 唤醒（任务重载时）。
+    任务在有限大小的线程池中执行，同一任务上次执行未结束时跳过本次执行
+    """
+
+    def __init__(self, max_workers: int = 2, max_idle: float = 300):
+        """
+        :param max_workers: 同时执行的任务数
+        :param max_idle: 最长休眠秒数。job 的执行时间为本地时间，系统时间调整后最迟在此时间后重新计算
+        """
+        super().__init__(name='schedule', daemon=True)
+        self.max_idle = max_idle
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='task')
+        self._cond = threading.Condition()
+        # (下次执行时间, 序号, job)
+        self._heap: List[Tuple[datetime.datetime, int, schedule.Job]] = []
+        self._seq = itertools.count()
+        self._changed = True
+        self._stopped = False
+        # 执行中的任务
+        self._running: Set[ScheduleTask] = set()
+
+    def wake(self):
+        """
+        job 有增减时调用，重新读取 schedule.jobs
+        :return:
+        """
+        with self._cond:
+            self._changed = True
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._executor.shutdown(wait=False)
+
+    def _acquire(self, task: ScheduleTask) -> bool:
+        """
+        标记任务正在执行
+        :param task:
+        :return: 任务已在执行时为 False
+        """
+        with self._cond:
+            if task in self._running:
+                logger.warning('定时任务仍在执行，跳过本次触发：%s', _task_name(task))
+                return False
+            self._running.add(task)
+            return True
+
+    def _release(self, task: ScheduleTask):
+        with self._cond:
+            self._running.discard(task)
+
+    def submit(self, task: ScheduleTask, bot: 'TeleBot') -> bool:
+        """
+        在线程池中执行任务
+        :param task:
+        :param bot:
+        :return: 任务上次执行未结束时为 False，本次不执行
+        """
+        if not self._acquire(task):
+            return False
+        self._executor.submit(self._trigger, task, bot)
+        return True
+
+    def trigger(self, task: ScheduleTask, bot: 'TeleBot') -> bool:
+        """
+        在当前线程执行任务，如 /task 任务名
+        :param task:
+        :param bot:
+        :return: 任务正在执行时为 False，本次不执行
+        """
+        if not self._acquire(task):
+            return False
+        try:
+            task.trigger(bot)
+        finally:
+            self._release(task)
+        return True
+
+    def _trigger(self, task: ScheduleTask, bot: 'TeleBot'):
+        try:
+            task.trigger(bot)
+        except Exception:
+            logger.exception('定时任务执行失败：%s', _task_name(task))
+        finally:
+            self._release(task)
+
+    def _push(self, job: schedule.Job):
+        if job.next_run is not None:
+            heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+
+    def _due_jobs(self) -> List[schedule.Job]:
+        """
+        取出到期的 job。没有到期的 job 时休眠
+        :return:
+        """
+        with self._cond:
+            if self._changed:
+                self._changed = False
+                self._heap = []
+                for job in schedule.jobs:
+                    self._push(job)
+            now = datetime.datetime.now()
+            due = []
+            while len(self._heap) > 0 and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+            if len(due) == 0:
+                timeout = self.max_idle
+                if len(self._heap) > 0:
+                    timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                self._cond.wait(timeout)
+            return due
+
+    def _run_job(self, job: schedule.Job):
+        """
+        执行 job 并重新放入堆中。任务的 job 只提交到线程池，不会阻塞
+        :param job:
+        :return:
+        """
+        if job not in schedule.jobs:
+            # 已取消
+            return
+        job_func = job.job_func
+        # 出错时 job.run 仍计算下次执行时间
+        job.job_func = functools.update_wrapper(functools.partial(_call_logged, job_func), job_func)
+        try:
+            ret = job.run()
+        finally:
+            job.job_func = job_func
+        if isinstance(ret, schedule.CancelJob) or ret is schedule.CancelJob:
+            schedule.cancel_job(job)
+            return
+        with self._cond:
+            self._push(job)
+
+    def run(self):
+        while not self._stopped:
+            for job in self._due_jobs():
+                self._run_job(job)
+
+
+def wake_scheduler():
+    """
+    唤醒调度线程，使增减的 job 生效
+    :return:
+    """
+    if _scheduler is not None:
+        _scheduler.wake()
+
+
+def start_scheduler(max_workers: int = 2) -> Scheduler:
     """
     运行定时任务
-    :param interval:
+    :param max_workers: 同时执行的任务数
     :return:
     """
+    global _scheduler
+    _scheduler = Scheduler(max_workers)
+    _scheduler.start()
+    return _scheduler
 
-    class ScheduleThread(threading.Thread):
-        @classmethod
-        def run(cls):
-            while True:
-                schedule.run_pending()
-                time.sleep(interval)
 
-    global _schedule_thread
-    _schedule_thread = ScheduleThread()
-    _schedule_thread.setDaemon(True)
-    _schedule_thread.start()
-    return _schedule_thread
+def start_schedule_thread(interval=5) -> threading.Thread:
+    """
+    运行定时任务。兼容旧接口，任务到期时即执行，不再轮询
+    :param interval: 不再使用
+    :return:
+    """
+    return start_scheduler()
+
+
+def trigger_task(task: ScheduleTask, bot: 'TeleBot') -> bool:
+    """
+    立即执行任务，如 /task 任务名。与定时执行相同，任务正在执行时不重复执行
+    :param task:
+    :param bot:
+    :return: 任务正在执行时为 False
+    """
+    if _scheduler is not None:
+        return _scheduler.trigger(task, bot)
+    task.trigger(bot)
+    return True
@@ -1,17 +1,26 @@
 import copy
 import datetime
+import glob
+import json
 import os
 import time
 import uuid
-from typing import List, Tuple, Union
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 from beancount.core.data import Transaction
-from beancount.parser import printer, parser
+from beancount.parser import parser
 
-from beancount_bot.config import get_global, GLOBAL_MANAGER, get_config
-from beancount_bot.dispatcher import Dispatcher
+from beancount_bot import metrics, profiler, render, rewrite
+from beancount_bot.accounts import AccountIndex, get_accounts
+from beancount_bot.config import get_global, GLOBAL_MANAGER, get_config_obj, lookup
+# NotMatchException 仍从此模块导出，兼容插件
+from beancount_bot.dispatcher import Dispatcher, NotMatchException
 from beancount_bot.i18n import _
-from beancount_bot.util import load_class
+from beancount_bot.index import TransactionIndex, Span, content_hash
+from beancount_bot.journal import GroupCommitWriter
+from beancount_bot.ledger import Ledger, get_ledger
+from beancount_bot.router import DispatcherRouter
+from beancount_bot.util import load_class, logger, file_signature
 
 META_UUID = 'tgbot_uuid'
 META_TIME = 'tgbot_time'
@@ -19,8 +28,14 @@ META_TIME = 'tgbot_time'
 Uuid = str
 
 
-class NotMatchException(Exception):
-    pass
+class BatchLine(NamedTuple):
+    """
+    Result of a line in a batch
+    """
+    lineno: int
+    text: str
+    tx: Union[Transaction, str, None]
+    error: Optional[str]
 
 
 class TransactionManager:
@@ -28,9 +43,36 @@ class TransactionManager:
     Transaction information management
     """
 
-    def __init__(self, dispatchers: List[Dispatcher], bean_file: str):
-        self.dispatchers = dispatchers
+    def __init__(self, dispatchers: List[Dispatcher], bean_file: str, index_file: str = None,
+                 writer: GroupCommitWriter = None, ledger: Ledger = None, accounts: AccountIndex = None):
+        self.router = DispatcherRouter(dispatchers)
+        # (configuration key, processor), to reuse unchanged processors on reload
+        self.sources: List[Tuple[tuple, Dispatcher]] = []
         self.__bean_file = bean_file
+        self._resolver = BeanFileResolver(bean_file)
+        self.index = TransactionIndex(index_file)
+        self.writer = writer if writer is not None else GroupCommitWriter()
+        self.ledger = ledger if ledger is not None else Ledger()
+        # Accounts of the main ledger. None disables account validation
+        self.accounts = accounts
+
+    @property
+    def dispatchers(self) -> List[Dispatcher]:
+        return self.router.dispatchers
+
+    def with_dispatchers(self, sources: List[Tuple[tuple, Dispatcher]],
+                         accounts: Optional[AccountIndex]) -> 'TransactionManager':
+        """
+        Copy of the manager with other processors and accounts. Account files, index and writer are shared
+        :param sources: (configuration key, processor)
+        :param accounts:
+        :return:
+        """
+        manager = copy.copy(self)
+        manager.router = DispatcherRouter([d for __, d in sources])
+        manager.sources = sources
+        manager.accounts = accounts
+        return manager
 
     def create(self, tx: Union[Transaction, str]) -> Tuple[Uuid, Union[Transaction, str]]:
         """
@@ -38,23 +80,57 @@ class TransactionManager:
         :param tx:
         :return:
         """
+        self.validate(tx)
         tx_uuid = Uuid(uuid.uuid4())
-        if isinstance(tx, str):
-            # Save to the account
-            with open(self.bean_file, 'a+', encoding='utf-8') as f:
-                f.write(f"; TGBOT_START {tx_uuid}\n{tx}\n; TGBOT_END {tx_uuid}\n")
-            return tx_uuid, tx
-        elif isinstance(tx, Transaction):
-            # Add control metadata
-            tx = copy.deepcopy(tx)
-            tx.meta[META_UUID] = tx_uuid
-            tx.meta[META_TIME] = str(datetime.datetime.now())
-            # Save to the account
-            with open(self.bean_file, 'a+', encoding='utf-8') as f:
-                printer.print_entry(tx, file=f)
-            return tx_uuid, tx
-        else:
-            raise ValueError()
+        text, tx = _to_text(tx_uuid, tx)
+        # Save to the account
+        self._append(tx_uuid, text)
+        return tx_uuid, tx
+
+    def create_batch(self, txs: List[Union[Transaction, str]], validate: bool = True) \
+            -> Tuple[Uuid, List[Tuple[Uuid, Union[Transaction, str]]]]:
+        """
+        Create transactions with a single append. The batch is wrapped in comments,
+        so that it can be withdrawn as a whole by the batch uuid
+        :param txs:
+        :param validate: False if the transactions are already validated
+        :return: batch uuid, created transactions
+        """
+        if validate:
+            for tx in txs:
+                self.validate(tx)
+        batch_uuid = Uuid(uuid.uuid4())
+        texts, created = [], []
+        for tx in txs:
+            tx_uuid = Uuid(uuid.uuid4())
+            text, tx = _to_text(tx_uuid, tx)
+            texts.append(text)
+            created.append((tx_uuid, tx))
+        self._append(batch_uuid, _wrap(batch_uuid, ''.join(texts)[:-1]))
+        return batch_uuid, created
+
+    def validate(self, tx: Union[Transaction, str]):
+        """
+        Check a transaction before it is written
+        :param tx:
+        :return:
+        """
+        if self.accounts is not None and isinstance(tx, Transaction):
+            self.accounts.validate(tx)
+
+    def _append(self, tx_uuid: Uuid, text: str):
+        """
+        Append a transaction to the account and record its span in the index.
+        Return after the transaction is durable
+        :param tx_uuid:
+        :param text:
+        :return:
+        """
+        bean_file = self.bean_file
+        data = text.encode('utf-8')
+        with metrics.stage('append'):
+            start = self.writer.append(bean_file, data)
+        self.index.add(tx_uuid, Span(os.path.realpath(bean_file), start, start + len(data), content_hash(data)))
 
     def remove(self, tx_uuid: Uuid) -> Union[Transaction, str]:
         """
@@ -62,7 +138,42 @@ class TransactionManager:
         :param tx_uuid:
         :return:
         """
-        entries, errors, __ = parser.parse_file(self.bean_file)
+        with profiler.sample('remove'), metrics.stage('remove'), self.writer.exclusive():
+            removed = self._remove_indexed(tx_uuid)
+            if removed is not None:
+                return removed
+            # 索引缺失或已过期，全量扫描
+            return self._remove_scan(tx_uuid)
+
+    def _remove_indexed(self, tx_uuid: Uuid) -> Union[Transaction, str, None]:
+        """
+        Delete transaction by the span recorded in the index
+        :param tx_uuid:
+        :return: Deleted transaction. None if the index does not know the transaction or is stale
+        """
+        span = self.index.get(tx_uuid)
+        if span is None:
+            return None
+        try:
+            data = rewrite.read_span(span.file, span.start, span.end)
+        except OSError:
+            data = b''
+        if content_hash(data) != span.hash:
+            logger.info('Index of transaction %s is stale, fall back to full scan', tx_uuid)
+            return None
+        # 删除
+        rewrite.remove_span(span.file, span.start, span.end)
+        self.index.cut(tx_uuid)
+        return _entry_from_text(tx_uuid, data.decode('utf-8'))
+
+    def _remove_scan(self, tx_uuid: Uuid) -> Union[Transaction, str]:
+        """
+        Delete transaction by parsing the whole account file
+        :param tx_uuid:
+        :return:
+        """
+        bean_file = self.bean_file
+        entries, errors = self.ledger.load(bean_file)
         if len(errors) > 0:
             desc = '\n'.join(map(lambda err:
                                  _('Row {lineno}：{message}')
@@ -82,10 +193,9 @@ class TransactionManager:
         for posting in to_delete.postings:
             max_line = max(max_line, posting.meta['lineno'])
         # 删除
-        with open(self.bean_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        with open(self.bean_file, 'w', encoding='utf-8') as f:
-            f.write(''.join(lines[:min_line - 1] + lines[max_line:]))
+        start, end = rewrite.line_span(bean_file, min_line, max_line)
+        rewrite.remove_span(bean_file, start, end)
+        self.index.cut(tx_uuid, Span(os.path.realpath(bean_file), start, end, ''))
         return to_delete
 
     def _remove_comment_wrapped(self, tx_uuid: Uuid) -> str:
@@ -94,25 +204,17 @@ class TransactionManager:
         :param tx_uuid:
         :return:
         """
-        with open(self.bean_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        bean_file = self.bean_file
         # 筛选列
-        min_line = -1
-        for i in range(len(lines)):
-            if f'TGBOT_START {tx_uuid}' in lines[i]:
-                min_line = i
-                break
-        max_line = -1
-        for i in range(len(lines)):
-            if f'TGBOT_END {tx_uuid}' in lines[i]:
-                max_line = i
-                break
-        if min_line == -1 or max_line == -1:
+        found = rewrite.marker_span(bean_file, f'TGBOT_START {tx_uuid}'.encode('utf-8'),
+                                    f'TGBOT_END {tx_uuid}'.encode('utf-8'))
+        if found is None:
             raise ValueError(_("Transaction does not exist！"))
         # 删除
-        with open(self.bean_file, 'w', encoding='utf-8') as f:
-            f.write(''.join(lines[:min_line] + lines[max_line + 1:]))
-        return ''.join(lines[min_line + 1:max_line])[:-1]
+        start, end, inner = found
+        rewrite.remove_span(bean_file, start, end)
+        self.index.cut(tx_uuid, Span(os.path.realpath(bean_file), start, end, ''))
+        return inner.decode('utf-8')[:-1]
 
     def create_from_str(self, tx_str) -> Union[Tuple[Uuid, Transaction], Tuple[None, str]]:
         """
@@ -120,39 +222,168 @@ class TransactionManager:
         :param tx_str:
         :return:
         """
-        tx = self._parse_transaction(tx_str)
-        tx_uuid, _ = self.create(tx)
-        return tx_uuid, tx
+        with profiler.sample('create_from_str'):
+            tx = self._parse_transaction(tx_str)
+            tx_uuid, _ = self.create(tx)
+            return tx_uuid, tx
 
-    def _parse_transaction(self, tx_str) -> Transaction:
-        for dispatcher in self.dispatchers:
-            if not dispatcher.quick_check(tx_str):
+    def parse_batch(self, batch_str: str) -> List[BatchLine]:
+        """
+        Parse and validate a trading syntax per line
+        :param batch_str:
+        :return: Result of every non-empty line
+        """
+        results = []
+        for lineno, line in enumerate(batch_str.splitlines(), 1):
+            if line.strip() == '':
                 continue
-            # Try to analyze
             try:
-                tx = dispatcher.process(tx_str)
-                return tx
-            except NotMatchException:
-                # Cannot be parsed by this parser
-                continue
-        else:
-            # No match
-            raise ValueError(_("Unable to identify this trading syntax"))
+                tx = self._parse_transaction(line)
+                self.validate(tx)
+                results.append(BatchLine(lineno, line, tx, None))
+            except ValueError as e:
+                results.append(BatchLine(lineno, line, None, e.args[0]))
+        return results
+
+    def create_parsed_batch(self, results: List[BatchLine], partial: bool = False) -> Optional[Uuid]:
+        """
+        Create the transactions of parse_batch
+        :param results:
+        :param partial: Whether to create the parsed transactions when some lines have errors
+        :return: batch uuid, None if nothing is created
+        """
+        parsed = [r.tx for r in results if r.error is None]
+        if len(parsed) == 0 or (not partial and len(parsed) != len(results)):
+            return None
+        batch_uuid, __ = self.create_batch(parsed, validate=False)
+        return batch_uuid
+
+    def create_batch_from_str(self, batch_str: str, partial: bool = False) -> Tuple[Optional[Uuid], List[BatchLine]]:
+        """
+        Create transactions from a trading syntax per line
+        :param batch_str:
+        :param partial: Whether to create the parsed transactions when some lines have errors
+        :return: batch uuid (None if nothing is created), result of every non-empty line
+        """
+        results = self.parse_batch(batch_str)
+        return self.create_parsed_batch(results, partial), results
+
+    def _parse_transaction(self, tx_str) -> Transaction:
+        return self.router.route(tx_str)
+
+    def ledger_files(self) -> List[str]:
+        """
+        Existing account files of all periods
+        :return:
+        """
+        pattern = glob.escape(self.__bean_file)
+        for k in ['year', 'month', 'date']:
+            pattern = pattern.replace(f'{{{k}}}', '*')
+        return sorted(glob.glob(pattern))
 
     @property
     def bean_file(self) -> str:
+        return self._resolver.resolve()
+
+
+class BeanFileResolver:
+    """
+    Resolve the account file of the current period. The path is cached until the period rolls over
+    """
+
+    def __init__(self, bean_file: str):
+        """
+        :param bean_file: Account file. Available: {year}, {month}, {date}
+        """
+        self.bean_file = bean_file
+        # Resolved path, timestamp of the next period
+        self._cached: Tuple[Optional[str], float] = (None, 0.0)
+
+    def _next_period(self, now: datetime.datetime) -> float:
+        """
+        Start of the next period of the account file
+        :param now:
+        :return: Timestamp
+        """
+        today = now.date()
+        if '{date}' in self.bean_file:
+            start = today + datetime.timedelta(days=1)
+        elif '{month}' in self.bean_file:
+            start = (today.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        elif '{year}' in self.bean_file:
+            start = today.replace(year=today.year + 1, month=1, day=1)
+        else:
+            return float('inf')
+        return datetime.datetime.combine(start, datetime.time()).timestamp()
+
+    def resolve(self) -> str:
+        """
+        Path of the account file. The parent folder is created when the period changes
+        :return:
+        """
+        path, expires = self._cached
+        now = time.time()
+        if path is not None and now < expires:
+            return path
+        local = datetime.datetime.fromtimestamp(now)
         params = {
-            'year': time.strftime("%Y", time.localtime()),
-            'month': time.strftime("%m", time.localtime()),
-            'date': time.strftime("%d", time.localtime()),
+            'year': local.strftime("%Y"),
+            'month': local.strftime("%m"),
+            'date': local.strftime("%d"),
         }
-        bean_file = self.__bean_file
+        path = self.bean_file
         for k, v in params.items():
-            bean_file = bean_file.replace(f'{{{k}}}', v)
+            path = path.replace(f'{{{k}}}', v)
         # 创建父文件夹
-        path = os.path.dirname(os.path.realpath(bean_file))
-        os.makedirs(path, exist_ok=True)
-        return bean_file
+        os.makedirs(os.path.dirname(os.path.realpath(path)), exist_ok=True)
+        self._cached = (path, self._next_period(local))
+        return path
+
+
+def _wrap(tx_uuid: Uuid, text: str) -> str:
+    """
+    Wrap a statement in comments
+    :param tx_uuid:
+    :param text:
+    :return:
+    """
+    return f"; TGBOT_START {tx_uuid}\n{text}\n; TGBOT_END {tx_uuid}\n"
+
+
+def _to_text(tx_uuid: Uuid, tx: Union[Transaction, str]) -> Tuple[str, Union[Transaction, str]]:
+    """
+    Text of a transaction written to the account
+    :param tx_uuid:
+    :param tx:
+    :return: text, transaction with control metadata
+    """
+    if isinstance(tx, str):
+        return _wrap(tx_uuid, tx), tx
+    elif isinstance(tx, Transaction):
+        # Add control metadata to the rendered text, which is also used for the reply
+        tx_time = str(datetime.datetime.now())
+        header, body = render.format_entry(tx).split('\n', 1)
+        text = f'{header}\n  {META_UUID}: "{tx_uuid}"\n  {META_TIME}: "{tx_time}"\n{body}\n'
+        return text, tx._replace(meta={**tx.meta, META_UUID: tx_uuid, META_TIME: tx_time})
+    else:
+        raise ValueError()
+
+
+def _entry_from_text(tx_uuid: Uuid, text: str) -> Union[Transaction, str]:
+    """
+    Restore the transaction from the text written by TransactionManager.create
+    :param tx_uuid:
+    :param text:
+    :return:
+    """
+    if text.startswith(f'; TGBOT_START {tx_uuid}'):
+        # Comment wrapped statement
+        return text[text.index('\n') + 1:text.rindex(f'; TGBOT_END {tx_uuid}') - 1]
+    entries, __, __ = parser.parse_string(text)
+    return next(
+        filter(lambda tx: tx.meta.get(META_UUID) == tx_uuid, entries),
+        text
+    )
 
 
 def stringfy(tx: Union[Transaction, str]) -> str:
@@ -163,24 +394,71 @@ def stringfy(tx: Union[Transaction, str]) -> str:
     """
     if isinstance(tx, str):
         return tx
-    return printer.format_entry(tx)
+    return render.format_entry(tx)
 
 
-def get_manager() -> TransactionManager:
+def dispatcher_key(conf: dict) -> tuple:
     """
-    Create management objects from configuration
+    Identity of a processor configuration, including the state of the files named by its arguments
+    :param conf:
     :return:
     """
+    args = conf.get('args') or {}
+    files = tuple(file_signature(v) for v in args.values() if isinstance(v, str) and os.path.isfile(v))
+    return conf['class'], json.dumps(args, sort_keys=True, default=str), files
 
-    def create_manager():
-        # Create a deliverer
-        dispatchers = []
-        for conf in get_config('transaction.message_dispatcher', []):
-            clazz = load_class(conf['class'])
-            dispatchers.append(clazz(**conf['args']))
-        # get Bean File location
-        bean_file: str = get_config('transaction.beancount_file')
-        # Create an object
-        return TransactionManager(dispatchers, bean_file)
 
-    return get_global(GLOBAL_MANAGER, create_manager)
+def create_dispatchers(confs: List[dict], previous: List[Tuple[tuple, Dispatcher]] = None) \
+        -> List[Tuple[tuple, Dispatcher]]:
+    """
+    Create processors from configuration
+    :param confs:
+    :param previous: Processors to reuse if their configuration key is unchanged
+    :return: (configuration key, processor)
+    """
+    reusable = {}
+    for key, d in previous or []:
+        reusable.setdefault(key, []).append(d)
+    sources = []
+    for conf in confs:
+        key = dispatcher_key(conf)
+        if len(reusable.get(key, [])) > 0:
+            sources.append((key, reusable[key].pop(0)))
+            continue
+        clazz = load_class(conf['class'])
+        sources.append((key, clazz(**conf['args'])))
+    return sources
+
+
+def create_manager(conf: dict, ledger: Ledger, accounts: Optional[AccountIndex],
+                   sources: List[Tuple[tuple, Dispatcher]] = None) -> TransactionManager:
+    """
+    Create management objects from a configuration
+    :param conf:
+    :param ledger:
+    :param accounts:
+    :param sources: Processors already created
+    :return:
+    """
+    # Create a deliverer
+    if sources is None:
+        sources = create_dispatchers(lookup(conf, 'transaction.message_dispatcher', []))
+    # get Bean File location
+    bean_file: str = lookup(conf, 'transaction.beancount_file')
+    index_file: str = lookup(conf, 'transaction.index_file')
+    # Group commit of appends
+    writer = GroupCommitWriter(window=lookup(conf, 'transaction.commit_window', 0.0),
+                               max_batch_size=lookup(conf, 'transaction.commit_batch_size', 64),
+                               max_open_files=lookup(conf, 'transaction.open_files', 4))
+    # Create an object
+    manager = TransactionManager([d for __, d in sources], bean_file, index_file, writer, ledger, accounts)
+    manager.sources = sources
+    return manager
+
+
+def get_manager() -> TransactionManager:
+    """
+    Create management objects from configuration
+    :return:
+    """
+    return get_global(GLOBAL_MANAGER, lambda: create_manager(get_config_obj(), get_ledger(), get_accounts()))
@@ -1,8 +1,9 @@
+import logging
+import os
 import sys
 
-import telebot
-
-logger = telebot.logger
+# Logger of telebot. telebot adds its handler when it is imported
+logger = logging.getLogger('TeleBot')
 
 
 def load_class(classname: str) -> type:
@@ -15,3 +16,16 @@ def load_class(classname: str) -> type:
     module, classname = '.'.join(class_path[:-1]), class_path[-1]
     __import__(module)
     return getattr(sys.modules[module], classname)
+
+
+def file_signature(path: str) -> tuple:
+    """
+    通过路径、修改时间、大小、inode 判断文件是否变化
+    :param path:
+    :return: 文件不存在时为 (path,)
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path,
+    return path, st.st_mtime_ns, st.st_size, st.st_ino
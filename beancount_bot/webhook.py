@@ -0,0 +1,106 @@
+import asyncio
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Set
+
+from aiohttp import web
+from telebot.types import Update
+
+from beancount_bot.config import get_config
+from beancount_bot.util import logger
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+UpdateProcessor = Callable[[Update], Awaitable]
+
+
+def create_app(process_update: UpdateProcessor, path: str = '/', secret_token: str = None) -> web.Application:
+    """
+    Create the HTTP receiver of webhook updates.
+    The request is answered once the update is parsed, and the update is processed in background
+    :param process_update: Coroutine function processing one update
+    :param path: Path of webhook
+    :param secret_token: Expected secret token header. None or empty for no check
+    :return:
+    """
+    background: Set[asyncio.Task] = set()
+
+    async def handle(request: web.Request) -> web.Response:
+        # 校验密钥
+        if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret_token):
+            logger.warning('Webhook request from %s with invalid secret token', request.remote)
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json())
+        except ValueError:
+            return web.Response(status=400)
+        # 后台处理，立即应答
+        task = asyncio.ensure_future(process_update(update))
+        background.add(task)
+        task.add_done_callback(background.discard)
+        return web.Response()
+
+    async def drain(app: web.Application):
+        if len(background) > 0:
+            await asyncio.wait(list(background))
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    app.on_shutdown.append(drain)
+    return app
+
+
+def sync_processor(workers: int) -> UpdateProcessor:
+    """
+    Process updates with the threaded TeleBot
+    :param workers:
+    :return:
+    """
+    from beancount_bot import bot
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='beancount_bot_webhook')
+
+    async def process_update(update: Update):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, bot.bot.process_new_updates, [update])
+
+    bot.setup()
+    return process_update
+
+
+def async_processor() -> UpdateProcessor:
+    """
+    Process updates with the AsyncTeleBot
+    :return:
+    """
+    from beancount_bot import async_bot
+
+    async def process_update(update: Update):
+        await async_bot.bot.process_new_updates([update])
+
+    async_bot.setup()
+    return process_update
+
+
+def serving(runtime: str = 'sync'):
+    """
+    start up Bot in webhook mode
+    :param runtime: sync or async
+    :return:
+    """
+    from beancount_bot import bot
+    if runtime == 'async':
+        process_update = async_processor()
+    else:
+        process_update = sync_processor(get_config('bot.io_workers', 4))
+    path = get_config('bot.webhook.path', '/')
+    secret_token = get_config('bot.webhook.secret_token')
+    # 注册 Webhook
+    url = get_config('bot.webhook.url')
+    if url:
+        bot.bot.set_webhook(url=url, secret_token=secret_token or None)
+    # start up
+    app = create_app(process_update, path, secret_token)
+    web.run_app(app,
+                host=get_config('bot.webhook.listen', '127.0.0.1'),
+                port=get_config('bot.webhook.port', 8443),
+                print=None)
@@ -0,0 +1,216 @@
+"""
+Local stand-in of the Telegram Bot API, for load tests without Telegram.
+
+Implements getUpdates (long polling), sendMessage, editMessageText and answerCallbackQuery.
+Other methods succeed with result true. Updates are queued by the test through push_message and
+push_callback; calls of the bot are passed to on_call.
+
+    api = FakeBotApi()
+    api.start()
+    apihelper.API_URL = api.api_url
+"""
+import email.parser
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'beancount_bot', 'username': 'beancount_bot'}
+
+
+def _user(uid: int) -> dict:
+    return {'id': uid, 'is_bot': False, 'first_name': f'user{uid}'}
+
+
+def _chat(uid: int) -> dict:
+    return {'id': uid, 'type': 'private', 'first_name': f'user{uid}'}
+
+
+def _parse_body(content_type: str, body: bytes) -> Dict[str, str]:
+    """
+    Parameters of a request body: urlencoded (telebot), multipart (AsyncTeleBot) or JSON
+    :param content_type:
+    :param body:
+    :return:
+    """
+    if len(body) == 0:
+        return {}
+    if content_type.startswith('application/json'):
+        return {k: v if isinstance(v, str) else json.dumps(v) for k, v in json.loads(body).items()}
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser().parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body)
+        params = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if name is not None and part.get_filename() is None:
+                params[name] = part.get_payload(decode=True).decode('utf-8')
+        return params
+    return dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+
+
+class FakeBotApi:
+    """
+    Bot API server keeping updates in memory
+    """
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 0,
+                 on_call: Optional[Callable[[str, dict], None]] = None):
+        """
+        :param listen:
+        :param port: 0 for any free port
+        :param on_call: Called with (method, params) for every call except getUpdates, before it is answered
+        """
+        self.on_call = on_call
+        self._updates: List[dict] = []
+        self._cond = threading.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self.calls: Dict[str, int] = {}
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, which Nagle's algorithm would delay on keep-alive connections
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = dict(parse_qsl(url.query, keep_blank_values=True))
+                length = int(self.headers.get('Content-Length', 0))
+                params.update(_parse_body(self.headers.get('Content-Type', ''), self.rfile.read(length)))
+                body = json.dumps({'ok': True, 'result': api.call(method, params)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((listen, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def api_url(self) -> str:
+        """
+        Value for telebot.apihelper.API_URL and telebot.asyncio_helper.API_URL
+        :return:
+        """
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/bot{{0}}/{{1}}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-bot-api', daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self._cond:
+            self._cond.notify_all()
+
+    def new_message(self, uid: int, text: str, from_bot: bool = False, reply_markup: str = None) -> dict:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': _chat(uid),
+            'from': BOT_USER if from_bot else _user(uid),
+            'text': text,
+        }
+        if reply_markup:
+            message['reply_markup'] = json.loads(reply_markup)
+        return message
+
+    def push_update(self, update: dict):
+        """
+        Queue an update for getUpdates
+        :param update: Without update_id
+        :return:
+        """
+        with self._cond:
+            update['update_id'] = next(self._update_ids)
+            self._updates.append(update)
+            self._cond.notify_all()
+
+    def push_message(self, uid: int, text: str) -> dict:
+        """
+        A user sends a message to the bot
+        :param uid:
+        :param text:
+        :return: The message
+        """
+        message = self.new_message(uid, text)
+        self.push_update({'message': message})
+        return message
+
+    def push_callback(self, uid: int, message: dict, data: str) -> str:
+        """
+        A user presses a button of a message of the bot
+        :param uid:
+        :param message: Message of the bot with the button
+        :param data: Callback data of the button
+        :return: Callback query id
+        """
+        callback_id = str(next(self._callback_ids))
+        self.push_update({'callback_query': {
+            'id': callback_id,
+            'from': _user(uid),
+            'message': message,
+            'chat_instance': str(uid),
+            'data': data,
+        }})
+        return callback_id
+
+    def call(self, method: str, params: dict):
+        """
+        Answer a Bot API call
+        :param method:
+        :param params:
+        :return: result
+        """
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            return self._get_updates(int(params.get('offset') or 0), int(params.get('limit') or 100),
+                                     float(params.get('timeout') or 0))
+        if method == 'sendMessage':
+            result = self.new_message(int(params['chat_id']), params.get('text', ''), True,
+                                      params.get('reply_markup'))
+            if 'reply_to_message_id' in params:
+                result['reply_to_message'] = {'message_id': int(params['reply_to_message_id']),
+                                              'date': result['date'], 'chat': result['chat']}
+        elif method == 'editMessageText':
+            uid = int(params['chat_id'])
+            result = {'message_id': int(params['message_id']), 'date': int(time.time()), 'chat': _chat(uid),
+                      'from': BOT_USER, 'text': params.get('text', '')}
+        elif method == 'getMe':
+            result = BOT_USER
+        else:
+            result = True
+        if self.on_call is not None:
+            self.on_call(method, {**params, 'result': result})
+        return result
+
+    def _get_updates(self, offset: int, limit: int, timeout: float) -> List[dict]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Confirmed updates are dropped
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while len(self._updates) == 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._updates[:limit]
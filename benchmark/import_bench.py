@@ -0,0 +1,80 @@
+"""
+Import a generated CSV statement through a template and report rows/sec and peak memory.
+The statement is generated while it is read, so the only memory that grows with rows is the dedupe set.
+
+    python -m benchmark.import_bench --rows 200000
+"""
+import io
+import os
+import resource
+import tempfile
+
+import click
+
+from beancount_bot import importer
+from beancount_bot.builtin.template_dispatcher import TemplateDispatcher
+from beancount_bot.transaction import TransactionManager
+
+TEMPLATE = '''config:
+  accounts: {}
+  default_account: 'Assets:Bank'
+templates:
+  - command: 'import'
+    args: ['payee', 'amount']
+    template: |
+      {date} * "{payee}"
+        {account}
+        Expenses:Unknown  {amount} CNY
+'''
+
+
+class GeneratedStatement(io.RawIOBase):
+    """
+    CSV statement generated on read
+    """
+
+    def __init__(self, rows: int):
+        self.rows = rows
+        self.next_row = 0
+        self.pending = b'date,amount,payee\n'
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self.pending) < len(b) and self.next_row < self.rows:
+            i = self.next_row
+            self.pending += f'2022-{i % 12 + 1:02d}-{i % 28 + 1:02d},{i % 1000}.{i % 100:02d},Shop {i}\n' \
+                .encode('utf-8')
+            self.next_row += 1
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+@click.command()
+@click.option('--rows', default=200000, help='Rows of the statement')
+@click.option('--batch-size', default=500, help='Transactions per append')
+def main(rows, batch_size):
+    with tempfile.TemporaryDirectory() as tmp:
+        template_file = os.path.join(tmp, 'template.yml')
+        with open(template_file, 'w', encoding='utf-8') as f:
+            f.write(TEMPLATE)
+        manager = TransactionManager([TemplateDispatcher(template_file)], os.path.join(tmp, 'import.bean'))
+        statement_importer = importer.StatementImporter(manager, 'import "{payee}" {amount}', date_field='date',
+                                                        batch_size=batch_size)
+
+        def on_progress(report):
+            if len(report.batches) % 100 == 0:
+                click.echo(f'{report.rows:>8} rows {report.rows_per_second:>8.0f} rows/s')
+
+        stream = io.BufferedReader(GeneratedStatement(rows))
+        report = statement_importer.run(importer.read_csv(stream), on_progress)
+        click.echo(str(report))
+        click.echo(f'ledger {os.path.getsize(os.path.join(tmp, "import.bean")) / 2 ** 20:.1f} MiB, '
+                   f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+End-to-end load test: the bot polls a local fake Bot API server (benchmark/fake_bot_api.py) while simulated
+users send transactions and withdraw some of them at a target rate.
+
+    python -m benchmark.load_test --users 50 --rate 100 --count 5000
+
+Reports throughput, p50/p99 reply latency per kind of update, and checks at the end that the account file
+contains every created transaction that was not withdrawn, exactly once.
+"""
+import collections
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import click
+import yaml
+from beancount.parser import parser
+
+from benchmark.fake_bot_api import FakeBotApi
+
+AUTH_TOKEN = 'load-test'
+
+TEMPLATE = '''config:
+  accounts:
+    cash: 'Assets:Cash'
+  default_account: 'Assets:Bank'
+templates:
+  - command: 'cmd'
+    args: ['price', 'payee']
+    template: |
+      {date} * "{payee}" "load test"
+        {account}
+        Expenses:Load  {price} CNY
+'''
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if len(values) > 0 else float('nan')
+
+
+class _Pending:
+    __slots__ = ('kind', 'uid', 'sent', 'tx_uuid')
+
+    def __init__(self, kind: str, uid: int, tx_uuid: Optional[str] = None):
+        self.kind = kind
+        self.uid = uid
+        self.sent = time.perf_counter()
+        self.tx_uuid = tx_uuid
+
+
+class LoadDriver:
+    """
+    Simulated users. Replies of the bot are matched to the updates they answer
+    """
+
+    def __init__(self, api: FakeBotApi):
+        self.api = api
+        api.on_call = self.on_call
+        self._cond = threading.Condition()
+        # message_id of the user message -> pending
+        self._messages: Dict[int, _Pending] = {}
+        # (chat_id, message_id of the bot message) and callback query id -> pending
+        self._callbacks: Dict[object, _Pending] = {}
+        self._callback_keys: Dict[int, Tuple[object, object]] = {}
+        # uid -> replies with a withdrawal button
+        self.withdrawable: Dict[int, List[Tuple[dict, str]]] = collections.defaultdict(list)
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.failures: Dict[str, int] = collections.defaultdict(int)
+        self.created: List[str] = []
+        self.withdrawn: List[str] = []
+        self.last_reply = 0.0
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._messages) + len(self._callback_keys)
+
+    def send(self, kind: str, uid: int, text: str):
+        with self._cond:
+            message = self.api.new_message(uid, text)
+            self._messages[message['message_id']] = _Pending(kind, uid)
+        # Queued after it is registered, so that the reply always finds it
+        self.api.push_update({'message': message})
+
+    def withdraw(self, uid: int) -> bool:
+        with self._cond:
+            if len(self.withdrawable[uid]) == 0:
+                return False
+            message, tx_uuid = self.withdrawable[uid].pop(random.randrange(len(self.withdrawable[uid])))
+            pending = _Pending('withdraw', uid, tx_uuid)
+            key = (uid, message['message_id'])
+            self._callbacks[key] = pending
+            callback_id = self.api.push_callback(uid, message, f'withdraw:{tx_uuid}')
+            self._callbacks[callback_id] = pending
+            self._callback_keys[id(pending)] = (key, callback_id)
+        return True
+
+    def _done(self, pending: _Pending, ok: bool):
+        now = time.perf_counter()
+        self.latencies[pending.kind].append(now - pending.sent)
+        if not ok:
+            self.failures[pending.kind] += 1
+        self.last_reply = now
+        self._cond.notify_all()
+
+    def on_call(self, method: str, params: dict):
+        with self._cond:
+            if method == 'sendMessage' and 'reply_to_message_id' in params:
+                pending = self._messages.pop(int(params['reply_to_message_id']), None)
+                if pending is None:
+                    return
+                tx_uuid = None
+                markup = params['result'].get('reply_markup')
+                if markup is not None:
+                    data = markup['inline_keyboard'][0][0].get('callback_data', '')
+                    tx_uuid = data[len('withdraw:'):] if data.startswith('withdraw:') else None
+                if tx_uuid is not None:
+                    self.created.append(tx_uuid)
+                    self.withdrawable[pending.uid].append((params['result'], tx_uuid))
+                self._done(pending, pending.kind != 'transaction' or tx_uuid is not None)
+            elif method in ('editMessageText', 'answerCallbackQuery'):
+                key = (int(params['chat_id']), int(params['message_id'])) if method == 'editMessageText' \
+                    else params.get('callback_query_id')
+                pending = self._callbacks.get(key)
+                if pending is None:
+                    return
+                for k in self._callback_keys.pop(id(pending)):
+                    self._callbacks.pop(k, None)
+                if method == 'editMessageText':
+                    self.withdrawn.append(pending.tx_uuid)
+                self._done(pending, method == 'editMessageText')
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for the replies of all updates sent
+        :param timeout: Seconds without any reply
+        :return: Whether all updates were answered
+        """
+        with self._cond:
+            while self.outstanding > 0:
+                if not self._cond.wait(timeout) and self.outstanding > 0:
+                    return False
+        return True
+
+
+def write_config(tmp: str, runtime: str, commit_window: float) -> str:
+    template_file = os.path.join(tmp, 'template.yml')
+    with open(template_file, 'w', encoding='utf-8') as f:
+        f.write(TEMPLATE)
+    config = {
+        'log': {'level': 'WARNING'},
+        'bot': {
+            'token': '1:LOADTEST',
+            'auth_token': AUTH_TOKEN,
+            'session_file': os.path.join(tmp, 'bot.session'),
+            'runtime': runtime,
+        },
+        'transaction': {
+            'beancount_file': os.path.join(tmp, 'load.bean'),
+            'index_file': os.path.join(tmp, 'bot.index'),
+            'commit_window': commit_window,
+            'message_dispatcher': [{
+                'class': 'beancount_bot.builtin.template_dispatcher.TemplateDispatcher',
+                'args': {'template_config': template_file},
+            }],
+        },
+        'schedule': [],
+    }
+    config_file = os.path.join(tmp, 'beancount_bot.yml')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        yaml.dump(config, f)
+    return config_file
+
+
+def start_bot(api: FakeBotApi, config_file: str, runtime: str):
+    """
+    Start the bot as main does, polling the fake server
+    :param api:
+    :param config_file:
+    :param runtime: sync or async
+    :return:
+    """
+    from telebot import apihelper
+    from beancount_bot import bot, config as conf
+    from beancount_bot.config import load_config
+    from beancount_bot.session import load_session
+    from beancount_bot.transaction import get_manager
+
+    apihelper.API_URL = api.api_url
+    conf.config_file = config_file
+    load_config()
+    bot.logger.setLevel('WARNING')
+    load_session()
+    get_manager()
+    if runtime == 'async':
+        from telebot import asyncio_helper
+        from beancount_bot import async_bot
+        asyncio_helper.API_URL = api.api_url
+        target = async_bot.serving
+    else:
+        target = bot.serving
+    threading.Thread(target=target, name='bot', daemon=True).start()
+
+
+def check_ledger(bean_file: str, created: List[str], withdrawn: List[str]) -> Tuple[int, int, int]:
+    """
+    Compare the account file with the replies
+    :param bean_file:
+    :param created:
+    :param withdrawn:
+    :return: (missing, unexpected, duplicated) transactions
+    """
+    from beancount_bot.transaction import META_UUID
+    entries, errors, __ = parser.parse_file(bean_file)
+    found = collections.Counter(e.meta[META_UUID] for e in entries if META_UUID in e.meta)
+    expected = set(created) - set(withdrawn)
+    missing = len(expected - set(found.keys()))
+    unexpected = len(set(found.keys()) - expected)
+    duplicated = sum(1 for count in found.values() if count > 1)
+    return missing, unexpected, duplicated
+
+
+@click.command()
+@click.option('--users', default=20, help='Simulated users')
+@click.option('--rate', default=50.0, help='Target updates per second')
+@click.option('--count', default=2000, help='Updates to send after authentication')
+@click.option('--withdraw-ratio', default=0.2, help='Fraction of updates that withdraw an earlier transaction')
+@click.option('--runtime', type=click.Choice(['sync', 'async']), default='sync', help='Serving runtime')
+@click.option('--commit-window', default=0.005, help='transaction.commit_window')
+@click.option('--timeout', default=30.0, help='Seconds to wait for a reply before giving up')
+def main(users, rate, count, withdraw_ratio, runtime, commit_window, timeout):
+    api = FakeBotApi()
+    api.start()
+    driver = LoadDriver(api)
+    with tempfile.TemporaryDirectory() as tmp:
+        config_file = write_config(tmp, runtime, commit_window)
+        start_bot(api, config_file, runtime)
+        uids = [10000 + i for i in range(users)]
+        # The first message of a user is the authentication token
+        for uid in uids:
+            driver.send('auth', uid, AUTH_TOKEN)
+        if not driver.wait(timeout):
+            raise click.ClickException('Authentication was not answered, is the bot running?')
+
+        start = time.perf_counter()
+        for i, uid in zip(range(count), itertools.cycle(uids)):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if random.random() < withdraw_ratio and driver.withdraw(uid):
+                continue
+            driver.send('transaction', uid, f'cmd {i % 1000 + 1}.{i % 100:02d} shop{i} <cash')
+        sent = time.perf_counter() - start
+        answered = driver.wait(timeout)
+        elapsed = driver.last_reply - start
+
+        click.echo(f'updates:    {count} in {sent:.1f}s (target {rate:.0f}/s)'
+                   + ('' if answered else f', {driver.outstanding} unanswered'))
+        click.echo(f'throughput: {sum(len(v) for k, v in driver.latencies.items() if k != "auth") / elapsed:.1f} '
+                   f'replies/s')
+        for kind in ['transaction', 'withdraw']:
+            latencies = driver.latencies[kind]
+            click.echo(f'{kind + ":":<11} {len(latencies)} replies, {driver.failures[kind]} failed, '
+                       f'p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms')
+        missing, unexpected, duplicated = check_ledger(os.path.join(tmp, 'load.bean'), driver.created,
+                                                       driver.withdrawn)
+        click.echo(f'ledger:     {len(driver.created) - len(driver.withdrawn)} expected, {missing} missing, '
+                   f'{unexpected} unexpected, {duplicated} duplicated')
+        if not answered or missing + unexpected + duplicated > 0:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Cost of split_command against the original character-by-character state machine.
+
+    python -m benchmark.split_command_bench
+"""
+import timeit
+
+import click
+
+from beancount_bot.builtin.template_dispatcher import split_command
+from test.builtin.test_template_dispatcher import split_command_reference
+
+CASES = [
+    ('short', '饮料 20 <wx'),
+    ('quoted', '饭 20 "Kentucky Fried Chicken" < zfb'),
+    ('many args', ' '.join(f'arg{i}' for i in range(200))),
+    ('long quoted 10k', 'memo "' + 'x' * 10000 + '"'),
+    ('long escaped 10k', 'memo "' + '\\"' * 5000 + '"'),
+    ('long quoted 100k', 'memo "' + 'x' * 100000 + '"'),
+]
+
+
+@click.command()
+@click.option('--repeat', default=3, help='Measurements per case')
+def main(repeat):
+    click.echo(f'{"case":<18} {"length":>7} {"state machine (us)":>19} {"split_command (us)":>19}')
+    for name, cmd in CASES:
+        assert split_command(cmd) == split_command_reference(cmd)
+        number = max(1, 200000 // len(cmd))
+        legacy = min(timeit.repeat(lambda: split_command_reference(cmd), number=number, repeat=repeat)) / number
+        fast = min(timeit.repeat(lambda: split_command(cmd), number=number, repeat=repeat)) / number
+        click.echo(f'{name:<18} {len(cmd):>7} {legacy * 1e6:>19.2f} {fast * 1e6:>19.2f}')
+
+
+if __name__ == '__main__':
+    main()
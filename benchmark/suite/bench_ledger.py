@@ -0,0 +1,53 @@
+"""
+Creating and withdrawing a transaction on account files of 1k to 1M lines.
+"""
+import pytest
+
+from beancount_bot.builtin.template_dispatcher import TemplateDispatcher
+from beancount_bot.transaction import TransactionManager
+from conftest import copy_file
+
+LEDGER_LINES = [
+    1_000,
+    10_000,
+    100_000,
+    pytest.param(1_000_000, marks=pytest.mark.slow),
+]
+
+
+@pytest.fixture(params=LEDGER_LINES, ids=lambda lines: f'{lines} lines')
+def manager(request, tmp_path, ledger_files, template_files):
+    bean_file = str(tmp_path / 'bot.bean')
+    copy_file(ledger_files(request.param), bean_file)
+    d = TemplateDispatcher(template_files(10))
+    return TransactionManager([d], bean_file, str(tmp_path / 'bot.index'))
+
+
+def test_create(benchmark, manager):
+    tx = manager.dispatchers[0].process('cmd1 12.5 Shop <wx')
+    tx_uuid, __ = benchmark(manager.create, tx)
+    assert tx_uuid is not None
+
+
+def test_remove(benchmark, manager):
+    tx = manager.dispatchers[0].process('cmd1 12.5 Shop <wx')
+
+    def create():
+        tx_uuid, __ = manager.create(tx)
+        return (tx_uuid,), {}
+
+    benchmark.pedantic(manager.remove, setup=create, rounds=50)
+
+
+def test_remove_unindexed(benchmark, manager):
+    """
+    Withdraw a transaction missing from the index, which scans the account file
+    """
+    tx = manager.dispatchers[0].process('cmd1 12.5 Shop <wx')
+
+    def create():
+        tx_uuid, __ = manager.create(tx)
+        manager.index.discard(tx_uuid)
+        return (tx_uuid,), {}
+
+    benchmark.pedantic(manager.remove, setup=create, rounds=10)
@@ -0,0 +1,64 @@
+"""
+Parsing of a message: split_command, template lookup and rendering, and the beancount parse.
+"""
+import pytest
+
+from beancount_bot.builtin.template_dispatcher import TemplateDispatcher, split_command
+
+SPLIT_CASES = {
+    'short': '饮料 20 <wx',
+    'quoted': '饭 20 "Kentucky Fried Chicken" < zfb',
+    'many args': ' '.join(f'arg{i}' for i in range(200)),
+    'long quoted 10k': 'memo "' + 'x' * 10000 + '"',
+    'long escaped 10k': 'memo "' + '\\"' * 5000 + '"',
+}
+
+TEMPLATE_COUNTS = [10, 100, 1000, 5000]
+
+
+@pytest.mark.parametrize('case', list(SPLIT_CASES.keys()))
+def test_split_command(benchmark, case):
+    benchmark(split_command, SPLIT_CASES[case])
+
+
+@pytest.fixture(params=TEMPLATE_COUNTS, ids=lambda count: f'{count} templates')
+def dispatcher(request, template_files):
+    return TemplateDispatcher(template_files(request.param))
+
+
+def _message(d: TemplateDispatcher) -> str:
+    # The last template, so that a linear scan would be the worst case
+    return f'cmd{len(d.templates) - 1} 12.5 Shop <wx'
+
+
+def test_quick_check(benchmark, dispatcher):
+    message = _message(dispatcher)
+
+    def quick_check():
+        # Split again every time, as for a new message
+        dispatcher._last_split.value = None
+        return dispatcher.quick_check(message)
+
+    assert benchmark(quick_check)
+
+
+def test_process_raw(benchmark, dispatcher):
+    message = _message(dispatcher)
+
+    def process_raw():
+        dispatcher._last_split.value = None
+        return dispatcher._process_raw(message)
+
+    assert 'Expenses:Bench' in benchmark(process_raw)
+
+
+def test_dispatcher_process(benchmark, template_files):
+    d = TemplateDispatcher(template_files(10))
+    message = 'cmd3 12.5 Shop <wx'
+
+    def process():
+        d._last_split.value = None
+        return d.process(message)
+
+    tx = benchmark(process)
+    assert tx.postings[1].account == 'Expenses:Bench:Item3'
@@ -0,0 +1,46 @@
+"""
+set_session with 10 to 100k users, for each session backend.
+"""
+import pytest
+
+from beancount_bot import session
+from beancount_bot.session import JsonSessionStore, SqliteSessionStore
+
+USER_COUNTS = [10, 1000, 100_000]
+
+BACKENDS = {
+    # Written behind, flush_delay seconds after a change
+    'json': lambda path: JsonSessionStore(path + '.json', flush_delay=1.0),
+    # Whole file written at every change
+    'json sync': lambda path: JsonSessionStore(path + '.json', flush_delay=0),
+    'sqlite': lambda path: SqliteSessionStore(path + '.db'),
+}
+
+
+@pytest.fixture(params=USER_COUNTS, ids=lambda count: f'{count} users')
+def users(request):
+    return request.param
+
+
+@pytest.fixture(params=list(BACKENDS.keys()))
+def store(request, tmp_path, monkeypatch, users):
+    store = BACKENDS[request.param](str(tmp_path / 'bot.session'))
+    sessions = {str(uid): {session.SESS_AUTH: True} for uid in range(users)}
+    monkeypatch.setattr(session, '_session_cache', sessions)
+    monkeypatch.setattr(session, '_store', store)
+    # Existing users in the backend
+    if isinstance(store, SqliteSessionStore):
+        store._conn.executemany('INSERT INTO session (uid, key, value) VALUES (?, ?, ?)',
+                                [(uid, session.SESS_AUTH, 'true') for uid in sessions.keys()])
+        store._conn.commit()
+    yield store
+    store.flush()
+
+
+def test_set_session(benchmark, store, users):
+    counter = iter(range(10 ** 9))
+
+    def set_session():
+        session.set_session(next(counter) % users, 'last', 1)
+
+    benchmark(set_session)
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+TEMPLATE_HEADER = '''config:
+  accounts:
+    zfb: 'Assets:Digital:Alipay'
+    wx: 'Assets:Digital:Wechat'
+  default_account: 'Assets:Digital:Alipay'
+templates:
+'''
+
+TEMPLATE = '''  - command: 'cmd{i}'
+    args: ['price']
+    optional_args: ['seller']
+    template: |
+      {{date}} * "{{seller}}" "{{command}}"
+        {{account}}
+        Expenses:Bench:Item{i}    {{price}} CNY
+'''
+
+TRANSACTION = '''2021-{month:02d}-{day:02d} * "Payee {i}" "Narration {i}"
+  Assets:Digital:Alipay
+  Expenses:Food:Drink  {amount} CNY
+
+'''
+
+
+def write_templates(path: str, count: int):
+    """
+    Template configuration of count commands, cmd0 ... cmd{count - 1}
+    :param path:
+    :param count:
+    :return:
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(TEMPLATE_HEADER)
+        for i in range(count):
+            f.write(TEMPLATE.format(i=i))
+
+
+def write_ledger(path: str, lines: int):
+    """
+    Account file of about lines lines, 5 lines per transaction
+    :param path:
+    :param lines:
+    :return:
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(lines // 5):
+            f.write(TRANSACTION.format(month=i % 12 + 1, day=i % 28 + 1, i=i, amount=i % 1000 + 1))
+
+
+@pytest.fixture(scope='session')
+def template_files(tmp_path_factory):
+    """
+    Template configurations by number of templates, generated once
+    :return: count -> path
+    """
+    directory = tmp_path_factory.mktemp('templates')
+    cache = {}
+
+    def get(count: int) -> str:
+        if count not in cache:
+            cache[count] = str(directory / f'template_{count}.yml')
+            write_templates(cache[count], count)
+        return cache[count]
+
+    return get
+
+
+@pytest.fixture(scope='session')
+def ledger_files(tmp_path_factory):
+    """
+    Generated account files by number of lines. Copy before writing
+    :return: lines -> path
+    """
+    directory = tmp_path_factory.mktemp('ledgers')
+    cache = {}
+
+    def get(lines: int) -> str:
+        if lines not in cache:
+            cache[lines] = str(directory / f'ledger_{lines}.bean')
+            write_ledger(cache[lines], lines)
+        return cache[lines]
+
+    return get
+
+
+def copy_file(src: str, dst: str):
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            chunk = fin.read(1 << 20)
+            if len(chunk) == 0:
+                break
+            fout.write(chunk)
+    os.utime(dst)
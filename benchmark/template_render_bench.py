@@ -0,0 +1,49 @@
+"""
+Per-message cost of rendering a template body: repeated str.replace against the compiled segment list.
+
+    python -m benchmark.template_render_bench
+"""
+import timeit
+
+import click
+
+from beancount_bot.builtin.template_dispatcher import CompiledTemplate
+
+
+def make_template(n_args: int, n_postings: int) -> dict:
+    args = [f'arg{i}' for i in range(n_args)]
+    body = '{date} * "{arg0}" "{command}"\n  {account}\n'
+    for i in range(n_postings):
+        body += f'  Expenses:Posting{i}  {{arg{i % n_args}}} CNY\n'
+    return {'command': 'bench', 'args': args, 'template': body}
+
+
+def make_args(template: dict) -> dict:
+    arg_map = {'account': 'Assets:Cash', 'date': '2021-01-01', 'command': 'bench'}
+    arg_map.update({k: str(i) for i, k in enumerate(template['args'])})
+    return arg_map
+
+
+def render_replace(template: dict, arg_map: dict) -> str:
+    ret = template['template']
+    for k, v in arg_map.items():
+        ret = ret.replace(f'{{{k}}}', str(v))
+    return ret
+
+
+@click.command()
+@click.option('--number', default=20000, help='Renders per measurement')
+def main(number):
+    click.echo(f'{"args":>6} {"postings":>9} {"replace (us)":>14} {"compiled (us)":>14}')
+    for n_args, n_postings in [(1, 2), (4, 4), (8, 16), (32, 64)]:
+        template = make_template(n_args, n_postings)
+        arg_map = make_args(template)
+        compiled = CompiledTemplate(template)
+        assert compiled.render(arg_map) == render_replace(template, arg_map)
+        legacy = min(timeit.repeat(lambda: render_replace(template, arg_map), number=number, repeat=3))
+        fast = min(timeit.repeat(lambda: compiled.render(arg_map), number=number, repeat=3))
+        click.echo(f'{n_args:>6} {n_postings:>9} {legacy / number * 1e6:>14.2f} {fast / number * 1e6:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Replay Telegram updates against a webhook receiver, without Telegram.
+
+Start the bot in webhook mode with `bot.webhook.url: null`, then:
+
+    python benchmark/webhook_replay.py --url http://127.0.0.1:8443/ --secret TOKEN --updates updates.jsonl
+
+updates.jsonl contains one recorded update per line. Without --updates, text messages are generated
+from --text for --users users. Replies of the bot go to the configured Bot API server and are not
+measured here; this measures how fast the receiver accepts updates.
+"""
+import asyncio
+import itertools
+import json
+import time
+from typing import List
+
+import aiohttp
+import click
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def load_updates(path: str) -> List[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def generate_updates(count: int, users: int, text: str) -> List[dict]:
+    updates = []
+    for i in range(count):
+        uid = 10000 + i % users
+        updates.append({
+            'update_id': i + 1,
+            'message': {
+                'message_id': i + 1,
+                'date': int(time.time()),
+                'text': text,
+                'chat': {'id': uid, 'type': 'private'},
+                'from': {'id': uid, 'is_bot': False, 'first_name': f'user{uid}'},
+            },
+        })
+    return updates
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def replay(url: str, secret: str, updates: List[dict], concurrency: int):
+    headers = {SECRET_HEADER: secret} if secret else {}
+    latencies = []
+    errors = 0
+    feed = iter(updates)
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        for update in feed:
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession() as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+@click.command()
+@click.option('--url', default='http://127.0.0.1:8443/', help='Webhook URL')
+@click.option('--secret', default='', help='Secret token')
+@click.option('--updates', 'updates_file', default=None, help='Recorded updates, one JSON per line')
+@click.option('--count', default=1000, help='Number of updates to send')
+@click.option('--users', default=10, help='Number of simulated users for generated updates')
+@click.option('--text', default='vultr', help='Message text of generated updates')
+@click.option('--concurrency', default=16, help='Concurrent connections')
+def main(url, secret, updates_file, count, users, text, concurrency):
+    if updates_file is not None:
+        updates = load_updates(updates_file)
+        updates = list(itertools.islice(itertools.cycle(updates), count))
+    else:
+        updates = generate_updates(count, users, text)
+    latencies, errors, elapsed = asyncio.run(replay(url, secret, updates, concurrency))
+    click.echo(f'updates:    {len(latencies)} ({errors} non-200)')
+    click.echo(f'throughput: {len(latencies) / elapsed:.1f} updates/s')
+    click.echo(f'latency:    p50 {percentile(latencies, 0.5) * 1000:.2f} ms, '
+               f'p99 {percentile(latencies, 0.99) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
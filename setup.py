@@ -19,7 +19,11 @@ setup(
         ]
     },
     install_requires=install_requires,
-    python_requires='>=3.6.0',
+    extras_require={
+        'async': ['aiohttp'],
+        'benchmark': ['pytest-benchmark'],
+    },
+    python_requires='>=3.7.0',
     license='MIT',
     author='KAAAsS',
     author_email='admin@kaaass.net',
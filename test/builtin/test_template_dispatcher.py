@@ -1,13 +1,76 @@
 import datetime
 import os.path
+import random
+import tempfile
 import unittest
+from typing import List
 
 from beancount_bot import transaction
 from beancount_bot.builtin.template_dispatcher import TemplateDispatcher, split_command
+from beancount_bot.i18n import _
 from beancount_bot.transaction import NotMatchException
 
 PATH = os.path.split(os.path.realpath(__file__))[0]
 
+# 原状态机实现，作为 split_command 的参照
+_CH_CLASS = [' ', '\"', '\\', '<']
+_STATE_MAT = [
+    # Empty, ", \, <, other characters
+    [0, 2, -1, 4, 1],  # 0: Space
+    [0, 2, -1, 4, 1],  # 1: word
+    [2, 0, 3, 2, 2],  # 2: String
+    [2, 2, 2, 2, 2],  # 3: Escape
+    [0, 2, -1, -1, 1],  # 4: symbol
+]
+
+
+def split_command_reference(cmd):
+    state = 0
+    words: List[str] = []
+
+    for i in range(len(cmd)):
+        ch = cmd[i]
+        # Character class
+        if ch in _CH_CLASS:
+            ch_class = _CH_CLASS.index(ch)
+        else:
+            ch_class = 4
+        # State transfer
+        state, old_state = _STATE_MAT[state][ch_class], state
+        if state == -1:
+            raise ValueError(_("Location {pos}：Grammatical errors!Should not appear {ch}.").format(pos=i, ch=ch))
+        # 进入事件
+        if state != old_state and old_state != 3:
+            if state in [1, 2, 4]:
+                words.append('')
+            if state in [2, 3]:
+                continue
+        # Status event
+        if state != 0:
+            words[-1] += ch
+    if state not in [0, 1, 4]:
+        raise ValueError(_("Location {pos}：Grammatical errors!String, the escape is not over.").format(pos=len(cmd)))
+    return words
+
+
+def _split_or_error(split, cmd):
+    try:
+        return split(cmd)
+    except ValueError as e:
+        return e.args[0]
+
+
+def _load_templates(templates: str) -> TemplateDispatcher:
+    with tempfile.NamedTemporaryFile('w', suffix='.yml', encoding='utf-8', delete=False) as f:
+        f.write("config:\n"
+                "  accounts: {}\n"
+                "  default_account: 'Assets:Cash'\n"
+                "templates:\n" + templates)
+    try:
+        return TemplateDispatcher(f.name)
+    finally:
+        os.remove(f.name)
+
 
 class TestTemplateDispatcher(unittest.TestCase):
 
@@ -18,6 +81,8 @@ class TestTemplateDispatcher(unittest.TestCase):
         self.assertFalse(d.quick_check('咖'))
         self.assertTrue(d.quick_check('饭     4.00'))
         self.assertTrue(d.quick_check('咖啡 123'))
+        self.assertFalse(d.quick_check(''))
+        self.assertFalse(d.quick_check('   '))
 
     def test_split_command(self):
         cases = [
@@ -54,6 +119,15 @@ class TestTemplateDispatcher(unittest.TestCase):
             except ValueError as e:
                 self.assertIn(str(pos), e.args[0])
 
+    def test_split_command_differential(self):
+        rand = random.Random(20211201)
+        alphabet = [' ', ' ', '"', '\\', '<', 'a', '1', '饮', '\t', '\n']
+        for _i in range(20000):
+            cmd = ''.join(rand.choice(alphabet) for _j in range(rand.randint(0, 12)))
+            self.assertEqual(_split_or_error(split_command, cmd),
+                             _split_or_error(split_command_reference, cmd),
+                             repr(cmd))
+
     def test_process_simple(self):
         today = datetime.date.today().isoformat()
         cases = [
@@ -65,16 +139,17 @@ class TestTemplateDispatcher(unittest.TestCase):
              f'{today} * "Vultr" "月费"\n'
              '  Assets:Digital:Wechat\n'
              '  Expenses:Tech:Cloud    5 USD\n'),
+            # 模板输出原样保留
             ('饮料 3.0',
-             f'{today} * "饮料"\n'
+             f'{today} * "" "饮料"\n'
              '  Assets:Digital:Alipay\n'
              '  Expenses:Food:Drink    3.0 CNY\n'),
             ('饮料 3.23<zfb',
-             f'{today} * "饮料"\n'
+             f'{today} * "" "饮料"\n'
              '  Assets:Digital:Alipay\n'
              '  Expenses:Food:Drink    3.23 CNY\n'),
             ('饮 3.1<wx',
-             f'{today} * "饮"\n'
+             f'{today} * "" "饮"\n'
              '  Assets:Digital:Wechat\n'
              '  Expenses:Food:Drink    3.1 CNY\n'),
         ]
@@ -129,3 +204,118 @@ class TestTemplateDispatcher(unittest.TestCase):
         self.assertIn(expense, ret)
         self.assertIn('"KFC" "饭"', ret)
         print(ret)
+
+    def test_computed(self):
+        d = _load_templates("  - command: 'year'\n"
+                            "    computed:\n"
+                            "      year: datetime.date.today().year\n"
+                            "      price: Decimal('1.50') * 2\n"
+                            "    template: |\n"
+                            "      {date} * \"{year}\"\n"
+                            "        {account}\n"
+                            "        Expenses:Food  {price} CNY\n")
+        ret = transaction.stringfy(d.process('year'))
+        self.assertIn(f'"{datetime.date.today().year}"', ret)
+        self.assertIn('3.00 CNY', ret)
+
+    def test_computed_import(self):
+        d = _load_templates("  - command: 'year'\n"
+                            "    computed:\n"
+                            "      year: __import__('datetime').date.today().year\n"
+                            "    template: |\n"
+                            "      {date} * \"{year}\"\n"
+                            "        {account}\n"
+                            "        Expenses:Food  1 CNY\n"
+                            "  - command: 'cwd'\n"
+                            "    computed:\n"
+                            "      cwd: __import__('os').getcwd()\n"
+                            "    template: |\n"
+                            "      {date} * \"{cwd}\"\n"
+                            "        {account}\n"
+                            "        Expenses:Food  1 CNY\n")
+        self.assertEqual(d.process('year').narration, str(datetime.date.today().year))
+        self.assertRaises(ImportError, d.process, 'cwd')
+
+    def test_computed_syntax_error(self):
+        try:
+            _load_templates("  - command: 'bad'\n"
+                            "    computed:\n"
+                            "      hour: datetime.datetime.now(.hour\n"
+                            "    template: '{hour}'\n")
+            self.fail("未发生错误")
+        except ValueError as e:
+            self.assertIn('bad', e.args[0])
+            self.assertIn('hour', e.args[0])
+
+    def test_render(self):
+        d = _load_templates("  - command: 'buy'\n"
+                            "    args: ['payee', 'price']\n"
+                            "    template: |\n"
+                            "      {date} * \"{payee}\" \"{command}\"\n"
+                            "        {account}\n"
+                            "        Assets:Stock  1 HOOL {{price} USD}\n")
+        # 参数值中的占位符不应再被替换
+        ret = d._process_raw('buy "{price}" 500')
+        self.assertIn('"{price}" "buy"', ret)
+        self.assertIn('1 HOOL {500 USD}', ret)
+
+    def test_skeleton(self):
+        d = _load_templates("  - command: 'buy'\n"
+                            "    args: ['payee', 'price']\n"
+                            "    template: |\n"
+                            "      {date} * \"{payee}\" \"{command}\"\n"
+                            "        {account}\n"
+                            "        Assets:Stock  1 HOOL {{price} USD}\n")
+        self.assertEqual(d._commands['buy'].check(), [])
+        try:
+            _load_templates("  - command: 'bad'\n"
+                            "    args: ['price']\n"
+                            "    template: |\n"
+                            "      {date} * \"bad\"\n"
+                            "        {account}  {price} USD USD\n")
+            self.fail("未发生错误")
+        except ValueError as e:
+            self.assertIn('bad', e.args[0])
+
+    def test_canonical_output(self):
+        d = _load_templates("  - command: 'tea'\n"
+                            "    args: ['price']\n"
+                            "    template: |\n"
+                            "      ; 注释不影响\n"
+                            "      {date} * \"Tea\"\n"
+                            "        {account}\n"
+                            "        Expenses:Food   {price}   CNY ; 原样\n"
+                            "  - command: 'coffee'\n"
+                            "    args: ['price']\n"
+                            "    template: |\n"
+                            "      {date} * \"Coffee\"\n"
+                            "        {account}\n"
+                            "        Expenses:Food   {price}   CNY ; 原样\n")
+        today = datetime.date.today().isoformat()
+        # 模板文本原样写入
+        self.assertEqual(transaction.stringfy(d.process('coffee 3')),
+                         f'{today} * "Coffee"\n  Assets:Cash\n  Expenses:Food   3   CNY ; 原样\n')
+        # 首行不是交易头时由 beancount 输出
+        self.assertTrue(transaction.stringfy(d.process('tea 3')).startswith(f'{today} * "Tea"\n'))
+
+    def test_complete(self):
+        d = TemplateDispatcher(os.path.join(PATH, 'template_config.yml'))
+        self.assertEqual([c.text for c in d.complete('饮')], ['饮', '饮料'])
+        self.assertEqual(d.complete('饮料')[0].title, '(饮料|饮|咖啡) price [seller]')
+        self.assertEqual([c.text for c in d.complete('饮料 20 <z')], ['饮料 20 <zfb'])
+        self.assertEqual([c.title for c in d.complete('饮料 20')], ['(饮料|饮|咖啡) price [seller]'])
+        self.assertEqual(d.complete('不存在 20'), [])
+        # 缺少参数时仅填入输入框
+        self.assertEqual([c.partial for c in d.complete('饮')], [True, True])
+        self.assertTrue(d.complete('饮料 <z')[0].partial)
+        self.assertFalse(d.complete('饮料 20')[0].partial)
+        self.assertFalse(d.complete('vultr')[0].partial)
+
+    def test_render_undefined(self):
+        try:
+            _load_templates("  - command: 'bad'\n"
+                            "    args: ['price']\n"
+                            "    template: '{date} {prise}'\n")
+            self.fail("未发生错误")
+        except ValueError as e:
+            self.assertIn('prise', e.args[0])
@@ -0,0 +1,81 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from beancount_bot.accounts import AccountTrie, AccountIndex
+from beancount_bot.dispatcher import Dispatcher
+from beancount_bot.ledger import Ledger
+from beancount_bot.transaction import TransactionManager
+
+
+class TestAccountTrie(unittest.TestCase):
+
+    def setUp(self):
+        self.trie = AccountTrie()
+        for account in ['Assets:Cash', 'Expenses:Food:Drink', 'Expenses:Food:Dinner', 'Expenses:Tech:Cloud']:
+            self.trie.add(account, datetime.date(2020, 1, 1))
+        self.trie.add('Assets:Old', datetime.date(2020, 1, 1), datetime.date(2021, 1, 1))
+
+    def test_is_open(self):
+        self.assertTrue(self.trie.is_open('Expenses:Food:Drink', datetime.date(2021, 1, 1)))
+        self.assertFalse(self.trie.is_open('Expenses:Food', datetime.date(2021, 1, 1)))
+        self.assertFalse(self.trie.is_open('Expenses:Food:Drink', datetime.date(2019, 1, 1)))
+        self.assertTrue(self.trie.is_open('Assets:Old', datetime.date(2020, 12, 31)))
+        # beancount 将同一天的 Close 排在交易之后
+        self.assertTrue(self.trie.is_open('Assets:Old', datetime.date(2021, 1, 1)))
+        self.assertFalse(self.trie.is_open('Assets:Old', datetime.date(2021, 1, 2)))
+
+    def test_accounts(self):
+        self.assertEqual(list(self.trie.accounts('Expenses:Food')), ['Expenses:Food:Dinner', 'Expenses:Food:Drink'])
+        self.assertEqual(self.trie.size, 5)
+
+    def test_suggest(self):
+        self.assertEqual(self.trie.suggest('Expenses:Fod:Drink'), ['Expenses:Food:Drink'])
+        self.assertEqual(self.trie.suggest('Expenses:Tech:Clod'), ['Expenses:Tech:Cloud'])
+        self.assertEqual(self.trie.suggest('Income:Salary'), [])
+
+
+class TestAccountIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.main_ledger = os.path.join(self.tmp_dir.name, 'main.bean')
+        with open(self.main_ledger, 'w', encoding='utf-8') as f:
+            f.write('include "accounts/*.bean"\n')
+        os.mkdir(os.path.join(self.tmp_dir.name, 'accounts'))
+        self.write_accounts('a.bean', '2020-01-01 open Assets:Cash\n2020-01-01 open Expenses:Food:Drink\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_accounts(self, name: str, text: str):
+        with open(os.path.join(self.tmp_dir.name, 'accounts', name), 'a', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_validate(self):
+        class MockDispatcher(Dispatcher):
+            def _process_raw(self, input_str: str) -> str:
+                return f'''
+                2021-01-01 * "Payee" "Desc"
+                  Assets:Cash
+                  {input_str}  1 CNY
+                '''
+
+        accounts = AccountIndex(self.main_ledger, Ledger())
+        bean_file = os.path.join(self.tmp_dir.name, 'bot.bean')
+        manager = TransactionManager([MockDispatcher()], bean_file, accounts=accounts)
+        manager.create_from_str('Expenses:Food:Drink')
+        try:
+            manager.create_from_str('Expenses:Fod:Drink')
+            self.fail("未发生错误")
+        except ValueError as e:
+            self.assertIn('Expenses:Food:Drink', e.args[0])
+        with open(bean_file, 'r', encoding='utf-8') as f:
+            self.assertNotIn('Fod', f.read())
+        # 新增账户
+        self.write_accounts('b.bean', '2020-01-01 open Expenses:Tech:Cloud\n')
+        self.write_accounts('a.bean', '2020-06-01 close Assets:Cash\n')
+        trie = accounts.refresh(force=True)
+        self.assertTrue(trie.is_open('Expenses:Tech:Cloud', datetime.date(2021, 1, 1)))
+        self.assertRaises(ValueError, manager.create_from_str, 'Expenses:Tech:Cloud')
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from beancount_bot import bot
+from beancount_bot.completion import Completion
+from beancount_bot.dispatcher import Dispatcher, NotMatchException
+from beancount_bot.transaction import TransactionManager
+
+
+class LineDispatcher(Dispatcher):
+    """
+    One statement per line, or several lines starting with 'multi'
+    """
+
+    def _process_raw(self, input_str: str) -> str:
+        lines = input_str.split('\n')
+        if (len(lines) > 1) != (lines[0] == 'multi'):
+            raise NotMatchException()
+        if lines[0] == 'bad':
+            raise ValueError('bad line')
+        return f'''
+        2010-01-01 * "Payee" "{' '.join(lines)}"
+          Income:Unknown
+          Assets:Unknown  1 CNY
+        '''
+
+
+class TestCreateLines(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manager = TransactionManager([LineDispatcher()], os.path.join(self.tmp_dir.name, 'bot.bean'))
+        for patcher in [mock.patch.object(bot, 'get_manager', return_value=self.manager),
+                        mock.patch.object(bot, 'get_config', side_effect=lambda key, default=None: default)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_batch(self):
+        single, batch_uuid, results = bot.create_lines('a\nb')
+        self.assertIsNone(single)
+        self.assertIsNotNone(batch_uuid)
+        self.assertEqual([r.tx.narration for r in results], ['a', 'b'])
+
+    def test_single_statement(self):
+        # 按行解析失败，整体为一条交易
+        single, batch_uuid, results = bot.create_lines('multi\nline\nend')
+        self.assertIsNone(batch_uuid)
+        self.assertEqual(single[1].narration, 'multi line end')
+
+    def test_errors(self):
+        single, batch_uuid, results = bot.create_lines('a\nbad')
+        self.assertIsNone(single)
+        self.assertIsNone(batch_uuid)
+        self.assertEqual([r.error for r in results], [None, 'bad line'])
+
+
+class TestInlineResults(unittest.TestCase):
+
+    def test_partial(self):
+        whole, partial = bot.inline_results([Completion('vultr', 'vultr'), Completion('饮料', '饮料 price', partial=True)])
+        self.assertEqual(whole.input_message_content.message_text, 'vultr')
+        self.assertIsNone(whole.reply_markup)
+        # 不发送不完整的语句，按钮将其填回输入框
+        self.assertEqual(partial.input_message_content.message_text, '饮料 price')
+        button = partial.reply_markup.keyboard[0][0]
+        self.assertEqual(button.switch_inline_query_current_chat, '饮料 ')
@@ -0,0 +1,20 @@
+import unittest
+
+from beancount_bot.completion import PrefixTrie
+
+
+class TestPrefixTrie(unittest.TestCase):
+
+    def test_complete(self):
+        trie = PrefixTrie([('drink', 1), ('dinner', 2), ('rice', 3), ('drink', 4), ('饮料', 5), ('饮', 6)])
+        self.assertEqual(trie.complete('d'), [2, 1, 4])
+        self.assertEqual(trie.complete('dr'), [1, 4])
+        self.assertEqual(trie.complete('drinks'), [])
+        self.assertEqual(trie.complete(''), [2, 1, 4, 3, 6, 5])
+        self.assertEqual(trie.complete('饮'), [6, 5])
+        self.assertEqual(trie.complete('', 2), [2, 1])
+
+    def test_limit(self):
+        trie = PrefixTrie(((f'cmd{i:04d}', i) for i in range(1000)), limit=50)
+        self.assertEqual(trie.complete('cmd'), list(range(50)))
+        self.assertEqual(trie.complete('cmd09'), list(range(900, 950)))
@@ -1,5 +1,7 @@
 import unittest
 
+from beancount.parser import parser
+
 from beancount_bot import transaction
 from beancount_bot.dispatcher import Dispatcher
 
@@ -14,3 +16,53 @@ class TestDispatcher(unittest.TestCase):
                          '2010-01-01 * "Payee" "Desc"\n'
                          '  Assets:Unknown\n'
                          '  Expenses:Unknown  1 CNY\n')
+
+    def test_process_braces(self):
+        class MockDispatcher(Dispatcher):
+            def _process_raw(self, input_str: str) -> str:
+                return '''
+                2010-01-01 * "Payee" "{input_str}"
+                  Assets:Unknown
+                  Assets:Stock  1 HOOL {500 USD}
+                '''
+
+        tx = MockDispatcher().process('')
+        self.assertEqual(tx.narration, '{input_str}')
+        self.assertEqual(len(tx.postings), 2)
+
+    def test_process_canonical(self):
+        class MockDispatcher(Dispatcher):
+            canonical_output = True
+
+            def _process_raw(self, input_str: str) -> str:
+                return '''
+                2010-01-01 * "Payee" "Desc"
+                  Assets:Unknown
+                  Expenses:Unknown      1   CNY ; 原样输出
+                '''
+
+        tx = MockDispatcher().process('')
+        self.assertEqual(transaction.stringfy(tx),
+                         '2010-01-01 * "Payee" "Desc"\n'
+                         '  Assets:Unknown\n'
+                         '  Expenses:Unknown      1   CNY ; 原样输出\n')
+
+    def test_process_canonical_comment(self):
+        class MockDispatcher(Dispatcher):
+            canonical_output = True
+
+            def _process_raw(self, input_str: str) -> str:
+                return '''
+                ; 注释
+                2010-01-01 * "Payee" "Desc"
+                  Assets:Unknown
+                  Expenses:Unknown      1   CNY
+                '''
+
+        tx = MockDispatcher().process('')
+        # 首行不是交易头时由 beancount 输出，控制元数据位于交易头之后
+        text, __ = transaction._to_text('uuid', tx)
+        self.assertTrue(text.startswith('2010-01-01 * "Payee" "Desc"\n'))
+        entries, errors, __ = parser.parse_string(text)
+        self.assertEqual(errors, [])
+        self.assertEqual(entries[0].meta[transaction.META_UUID], 'uuid')
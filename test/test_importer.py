@@ -0,0 +1,102 @@
+import io
+import os
+import tempfile
+import unittest
+
+from beancount.parser import parser
+
+from beancount_bot import importer
+from beancount_bot.dispatcher import Dispatcher
+from beancount_bot.builtin.template_dispatcher import split_command
+from beancount_bot.transaction import TransactionManager
+
+OFX = b'''OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20211231120000[-5:EST]
+<TRNAMT>-5.00
+<FITID>0001
+<NAME>Coffee "Shop"
+</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>20220101</DTPOSTED><TRNAMT>-12.50</TRNAMT><FITID>0002</FITID>
+<NAME>Lunch</NAME></STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+'''
+
+
+class MockDispatcher(Dispatcher):
+
+    def _process_raw(self, input_str: str) -> str:
+        words = split_command(input_str)
+        if words[0] != 'import':
+            raise ValueError('bad statement')
+        payee = words[1].replace('"', '\\"')
+        return f'''
+        2010-01-01 * "{payee}"
+          Assets:Unknown
+          Expenses:Unknown  {-float(words[2]):.2f} USD
+        '''
+
+
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w+b', suffix='.bean', delete=False) as f:
+            self.tmp_file = f.name
+        self.manager = TransactionManager([MockDispatcher()], self.tmp_file)
+
+    def tearDown(self):
+        os.remove(self.tmp_file)
+
+    def test_read_ofx(self):
+        # 小块读取，标签跨越读取边界
+        importer.READ_SIZE, read_size = 7, importer.READ_SIZE
+        try:
+            rows = list(importer.read_ofx(io.BytesIO(OFX)))
+        finally:
+            importer.READ_SIZE = read_size
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['NAME'], 'Coffee "Shop"')
+        self.assertEqual(rows[0]['DTPOSTED'], '20211231120000[-5:EST]')
+        self.assertEqual(rows[1]['TRNAMT'], '-12.50')
+        self.assertEqual(rows[1]['NAME'], 'Lunch')
+
+    def test_read_csv(self):
+        data = '账户,招商银行\n日期,金额,摘要\n2022-01-02,-3.00,咖啡\n'.encode('utf-8')
+        rows = list(importer.read_csv(io.BytesIO(data), skip_lines=1))
+        self.assertEqual(rows, [{'日期': '2022-01-02', '金额': '-3.00', '摘要': '咖啡'}])
+
+    def test_run(self):
+        statement_importer = importer.StatementImporter(self.manager, 'import "{NAME}" {TRNAMT}',
+                                                        date_field='DTPOSTED', batch_size=1)
+        first = statement_importer.run(importer.read_ofx(io.BytesIO(OFX)))
+        self.assertEqual((first.rows, first.imported, first.failed), (2, 2, 0))
+        self.assertEqual(len(first.batches), 2)
+        entries, errors, __ = parser.parse_file(self.tmp_file)
+        self.assertEqual(errors, [])
+        self.assertEqual([(str(e.date), e.narration) for e in entries],
+                         [('2021-12-31', 'Coffee "Shop"'), ('2022-01-01', 'Lunch')])
+        # 重复导入
+        report = statement_importer.run(importer.read_ofx(io.BytesIO(OFX)))
+        self.assertEqual((report.rows, report.imported, report.duplicates), (2, 0, 2))
+        # 撤回批次
+        self.manager.remove(first.batches[0])
+        entries, __, __ = parser.parse_file(self.tmp_file)
+        self.assertEqual(len(entries), 1)
+
+    def test_run_errors(self):
+        data = b'date,amount,name\n2022-01-02,-3.00,a\n2022-01-02,-3.00,a\nbad,-1,b\n2022-01-03,-1,c\n'
+        statement_importer = importer.StatementImporter(self.manager, 'import "{name}" {amount}',
+                                                        date_field='date')
+        report = statement_importer.run(importer.read_csv(io.BytesIO(data)))
+        # 相同的行仍分别导入
+        self.assertEqual((report.rows, report.imported, report.failed), (4, 3, 1))
+        self.assertEqual(report.errors[0][0], 3)
+        report = importer.StatementImporter(self.manager, 'import "{missing}" {amount}').run(
+            importer.read_csv(io.BytesIO(data)))
+        self.assertEqual(report.imported, 0)
+        self.assertIn('missing', report.errors[0][1])
+
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from beancount_bot.journal import GroupCommitWriter
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w+b', suffix='.bean', delete=False) as f:
+            self.tmp_file = f.name
+            f.write(b'; header\n')
+
+    def tearDown(self):
+        os.remove(self.tmp_file)
+
+    def test_append(self):
+        writer = GroupCommitWriter()
+        start = writer.append(self.tmp_file, b'; a\n')
+        self.assertEqual(start, 9)
+        self.assertEqual(writer.append(self.tmp_file, b'; b\n'), 13)
+
+    def test_group_commit(self):
+        writer = GroupCommitWriter(window=0.05, max_batch_size=8)
+        offsets = {}
+
+        def append(i):
+            offsets[i] = writer.append(self.tmp_file, f'; {i:02d}\n'.encode('utf-8'))
+
+        with mock.patch('os.fsync', wraps=os.fsync) as fsync:
+            threads = [threading.Thread(target=append, args=(i,)) for i in range(16)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # 16 次写入应合并为少数几次提交
+            self.assertLess(fsync.call_count, 16)
+
+        with open(self.tmp_file, 'rb') as f:
+            data = f.read()
+        for i, start in offsets.items():
+            self.assertEqual(data[start:start + 5], f'; {i:02d}\n'.encode('utf-8'))
+
+    def test_error(self):
+        writer = GroupCommitWriter()
+        self.assertRaises(OSError, writer.append, os.path.join(self.tmp_file, 'not_dir'), b'; a\n')
+        # 出错后仍可继续写入
+        self.assertEqual(writer.append(self.tmp_file, b'; a\n'), 9)
+
+    def test_handle_pool(self):
+        writer = GroupCommitWriter(max_open_files=1)
+        with mock.patch('builtins.open', wraps=open) as mock_open:
+            writer.append(self.tmp_file, b'; a\n')
+            writer.append(self.tmp_file, b'; b\n')
+            self.assertEqual(mock_open.call_count, 1)
+        # 文件被替换后应重新打开
+        with open(self.tmp_file + '.new', 'wb') as f:
+            f.write(b'; new\n')
+        os.replace(self.tmp_file + '.new', self.tmp_file)
+        self.assertEqual(writer.append(self.tmp_file, b'; c\n'), 6)
+        with open(self.tmp_file, 'rb') as f:
+            self.assertEqual(f.read(), b'; new\n; c\n')
+        writer.close()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+from beancount_bot.ledger import Ledger
+
+TX = '''2010-01-01 * "{narration}"
+  Income:Unknown
+  Assets:Unknown  1 CNY
+
+'''
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w+b', suffix='.bean', delete=False) as f:
+            self.tmp_file = f.name
+            f.write(TX.format(narration='a').encode('utf-8'))
+
+    def tearDown(self):
+        os.remove(self.tmp_file)
+
+    def append(self, text: str):
+        with open(self.tmp_file, 'a', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_incremental(self):
+        ledger = Ledger()
+        entries, errors = ledger.load(self.tmp_file)
+        self.assertEqual([e.narration for e in entries], ['a'])
+        # 追加只解析新内容，行号连续
+        self.append(TX.format(narration='b'))
+        entries, errors = ledger.load(self.tmp_file)
+        self.assertEqual([e.narration for e in entries], ['a', 'b'])
+        self.assertEqual(entries[1].meta['lineno'], 5)
+        self.assertEqual(entries[1].postings[1].meta['lineno'], 7)
+        self.assertEqual((ledger.full_parses, ledger.tail_parses), (1, 1))
+        # 未变化时不解析
+        ledger.load(self.tmp_file)
+        self.assertEqual((ledger.full_parses, ledger.tail_parses), (1, 1))
+
+    def test_incomplete_line(self):
+        ledger = Ledger()
+        ledger.load(self.tmp_file)
+        self.append('2010-01-02 * "c"\n  Income:Unknown\n  Assets:Unknown  1')
+        entries, errors = ledger.load(self.tmp_file)
+        self.assertEqual(len(entries), 2)
+        self.append(' CNY\n')
+        entries, errors = ledger.load(self.tmp_file)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(entries[1].postings), 2)
+
+    def test_edited(self):
+        self.append(TX.format(narration='b'))
+        ledger = Ledger()
+        ledger.load(self.tmp_file)
+        # 原地修改已解析内容
+        with open(self.tmp_file, 'r+b') as f:
+            f.write(b'2011')
+        self.append(TX.format(narration='c'))
+        entries, errors = ledger.load(self.tmp_file)
+        self.assertEqual([str(e.date) for e in entries], ['2011-01-01', '2010-01-01', '2010-01-01'])
+        self.assertEqual(ledger.full_parses, 2)
+        # 替换文件
+        with open(self.tmp_file + '.new', 'w', encoding='utf-8') as f:
+            f.write(TX.format(narration='c'))
+        os.replace(self.tmp_file + '.new', self.tmp_file)
+        entries, errors = ledger.load(self.tmp_file)
+        self.assertEqual([e.narration for e in entries], ['c'])
+        self.assertEqual(ledger.full_parses, 3)
@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+import urllib.request
+from unittest import mock
+
+from beancount_bot import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_render(self):
+        registry = metrics.Registry()
+        histogram = registry.histogram('test_seconds', 'Test', ['stage'], buckets=(0.1, 1.0))
+        counter = registry.counter('test_total', 'Test', ['stage'])
+        histogram.observe(0.05, 'a"b')
+        histogram.observe(0.5, 'a"b')
+        counter.inc('c')
+        text = registry.render()
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn('test_seconds_bucket{stage="a\\"b",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{stage="a\\"b",le="+Inf"} 2', text)
+        self.assertIn('test_seconds_count{stage="a\\"b"} 2', text)
+        self.assertIn('test_total{stage="c"} 1.0', text)
+
+    def test_timed(self):
+        @metrics.timed
+        def sync_handler():
+            raise ValueError()
+
+        @metrics.timed
+        async def async_handler():
+            return 1
+
+        # 未启用时不记录
+        self.assertRaises(ValueError, sync_handler)
+        self.assertEqual(metrics.HANDLER_SECONDS.count('sync_handler'), 0)
+        with mock.patch.object(metrics, 'enabled', True):
+            self.assertRaises(ValueError, sync_handler)
+            self.assertEqual(asyncio.run(async_handler()), 1)
+            with metrics.stage('test'):
+                pass
+        self.assertEqual(metrics.HANDLER_SECONDS.count('sync_handler'), 1)
+        self.assertEqual(metrics.HANDLER_ERRORS.get('sync_handler'), 1)
+        self.assertEqual(metrics.HANDLER_SECONDS.count('async_handler'), 1)
+        self.assertEqual(metrics.STAGE_SECONDS.count('test'), 1)
+
+    def test_server(self):
+        with mock.patch.object(metrics, '_instrument_telegram'):
+            server = metrics.start_server('127.0.0.1', 0)
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+            with urllib.request.urlopen(url) as response:
+                self.assertIn('# TYPE beancount_bot_handler_seconds histogram', response.read().decode('utf-8'))
+        finally:
+            server.shutdown()
+            server.server_close()
+            metrics.enabled = False
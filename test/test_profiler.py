@@ -0,0 +1,58 @@
+import marshal
+import os
+import tempfile
+import unittest
+
+from beancount_bot import profiler
+from beancount_bot.dispatcher import Dispatcher
+from beancount_bot.profiler import HotPathProfiler
+from beancount_bot.transaction import TransactionManager
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w+b', suffix='.bean', delete=False) as f:
+            self.tmp_file = f.name
+
+        class MockDispatcher(Dispatcher):
+            def _process_raw(self, input_str: str) -> str:
+                return f'''
+                2021-01-01 * "Payee" "{input_str}"
+                  Assets:Cash
+                  Expenses:Food  1 CNY
+                '''
+
+        self.manager = TransactionManager([MockDispatcher()], self.tmp_file)
+
+    def tearDown(self):
+        profiler.disable()
+        os.remove(self.tmp_file)
+
+    def test_sample(self):
+        hot_path = profiler.enable(sample_rate=1.0, capacity=2)
+        tx_uuid, __ = self.manager.create_from_str('a')
+        self.manager.create_from_str('b')
+        self.manager.remove(tx_uuid)
+        # 仅保留最近的记录
+        self.assertEqual([p.name for p in hot_path.snapshot()], ['create_from_str', 'remove'])
+        spans = [name for name, __ in hot_path.snapshot()[0].spans]
+        self.assertIn('parse', spans)
+        self.assertIn('append', spans)
+        report = hot_path.report()
+        self.assertIn('create_from_str', report)
+        self.assertIn('cumulative', report)
+        self.assertIsInstance(marshal.loads(hot_path.dump()), dict)
+
+    def test_not_sampled(self):
+        hot_path = profiler.enable(sample_rate=0.0)
+        self.manager.create_from_str('a')
+        self.assertEqual(hot_path.snapshot(), [])
+        self.assertEqual(hot_path.report(), 'No profile yet')
+
+    def test_spans_only(self):
+        hot_path = HotPathProfiler(sample_rate=1.0, use_cprofile=False)
+        with hot_path.sample('test'):
+            pass
+        self.assertIsNone(hot_path.dump())
+        self.assertEqual(hot_path.snapshot()[0].spans, [])
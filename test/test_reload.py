@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import schedule
+import yaml
+
+from beancount_bot import config as conf
+from beancount_bot.config import load_config
+from beancount_bot.reload import reload_config, ConfigWatcher, watched_files
+from beancount_bot.task import get_task
+from beancount_bot.transaction import get_manager
+
+PATH = os.path.split(os.path.realpath(__file__))[0]
+
+
+class TestReload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_file = os.path.join(self.tmp_dir.name, 'template.yml')
+        shutil.copy(os.path.join(PATH, 'builtin', 'template_config.yml'), self.template_file)
+        self.config_file = os.path.join(self.tmp_dir.name, 'beancount_bot.yml')
+        self.config = {
+            'transaction': {
+                'beancount_file': os.path.join(self.tmp_dir.name, 'bot.bean'),
+                'index_file': None,
+                'message_dispatcher': [{
+                    'class': 'beancount_bot.builtin.template_dispatcher.TemplateDispatcher',
+                    'args': {'template_config': self.template_file},
+                }],
+            },
+            'schedule': [{
+                'name': 'price',
+                'class': 'beancount_bot.builtin.DailyCommandTask',
+                'args': {'time': '02:00', 'commands': [], 'message': ''},
+            }],
+        }
+        self.write_config()
+        self.old_config_file = conf.config_file
+        conf.config_file = self.config_file
+        load_config()
+
+    def tearDown(self):
+        schedule.clear()
+        conf.config_file = self.old_config_file
+        self.tmp_dir.cleanup()
+
+    def write_config(self):
+        with open(self.config_file, 'w', encoding='utf-8') as f:
+            yaml.dump(self.config, f)
+
+    def test_unchanged(self):
+        manager, tasks = get_manager(), get_task()
+        self.assertEqual(reload_config(), [])
+        self.assertIs(get_manager(), manager)
+        self.assertIs(get_task()['price'], tasks['price'])
+        self.assertEqual(len(schedule.jobs), 1)
+
+    def test_task_changed(self):
+        manager, tasks = get_manager(), get_task()
+        self.config['schedule'][0]['args']['time'] = '03:00'
+        self.write_config()
+        self.assertEqual(reload_config(), ['task price'])
+        # 处理器未重建
+        self.assertIs(get_manager(), manager)
+        self.assertIsNot(get_task()['price'], tasks['price'])
+        self.assertEqual([str(job.at_time) for job in schedule.jobs], ['03:00:00'])
+
+    def test_template_changed(self):
+        manager = get_manager()
+        dispatcher = manager.dispatchers[0]
+        with open(self.template_file, 'a', encoding='utf-8') as f:
+            f.write("  - command: 'tea'\n    template: |\n      {date} * \"Tea\"\n        {account}\n"
+                    "        Expenses:Food:Drink    1 CNY\n")
+        changes = reload_config()
+        self.assertEqual(changes, ['dispatcher beancount_bot.builtin.template_dispatcher.TemplateDispatcher'])
+        new_manager = get_manager()
+        self.assertIsNot(new_manager.dispatchers[0], dispatcher)
+        self.assertIs(new_manager.writer, manager.writer)
+        # 旧对象保持一致的快照
+        self.assertIs(manager.dispatchers[0], dispatcher)
+        self.assertIn(self.template_file, watched_files())
+
+    def test_watcher(self):
+        watcher = ConfigWatcher(interval=0.01)
+        self.assertIsNone(watcher.check())
+        self.config['transaction']['commit_window'] = 0.0
+        self.write_config()
+        self.assertEqual(watcher.check(), ['transaction'])
+        self.assertIsNone(watcher.check())
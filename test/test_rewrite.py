@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from beancount_bot import rewrite
+
+
+class TestRewrite(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w+b', suffix='.bean', delete=False) as f:
+            self.tmp_file = f.name
+            self.data = bytes(range(256)) * 1000
+            f.write(self.data)
+
+    def tearDown(self):
+        os.remove(self.tmp_file)
+
+    def _assert_removed(self, start, end):
+        with open(self.tmp_file, 'rb') as f:
+            self.assertEqual(f.read(), self.data[:start] + self.data[end:])
+
+    def test_remove_span(self):
+        rewrite.remove_span(self.tmp_file, 1000, 2000)
+        self._assert_removed(1000, 2000)
+        # 临时文件应被清理
+        self.assertEqual(os.listdir(os.path.dirname(self.tmp_file)).count(os.path.basename(self.tmp_file)), 1)
+
+    def test_remove_span_fallback(self):
+        # 不支持内核复制时，使用固定缓冲区
+        with mock.patch.object(rewrite, '_copy_file_range', None), \
+                mock.patch.object(rewrite, '_sendfile', None), \
+                mock.patch.object(rewrite, 'BUFFER_SIZE', 1000):
+            rewrite.remove_span(self.tmp_file, 12345, 54321)
+        self._assert_removed(12345, 54321)
+
+    def test_remove_span_symlink(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            link = os.path.join(tmp_dir, 'ledger.bean')
+            os.symlink(self.tmp_file, link)
+            rewrite.remove_span(link, 1000, 2000)
+            # 替换链接指向的文件，链接保留
+            self.assertTrue(os.path.islink(link))
+            self._assert_removed(1000, 2000)
+
+    def test_atomic_open_failure(self):
+        try:
+            with rewrite.atomic_open(self.tmp_file) as f:
+                f.write(b'partial')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self._assert_removed(0, 0)
+
+    def test_line_span(self):
+        with open(self.tmp_file, 'wb') as f:
+            f.write('a\n饮料\nc\nd\n'.encode('utf-8'))
+        self.assertEqual(rewrite.line_span(self.tmp_file, 2, 3), (2, 11))
+        self.assertRaises(ValueError, rewrite.line_span, self.tmp_file, 4, 5)
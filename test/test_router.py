@@ -0,0 +1,80 @@
+import unittest
+
+from beancount_bot.dispatcher import Dispatcher, NotMatchException
+from beancount_bot.router import DispatcherRouter
+
+
+class MockDispatcher(Dispatcher):
+    route_by_token = True
+
+    def __init__(self, name, commands):
+        super().__init__()
+        self.name = name
+        self.commands = commands
+        self.calls = 0
+
+    def process(self, input_str: str):
+        self.calls += 1
+        if input_str.split()[0] not in self.commands:
+            raise NotMatchException()
+        return f'; {self.name} {input_str}'
+
+    def get_name(self) -> str:
+        return self.name
+
+
+class BangDispatcher(Dispatcher):
+    """
+    Rejects inputs ending with !, whatever the leading token
+    """
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def process(self, input_str: str):
+        if input_str.endswith('!'):
+            raise NotMatchException()
+        return f'; {self.name} {input_str}'
+
+    def get_name(self) -> str:
+        return self.name
+
+
+class TestDispatcherRouter(unittest.TestCase):
+
+    def test_route(self):
+        a = MockDispatcher('a', ['x'])
+        b = MockDispatcher('b', ['y'])
+        c = MockDispatcher('c', ['y', 'z'])
+        router = DispatcherRouter([a, b, c])
+        self.assertEqual(router.route('z 1'), '; c z 1')
+        self.assertEqual((a.calls, b.calls, c.calls), (1, 1, 1))
+        # 已知 a、b 不匹配 z，直接尝试 c
+        self.assertEqual(router.route('z 2'), '; c z 2')
+        self.assertEqual((a.calls, b.calls, c.calls), (1, 1, 2))
+        # b、c 冲突时保持优先级
+        self.assertEqual(router.route('y 1'), '; b y 1')
+        self.assertEqual(router.route('y 2'), '; b y 2')
+        self.assertEqual(c.calls, 2)
+        self.assertRaises(ValueError, router.route, 'w')
+        # 统计
+        self.assertEqual([s.hits for s in router.stats], [0, 2, 2])
+        self.assertEqual([s.misses for s in router.stats], [3, 2, 1])
+
+    def test_miss_not_by_token(self):
+        a = BangDispatcher('a')
+        b = MockDispatcher('b', ['x'])
+        router = DispatcherRouter([a, b])
+        self.assertEqual(router.route('x 1'), '; a x 1')
+        self.assertEqual(router.route('x 1!'), '; b x 1!')
+        # a 的不匹配不取决于首个单词，仍按优先级先尝试 a
+        self.assertEqual(router.route('x 2'), '; a x 2')
+
+    def test_cache_size(self):
+        a = MockDispatcher('a', ['x'])
+        b = MockDispatcher('b', [str(i) for i in range(10)])
+        router = DispatcherRouter([a, b], cache_size=4)
+        for i in range(10):
+            router.route(str(i))
+        self.assertEqual(len(router._routes), 4)
@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from beancount_bot import session
+from beancount_bot.config import set_global, GLOBAL_CONFIG
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w+b', suffix='.session', delete=False) as f:
+            self.tmp_file = f.name
+        os.remove(self.tmp_file)
+
+    def tearDown(self):
+        session.flush_session()
+        if os.path.exists(self.tmp_file):
+            os.remove(self.tmp_file)
+
+    def _configure(self, backend, flush_delay=1.0):
+        set_global(GLOBAL_CONFIG, {'bot': {
+            'session_file': self.tmp_file,
+            'session_backend': backend,
+            'session_flush_delay': flush_delay,
+        }})
+        session.load_session()
+
+    def test_json_write_behind(self):
+        self._configure('json', flush_delay=0.05)
+        session.set_session(1, session.SESS_AUTH, True)
+        session.set_session(2, 'key', 'value')
+        # 尚未写入
+        self.assertFalse(os.path.exists(self.tmp_file))
+        time.sleep(0.2)
+        with open(self.tmp_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {'1': {session.SESS_AUTH: True}, '2': {'key': 'value'}})
+
+    def test_json_flush(self):
+        self._configure('json', flush_delay=60)
+        session.set_session(1, session.SESS_AUTH, True)
+        session.flush_session()
+        self._configure('json')
+        self.assertEqual(list(session.all_user()), [1])
+
+    def test_sqlite(self):
+        self._configure('sqlite')
+        session.set_session(1, session.SESS_AUTH, True)
+        session.set_session(2, session.SESS_AUTH, False)
+        session.set_session(2, 'key', [1, 2])
+        # 重新加载
+        self._configure('sqlite')
+        self.assertEqual(list(session.all_user()), [1])
+        self.assertEqual(sorted(session.all_user(auth=False)), [1, 2])
+        self.assertEqual(session.get_session(2, 'key'), [1, 2])
+        self.assertEqual(dict(session.get_session_for(1)), {session.SESS_AUTH: True})
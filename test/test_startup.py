@@ -0,0 +1,37 @@
+import subprocess
+import sys
+import unittest
+
+from beancount_bot.startup import StartupProfile, phase
+
+
+class TestStartupProfile(unittest.TestCase):
+
+    def test_until_first_poll(self):
+        class MockBot:
+            def get_updates(self, offset=None):
+                return [offset]
+
+        reports = []
+        profile = StartupProfile(reports.append)
+        with phase(profile, 'config load'):
+            pass
+        with phase(None, 'not profiled'):
+            pass
+        bot = MockBot()
+        profile.until_first_poll(bot)
+        self.assertEqual(bot.get_updates(offset=1), [1])
+        self.assertEqual(bot.get_updates(offset=2), [2])
+        # 仅第一次轮询时输出
+        self.assertEqual(len(reports), 1)
+        self.assertEqual([line.split()[0] for line in reports[0].splitlines()], ['config', 'first', 'total'])
+
+    def test_lazy_imports(self):
+        code = 'import sys, beancount_bot.main; print(sorted({"telebot", "beancount", "schedule", "yaml"} & set(sys.modules)))'
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), '[]')
+
+    def test_entry_point(self):
+        code = 'import beancount_bot.main; from beancount_bot import main; print(type(main).__name__)'
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), 'Group')
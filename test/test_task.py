@@ -0,0 +1,111 @@
+import datetime
+import threading
+import time
+import unittest
+
+import schedule
+
+from beancount_bot.task import ScheduleTask, Scheduler
+
+
+class BlockingTask(ScheduleTask):
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.count = 0
+
+    def trigger(self, bot):
+        self.count += 1
+        self.started.set()
+        self.release.wait(5)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        schedule.clear()
+        self.scheduler = Scheduler(max_workers=2)
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.stop()
+        schedule.clear()
+
+    def add_due_job(self, task: ScheduleTask) -> schedule.Job:
+        job = schedule.every().day.at('00:00').do(self.scheduler.submit, task, None)
+        job.next_run = datetime.datetime.now()
+        return job
+
+    def assertRescheduled(self, job: schedule.Job):
+        deadline = time.monotonic() + 1
+        while job.next_run <= datetime.datetime.now():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_wake(self):
+        task = BlockingTask()
+        task.release.set()
+        # 线程已休眠，新增 job 后唤醒
+        time.sleep(0.05)
+        job = self.add_due_job(task)
+        self.scheduler.wake()
+        self.assertTrue(task.started.wait(1))
+        self.assertRescheduled(job)
+
+    def test_cancelled(self):
+        task = BlockingTask()
+        job = self.add_due_job(task)
+        schedule.cancel_job(job)
+        self.scheduler.wake()
+        self.assertFalse(task.started.wait(0.2))
+
+    def test_overlap(self):
+        task = BlockingTask()
+        self.assertTrue(self.scheduler.submit(task, None))
+        self.assertTrue(task.started.wait(1))
+        # 上次执行未结束
+        self.assertFalse(self.scheduler.submit(task, None))
+        task.release.set()
+        deadline = time.monotonic() + 1
+        while not self.scheduler.submit(task, None):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_manual_trigger(self):
+        task = BlockingTask()
+        self.assertTrue(self.scheduler.submit(task, None))
+        self.assertTrue(task.started.wait(1))
+        # 定时执行未结束时，手动触发不重复执行
+        self.assertFalse(self.scheduler.trigger(task, None))
+        task.release.set()
+        deadline = time.monotonic() + 1
+        while not self.scheduler.trigger(task, None):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(task.count, 2)
+
+    def test_slow_task_not_blocking(self):
+        slow, fast = BlockingTask(), BlockingTask()
+        fast.release.set()
+        self.add_due_job(slow)
+        self.add_due_job(fast)
+        self.scheduler.wake()
+        self.assertTrue(slow.started.wait(1))
+        self.assertTrue(fast.started.wait(1))
+        slow.release.set()
+
+    def test_failing_job(self):
+        task = BlockingTask()
+        task.release.set()
+        failing = schedule.every().day.at('00:00').do(lambda: 1 / 0)
+        failing.next_run = datetime.datetime.now()
+        self.add_due_job(task)
+        self.scheduler.wake()
+        self.assertTrue(task.started.wait(1))
+        self.assertRescheduled(failing)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,16 @@
+import datetime
+import os
 import tempfile
 import unittest
 import uuid
+from unittest import mock
+
+from beancount.parser import parser
 
 from beancount_bot import transaction
 from beancount_bot.dispatcher import Dispatcher
-from beancount_bot.transaction import TransactionManager
+from beancount_bot.index import Span, TransactionIndex
+from beancount_bot.transaction import TransactionManager, BeanFileResolver
 
 
 class TestTransactionManager(unittest.TestCase):
@@ -12,6 +18,12 @@ class TestTransactionManager(unittest.TestCase):
     def setUp(self):
         with tempfile.NamedTemporaryFile('w+b', suffix='.bean', delete=False) as f:
             self.tmp_file = f.name
+        self.index_file = self.tmp_file + '.index'
+
+    def tearDown(self):
+        for path in [self.tmp_file, self.index_file]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_create(self):
         # Mock
@@ -32,6 +44,10 @@ class TestTransactionManager(unittest.TestCase):
             self.assertIn(transaction.META_TIME, data)
             self.assertIn(transaction.META_UUID, data)
 
+        tx_uuid, created = manager.create(tx)
+        self.assertEqual(created.meta[transaction.META_UUID], tx_uuid)
+        self.assertIn(transaction.META_TIME, created.meta)
+        self.assertNotIn(transaction.META_UUID, tx.meta)
         tx_str = transaction.stringfy(tx)
         self.assertIn('2010-01-01 * "Payee" "Desc"\n', tx_str)
         self.assertIn('Income:Unknown\n', tx_str)
@@ -105,3 +121,140 @@ class TestTransactionManager(unittest.TestCase):
         self.assertNotIn(tx_uuid, data)
         self.assertIn(pre, data)
         self.assertIn(post, data)
+
+    def test_remove_indexed(self):
+        # Mock
+        class MockDispatcher(Dispatcher):
+            def _process_raw(self, input_str: str) -> str:
+                return f'''
+                2010-01-01 * "Payee" "{input_str}"
+                  Income:Unknown
+                  Assets:Unknown  1 CNY
+                '''
+
+        manager = TransactionManager([MockDispatcher()], self.tmp_file, self.index_file)
+        uuid_a, _ = manager.create_from_str('tx_a')
+        uuid_b, _ = manager.create_from_str('tx_b')
+        uuid_c, _ = manager.create_from_str('tx_c')
+        # 删除中间交易后，后续交易的位置应被修正
+        manager.remove(uuid_b)
+        # 索引持久化
+        manager = TransactionManager([MockDispatcher()], self.tmp_file, self.index_file)
+        delete_tx = manager.remove(uuid_c)
+        self.assertEqual(uuid_c, delete_tx.meta[transaction.META_UUID])
+
+        with open(self.tmp_file, 'r', encoding='utf-8') as f:
+            data = f.read()
+        self.assertIn('tx_a', data)
+        self.assertNotIn('tx_b', data)
+        self.assertNotIn('tx_c', data)
+        self.assertEqual(len(manager.index), 1)
+
+    def test_index_log(self):
+        index = TransactionIndex(self.index_file)
+        for i in range(10):
+            index.add(str(i), Span('a.bean', i * 10, i * 10 + 10, str(i)))
+        # 删除时追加记录，而不是重写
+        index.cut('3')
+        index.cut('5')
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 12)
+        reloaded = TransactionIndex(self.index_file)
+        self.assertEqual(reloaded._spans, index._spans)
+        self.assertEqual(reloaded.get('9'), Span('a.bean', 70, 80, '9'))
+        # 删除过多时压缩
+        for i in [0, 1, 2]:
+            index.cut(str(i))
+        with mock.patch.object(TransactionIndex, 'COMPACT_CUTS', 6):
+            index.cut('4')
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 4)
+        self.assertEqual(TransactionIndex(self.index_file).get('9'), Span('a.bean', 30, 40, '9'))
+
+    def test_remove_stale_index(self):
+        # Mock
+        class MockDispatcher(Dispatcher):
+            def _process_raw(self, input_str: str) -> str:
+                return '; comment'
+
+        manager = TransactionManager([MockDispatcher()], self.tmp_file, self.index_file)
+        tx_uuid, tx = manager.create_from_str('')
+        # 在交易前插入内容，使索引过期
+        with open(self.tmp_file, 'r', encoding='utf-8') as f:
+            data = f.read()
+        with open(self.tmp_file, 'w', encoding='utf-8') as f:
+            f.write('; edited outside\n' + data)
+        delete_tx = manager.remove(tx_uuid)
+        self.assertEqual(tx, delete_tx)
+
+        with open(self.tmp_file, 'r', encoding='utf-8') as f:
+            data = f.read()
+        self.assertEqual(data, '; edited outside\n')
+        self.assertNotIn(tx_uuid, manager.index)
+
+    def test_create_batch(self):
+        # Mock
+        class MockDispatcher(Dispatcher):
+            def _process_raw(self, input_str: str) -> str:
+                if input_str == 'bad':
+                    raise ValueError('bad line')
+                return f'''
+                2010-01-01 * "Payee" "{input_str}"
+                  Income:Unknown
+                  Assets:Unknown  1 CNY
+                '''
+
+        manager = TransactionManager([MockDispatcher()], self.tmp_file, self.index_file)
+        # 全部成功或全部失败
+        batch_uuid, results = manager.create_batch_from_str('tx_a\nbad\n\ntx_b')
+        self.assertIsNone(batch_uuid)
+        self.assertEqual([(r.lineno, r.error) for r in results], [(1, None), (2, 'bad line'), (4, None)])
+        with open(self.tmp_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(f.read(), '')
+        # 部分成功
+        batch_uuid, results = manager.create_batch_from_str('tx_a\nbad\n\ntx_b', partial=True)
+        self.assertIsNotNone(batch_uuid)
+        self.assertEqual(results[2].tx.narration, 'tx_b')
+        entries, errors, __ = parser.parse_file(self.tmp_file)
+        self.assertEqual(errors, [])
+        self.assertEqual([e.narration for e in entries], ['tx_a', 'tx_b'])
+        # 整批撤回
+        manager.remove(batch_uuid)
+        with open(self.tmp_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(f.read(), '')
+
+    def test_remove_batch_scan(self):
+        # Mock
+        class MockDispatcher(Dispatcher):
+            def _process_raw(self, input_str: str) -> str:
+                return f'''
+                2010-01-01 * "Payee" "{input_str}"
+                  Income:Unknown
+                  Assets:Unknown  1 CNY
+                '''
+
+        manager = TransactionManager([MockDispatcher()], self.tmp_file)
+        tx_uuid, _ = manager.create_from_str('single')
+        batch_uuid, _ = manager.create_batch_from_str('tx_a\ntx_b')
+        # 无索引时通过注释定位
+        manager = TransactionManager([MockDispatcher()], self.tmp_file)
+        manager.remove(batch_uuid)
+        entries, errors, __ = parser.parse_file(self.tmp_file)
+        self.assertEqual([e.narration for e in entries], ['single'])
+
+
+class TestBeanFileResolver(unittest.TestCase):
+
+    def test_resolve(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            resolver = BeanFileResolver(os.path.join(tmp, '{year}', '{month}.bean'))
+            now = datetime.datetime(2021, 12, 31, 23, 59).timestamp()
+            with mock.patch('time.time', return_value=now), mock.patch('os.makedirs', wraps=os.makedirs) as makedirs:
+                self.assertEqual(resolver.resolve(), os.path.join(tmp, '2021', '12.bean'))
+                self.assertEqual(resolver.resolve(), os.path.join(tmp, '2021', '12.bean'))
+                # 同一周期内只解析一次
+                self.assertEqual(makedirs.call_count, 1)
+            # 跨月
+            with mock.patch('time.time', return_value=now + 120):
+                self.assertEqual(resolver.resolve(), os.path.join(tmp, '2022', '01.bean'))
+            self.assertTrue(os.path.isdir(os.path.join(tmp, '2022')))
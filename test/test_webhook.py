@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import unittest
+
+try:
+    from aiohttp.test_utils import TestClient, TestServer
+    from beancount_bot import webhook
+except ImportError:
+    webhook = None
+
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1, 'date': 0, 'text': 'vultr',
+        'chat': {'id': 7, 'type': 'private'},
+        'from': {'id': 7, 'is_bot': False, 'first_name': 'user'},
+    },
+}
+
+
+def async_test(func):
+    """
+    Run a coroutine test in a new event loop, between start_client and close_client.
+    unittest.IsolatedAsyncioTestCase requires Python 3.8
+    """
+
+    @functools.wraps(func)
+    def wrapper(self):
+        async def run():
+            await self.start_client()
+            try:
+                await func(self)
+            finally:
+                await self.close_client()
+
+        asyncio.run(run())
+
+    return wrapper
+
+
+@unittest.skipIf(webhook is None, 'aiohttp is not installed')
+class TestWebhook(unittest.TestCase):
+
+    async def start_client(self):
+        self.received = []
+        self.release = asyncio.Event()
+
+        async def process_update(update):
+            # 模拟耗时处理，应答不应等待处理完成
+            await self.release.wait()
+            self.received.append(update)
+
+        app = webhook.create_app(process_update, '/hook', 'secret')
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def close_client(self):
+        self.release.set()
+        await self.client.close()
+
+    @async_test
+    async def test_secret_token(self):
+        resp = await self.client.post('/hook', json=UPDATE)
+        self.assertEqual(resp.status, 403)
+        resp = await self.client.post('/hook', json=UPDATE, headers={webhook.SECRET_HEADER: 'wrong'})
+        self.assertEqual(resp.status, 403)
+        self.assertEqual(self.received, [])
+
+    @async_test
+    async def test_update(self):
+        resp = await self.client.post('/hook', json=UPDATE, headers={webhook.SECRET_HEADER: 'secret'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(self.received, [])
+        # 后台处理完成
+        self.release.set()
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(self.received[0].message.text, 'vultr')
+
+    @async_test
+    async def test_bad_request(self):
+        resp = await self.client.post('/hook', data='not json', headers={webhook.SECRET_HEADER: 'secret'})
+        self.assertEqual(resp.status, 400)